@@ -0,0 +1,249 @@
+from pathlib import Path
+from tqdm import tqdm
+import numpy as np
+import argparse
+import json
+import os
+
+from utils import *
+from registry import *
+
+path = str(Path.cwd())
+
+default_store_dir = path + '/data/answer_store'
+
+def token_dtype(vocab):
+    """Returns the smallest signed integer type holding the token ids of a
+    vocabulary, the type of the token ids saved on disk and of the compact
+    training tensors. Torch has no unsigned 16 bit type.
+
+    Arguments:
+        vocab: Dictionary mapping token to id
+    """
+    # BERT vocabulary fits into 16 bit integers
+    return np.int16 if len(vocab) <= np.iinfo(np.int16).max else np.int32
+
+class AnswerStore():
+    """Memory-mapped store of the WordPiece token ids of every answer.
+
+    The token ids of all answers are concatenated in token_ids.npy and
+    offsets.npy holds the start of each answer, in the order of the sorted
+    docids in docids.npy.
+    """
+    def __init__(self, store_dir=default_store_dir):
+        """Opens the store.
+
+        Arguments:
+            store_dir: str - directory created by build_answer_store
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        # Longest answer in tokens kept in the store
+        self.max_answer_len = self.meta['max_answer_len']
+        self.token_ids = np.load(os.path.join(store_dir, 'token_ids.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, 'offsets.npy'))
+        self.docids = np.load(os.path.join(store_dir, 'docids.npy'))
+
+    def __len__(self):
+        return len(self.docids)
+
+    def __contains__(self, docid):
+        row = np.searchsorted(self.docids, docid)
+        return row < len(self.docids) and self.docids[row] == docid
+
+    def get_ids(self, docid):
+        """Returns the token ids of an answer.
+
+        Returns:
+            ids: Numpy array of token ids without special tokens
+        ----------
+        Arguments:
+            docid: int
+        """
+        row = np.searchsorted(self.docids, docid)
+        if row == len(self.docids) or self.docids[row] != docid:
+            raise KeyError(docid)
+
+        return self.token_ids[self.offsets[row]:self.offsets[row+1]]
+
+def load_answer_store(config):
+    """Opens the answer store given in the config.
+
+    Returns:
+        answer_store: AnswerStore object or None if no store is configured
+    ----------
+    Arguments:
+        config: Dictionary
+    """
+    if config.get('answer_store') is None:
+        return None
+
+    return AnswerStore(config['answer_store'])
+
+def build_answer_store(docid_to_text, tokenizer, max_answer_len, store_dir=default_store_dir):
+    """Tokenizes every answer once and saves the token ids truncated to
+    max_answer_len.
+
+    Arguments:
+        docid_to_text: Dictionary mapping docid to answer text
+        tokenizer: BERT tokenizer
+        max_answer_len: int - number of answer tokens to keep
+        store_dir: str - output directory
+    """
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    dtype = token_dtype(tokenizer.vocab)
+
+    docids = np.array(sorted(docid_to_text.keys()), dtype=np.int64)
+    offsets = np.zeros(len(docids) + 1, dtype=np.int64)
+    token_ids = []
+
+    for i, docid in enumerate(tqdm(docids)):
+        ids = tokenizer.encode(docid_to_text[docid], add_special_tokens=False)[:max_answer_len]
+        token_ids.append(np.array(ids, dtype=dtype))
+        offsets[i+1] = offsets[i] + len(ids)
+
+    np.save(os.path.join(store_dir, 'token_ids.npy'), np.concatenate(token_ids))
+    np.save(os.path.join(store_dir, 'offsets.npy'), offsets)
+    np.save(os.path.join(store_dir, 'docids.npy'), docids)
+
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump({'max_answer_len': max_answer_len,
+                   'num_answers': len(docids),
+                   'num_tokens': int(offsets[-1])}, f)
+
+def truncate_pair(q_len, a_len, max_seq_len):
+    """Computes the lengths of a QA pair after truncation with the
+    'longest_first' strategy of the BERT tokenizer, which removes one token
+    at a time from the longer sequence.
+
+    Returns:
+        q_len: int - number of question tokens kept
+        a_len: int - number of answer tokens kept
+    ----------
+    Arguments:
+        q_len: int - number of question tokens
+        a_len: int - number of answer tokens
+        max_seq_len: int - maximum length including [CLS] and 2 [SEP] tokens
+    """
+    num_to_remove = q_len + a_len + 3 - max_seq_len
+    if num_to_remove <= 0:
+        return q_len, a_len
+
+    # Shorten the longer sequence down to the length of the shorter one
+    if a_len >= q_len:
+        diff = min(num_to_remove, a_len - q_len)
+        a_len -= diff
+    else:
+        diff = min(num_to_remove, q_len - a_len)
+        q_len -= diff
+    num_to_remove -= diff
+    # Then alternate, starting with the answer
+    a_len -= (num_to_remove + 1) // 2
+    q_len -= num_to_remove // 2
+
+    return q_len, a_len
+
+class PairEncoder():
+    """Encodes QA pairs into BERT inputs. Answers are taken from an
+    AnswerStore when one is given, so only the question is tokenized.
+    """
+    def __init__(self, tokenizer, max_seq_len, answer_store=None):
+        """Arguments:
+            tokenizer: BERT tokenizer
+            max_seq_len: int - maximum sequence length
+            answer_store: AnswerStore object or None
+        """
+        self.tokenizer = tokenizer
+        self.max_seq_len = max_seq_len
+        self.answer_store = answer_store
+        # Question text and token ids of the most recent question
+        self.last_question = (None, None)
+
+        if answer_store is not None and max_seq_len is not None and \
+           answer_store.max_answer_len < max_seq_len - 3:
+            print("Warning: answers in the store are truncated to {} tokens, "
+                  "shorter than max_seq_len allows".format(answer_store.max_answer_len))
+
+    def question_ids(self, q_text):
+        """Returns the token ids of a question, reusing those of the previous
+        call when the question is the same.
+        """
+        last_text, last_ids = self.last_question
+        if last_text == q_text:
+            return last_ids
+        q_ids = self.tokenizer.encode(q_text, add_special_tokens=False)
+        self.last_question = (q_text, q_ids)
+
+        return q_ids
+
+    def encode(self, q_text, docid, pad=True):
+        """Encodes a QA pair.
+
+        Returns:
+            encoded_seq: Dictionary with input_ids, token_type_ids and
+                         attention_mask
+        ----------
+        Arguments:
+            q_text: str - question
+            docid: int - answer docid
+            pad: bool - pad to max_seq_len
+        """
+        if self.answer_store is None:
+            return self.tokenizer.encode_plus(q_text, registry.docid_to_text[docid],
+                                              max_length=self.max_seq_len,
+                                              pad_to_max_length=pad,
+                                              return_token_type_ids=True,
+                                              return_attention_mask = True)
+
+        q_ids = self.question_ids(q_text)
+        a_ids = self.answer_store.get_ids(docid).tolist()
+
+        if self.max_seq_len is not None:
+            q_len, a_len = truncate_pair(len(q_ids), len(a_ids), self.max_seq_len)
+            q_ids, a_ids = q_ids[:q_len], a_ids[:a_len]
+
+        # [CLS] question [SEP] answer [SEP]
+        input_ids = [self.tokenizer.cls_token_id] + q_ids + [self.tokenizer.sep_token_id] + \
+                    a_ids + [self.tokenizer.sep_token_id]
+        token_type_ids = [0]*(len(q_ids) + 2) + [1]*(len(a_ids) + 1)
+        att_mask = [1]*len(input_ids)
+
+        if pad and self.max_seq_len is not None:
+            num_pad = self.max_seq_len - len(input_ids)
+            input_ids += [self.tokenizer.pad_token_id]*num_pad
+            token_type_ids += [0]*num_pad
+            att_mask += [0]*num_pad
+
+        return {'input_ids': input_ids,
+                'token_type_ids': token_type_ids,
+                'attention_mask': att_mask}
+
+def main():
+    # Imported here so the store can be opened without loading transformers
+    from transformers import BertTokenizer
+
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    parser.add_argument("--docid_to_text", default=path + '/data/id_to_text/docid_to_text.pickle',
+    type=str, required=False, help="Path to the pickled docid to answer text dictionary.")
+    parser.add_argument("--max_seq_len", default=512, type=int, required=False,
+    help="Maximum sequence length of the model. Answers are truncated to max_seq_len - 3 tokens.")
+    parser.add_argument("--output_dir", default=default_store_dir, type=str, required=False,
+    help="The output directory where the answer store will be saved.")
+
+    args = parser.parse_args()
+
+    tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
+    docid_to_text = load_pickle(args.docid_to_text)
+
+    print("\nTokenizing {} answers...\n".format(len(docid_to_text)))
+    build_answer_store(docid_to_text, tokenizer, args.max_seq_len - 3, args.output_dir)
+
+    print("Done. The answer store is saved in {}".format(args.output_dir))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import numpy as np
+
+def pad_encoded(encoded_seqs, pad_len=None, pad_token_id=0):
+    """Pads a batch of encoded QA pairs to the length of its longest member.
+    Padding already added by the tokenizer is stripped first, so the masks
+    and lengths only count the real tokens.
+
+    Returns:
+        input_ids: List of lists of padded numericalized tokens
+        token_type_ids: List of lists of padded segment token indices
+        att_masks: List of lists of mask values, 0 for padding tokens
+    ----------
+    Arguments:
+        encoded_seqs: List of dictionaries from the BERT tokenizer with
+                      input_ids, token_type_ids and attention_mask
+        pad_len: int - length to pad to, defaults to the longest sequence
+        pad_token_id: int - id of the padding token
+    """
+    # Number of real tokens, the tokenizer pads at the end
+    seq_lens = [sum(seq['attention_mask']) if 'attention_mask' in seq else len(seq['input_ids']) \
+                for seq in encoded_seqs]
+    if pad_len is None:
+        pad_len = max(seq_lens)
+
+    input_ids = []
+    token_type_ids = []
+    att_masks = []
+
+    for seq, seq_len in zip(encoded_seqs, seq_lens):
+        # Number of padding tokens to append
+        num_pad = pad_len - seq_len
+        input_ids.append(list(seq['input_ids'][:seq_len]) + [pad_token_id]*num_pad)
+        token_type_ids.append(list(seq['token_type_ids'][:seq_len]) + [0]*num_pad)
+        att_masks.append([1]*seq_len + [0]*num_pad)
+
+    return input_ids, token_type_ids, att_masks
+
+def length_bucketed_batches(lengths, batch_size, bucket_width):
+    """Sorts sequences by length, groups them into buckets of similar length
+    and splits every bucket into batches.
+
+    Returns:
+        batches: List of lists of indices into lengths
+    ----------
+    Arguments:
+        lengths: List of encoded sequence lengths
+        batch_size: int - maximum number of sequences per batch
+        bucket_width: int - range of lengths that share a bucket
+    """
+    # Indices of the sequences sorted by length
+    sorted_index = np.argsort(lengths, kind='stable')
+
+    batches = []
+    batch = []
+    bucket = None
+
+    for idx in sorted_index:
+        seq_bucket = lengths[idx] // bucket_width
+        # Start a new batch when it is full or the bucket changes
+        if len(batch) == batch_size or (batch and seq_bucket != bucket):
+            batches.append(batch)
+            batch = []
+        batch.append(int(idx))
+        bucket = seq_bucket
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+class PaddingStats():
+    """Counts real and padding tokens fed to the model.
+    """
+    def __init__(self):
+        # Number of non-padding tokens
+        self.num_tokens = 0
+        # Number of tokens including padding with dynamic padding
+        self.num_padded = 0
+        # Number of sequences
+        self.num_seqs = 0
+
+    def update(self, lengths, pad_len):
+        """Records a batch padded to pad_len.
+
+        Arguments:
+            lengths: List of sequence lengths in the batch
+            pad_len: int - length the batch is padded to
+        """
+        self.num_tokens += sum(lengths)
+        self.num_padded += pad_len * len(lengths)
+        self.num_seqs += len(lengths)
+
+    def waste_ratio(self):
+        """Returns the fraction of the processed tokens that are padding.
+        """
+        if self.num_padded == 0:
+            return 0.0
+        return 1 - self.num_tokens/self.num_padded
+
+    def fixed_waste_ratio(self, max_seq_len):
+        """Returns the fraction of tokens that would be padding if every
+        sequence was padded to max_seq_len.
+        """
+        if self.num_seqs == 0:
+            return 0.0
+        return 1 - self.num_tokens/(max_seq_len * self.num_seqs)
+
+    def report(self, max_seq_len):
+        """Prints the padding waste of dynamic and fixed-length padding.
+        """
+        if max_seq_len is None:
+            print("Padding waste: {0:.1f}%".format(self.waste_ratio()*100))
+            return
+        print("Padding waste: {0:.1f}% with dynamic padding, {1:.1f}% when padded to {2}".format(
+              self.waste_ratio()*100, self.fixed_waste_ratio(max_seq_len)*100, max_seq_len))
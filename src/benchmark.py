@@ -0,0 +1,373 @@
+from pathlib import Path
+import multiprocessing
+import argparse
+import resource
+import time
+import io
+import sys
+
+from utils import *
+from finbert_qa import *
+
+path = str(Path.cwd())
+
+default_test_path = path + '/data/data_pickle/test_set_50.pickle'
+
+def model_size(model):
+    """Returns the size of the serialized model weights in MB.
+
+    Arguments:
+        model: Torch model
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+
+    return buffer.tell()/1e6
+
+def evaluate_qa(qa, k=10):
+    """Re-ranks the test set of a FinBERT_QA object and times it.
+
+    Returns:
+        results: Dictionary with the latency per query in ms, the model size
+                 in MB, MRR@k, nDCG@k and Precision@1
+    ----------
+    Arguments:
+        qa: FinBERT_QA object with test_set set and the model loaded
+        k: int
+    """
+    start = time.time()
+    qid_pred_rank = qa.get_rank(qa.model)
+    latency = (time.time() - start)/len(qa.test_set)*1000
+
+    MRR, average_ndcg, precision, rank_pos = evaluate(qid_pred_rank, registry.labels, k)
+
+    return {'latency_ms': latency,
+            'size_mb': model_size(qa.model),
+            'MRR': MRR,
+            'nDCG': average_ndcg,
+            'P@1': precision}
+
+def print_comparison(names, results):
+    """Prints a table of benchmark results, one column per setting.
+
+    Arguments:
+        names: List of setting names
+        results: List of dictionaries with the same keys
+    """
+    print("\n{:<14}".format("") + "".join("{:>14}".format(name) for name in names))
+    for key in results[0]:
+        print("{:<14}".format(key) + "".join("{:>14.3f}".format(result[key]) for result in results))
+
+def benchmark_quantization(config):
+    """Compares the latency, model size and ranking quality of the fp32
+    model against the int8 dynamically quantized model on CPU.
+
+    Arguments:
+        config: Dictionary
+    """
+    qa = FinBERT_QA(config)
+    qa.test_set = load_pickle(config['test_set'])[:config['num_queries']]
+
+    if config['model_path'] is None:
+        qa.load_finetuned_model()
+    else:
+        qa.model.load_state_dict(torch.load(config['model_path'], map_location=qa.device))
+        qa.model.eval()
+
+    print("\nEvaluating fp32 model...\n")
+    fp32 = evaluate_qa(qa)
+
+    qa.quantize()
+    print("\nEvaluating int8 model...\n")
+    int8 = evaluate_qa(qa)
+
+    print_comparison(['fp32', 'int8'], [fp32, int8])
+    print("\nSpeed-up: {0:.2f}x | Size reduction: {1:.2f}x | MRR change: {2:+.3f} | nDCG change: {3:+.3f}".format(
+          fp32['latency_ms']/int8['latency_ms'], fp32['size_mb']/int8['size_mb'],
+          int8['MRR'] - fp32['MRR'], int8['nDCG'] - fp32['nDCG']))
+
+def evaluate_retriever(searcher, test_set, k=50):
+    """Retrieves the top-k answers of every test question and times it.
+
+    Returns:
+        results: Dictionary with the latency per query in ms and the recall@k
+    ----------
+    Arguments:
+        searcher: Object with a search(query, k) method returning hits
+        test_set: List of lists in the form of [qid, [pos ans], [ans cands]]
+        k: int
+    """
+    recall = 0.0
+    start = time.time()
+
+    for seq in tqdm(test_set):
+        qid = seq[0]
+        hits = searcher.search(registry.qid_to_text[qid], k=k)
+        retrieved = set(int(hit.docid) for hit in hits)
+        # Fraction of the relevant answers retrieved
+        relevant = registry.labels[qid]
+        recall += len(retrieved.intersection(relevant))/len(relevant)
+
+    latency = (time.time() - start)/len(test_set)*1000
+
+    return {'latency_ms': latency,
+            'recall@{}'.format(k): recall/len(test_set)}
+
+def benchmark_retrieval(config):
+    """Compares the latency and recall@50 of BM25 against the dense retriever
+    over the QA-LSTM answer vectors, exhaustive and with the IVF index.
+
+    Arguments:
+        config: Dictionary
+    """
+    # Imported here since loading pyserini starts the JVM
+    from pyserini.search import pysearch
+    from dense_retriever import DenseSearcher
+
+    test_set = load_pickle(config['test_set'])[:config['num_queries']]
+
+    names = ['bm25', 'dense']
+    searchers = [pysearch.SimpleSearcher(fiqa_index), DenseSearcher(dict(config, nprobe=0))]
+    if config['nprobe'] > 0:
+        names.append('dense-ivf')
+        searchers.append(DenseSearcher(config))
+
+    results = []
+    for name, searcher in zip(names, searchers):
+        print("\nEvaluating {} retrieval...\n".format(name))
+        results.append(evaluate_retriever(searcher, test_set))
+
+    print_comparison(names, results)
+
+def recall_at(searcher, test_set, cutoffs):
+    """Computes the recall of the relevant answers in labels.pickle at
+    several numbers of candidates, retrieving once at the largest.
+
+    Returns:
+        results: Dictionary mapping 'recall@N' to the average recall
+    ----------
+    Arguments:
+        searcher: Object with a search(query, k) method returning hits
+        test_set: List of lists in the form of [qid, [pos ans], [ans cands]]
+        cutoffs: List of ints - numbers of candidates N
+    """
+    recall = np.zeros(len(cutoffs))
+
+    for seq in tqdm(test_set):
+        qid = seq[0]
+        hits = searcher.search(registry.qid_to_text[qid], k=max(cutoffs))
+        docids = [int(hit.docid) for hit in hits]
+        relevant = registry.labels[qid]
+        for i, n in enumerate(cutoffs):
+            recall[i] += len(set(docids[:n]).intersection(relevant))/len(relevant)
+
+    return {'recall@{}'.format(n): r/len(test_set) for n, r in zip(cutoffs, recall)}
+
+def benchmark_fusion(config):
+    """Reports the recall@N of BM25, dense and hybrid retrieval for several
+    numbers of candidates N, to choose how many candidates to re-rank.
+
+    Arguments:
+        config: Dictionary
+    """
+    # Imported here since loading pyserini starts the JVM
+    from pyserini.search import pysearch
+    from dense_retriever import DenseSearcher
+
+    test_set = load_pickle(config['test_set'])[:config['num_queries']]
+    cutoffs = [5, 10, 20, 30, 50, 100]
+
+    bm25 = pysearch.SimpleSearcher(fiqa_index)
+    dense = DenseSearcher(config)
+    hybrid = HybridSearcher([bm25, dense],
+                            weights=[1 - config['dense_weight'], config['dense_weight']],
+                            fusion=config['fusion'])
+
+    names = ['bm25', 'dense', 'hybrid']
+    results = []
+    for name, searcher in zip(names, [bm25, dense, hybrid]):
+        print("\nEvaluating {} retrieval...\n".format(name))
+        results.append(recall_at(searcher, test_set, cutoffs))
+
+    print_comparison(names, results)
+
+def benchmark_bm25(config):
+    """Compares the latency of the Lucene BM25 retriever against the
+    in-process BM25 engine and the overlap of their top-50 answers.
+
+    Arguments:
+        config: Dictionary
+    """
+    # Imported here since loading pyserini starts the JVM
+    from pyserini.search import pysearch
+    from bm25 import NativeBM25Searcher
+
+    test_set = load_pickle(config['test_set'])[:config['num_queries']]
+    k = 50
+
+    names = ['lucene', 'native']
+    searchers = [pysearch.SimpleSearcher(fiqa_index), NativeBM25Searcher(config['bm25_index'])]
+    hits = []
+    results = []
+    for name, searcher in zip(names, searchers):
+        print("\nEvaluating {} BM25...\n".format(name))
+        results.append(evaluate_retriever(searcher, test_set, k))
+        hits.append([[int(hit.docid) for hit in searcher.search(registry.qid_to_text[seq[0]], k=k)] \
+                     for seq in test_set])
+
+    print_comparison(names, results)
+
+    # Fraction of the Lucene top-k also retrieved by the native engine
+    overlap = np.mean([len(set(lucene).intersection(native))/max(1, len(lucene)) \
+                       for lucene, native in zip(hits[0], hits[1])])
+    # Fraction of queries with the same top-1 answer
+    top1 = np.mean([len(lucene) > 0 and len(native) > 0 and lucene[0] == native[0] \
+                    for lucene, native in zip(hits[0], hits[1])])
+    print("\nOverlap@{0}: {1:.3f} | Same top-1: {2:.3f} | Speed-up: {3:.2f}x".format(
+          k, overlap, top1, results[0]['latency_ms']/results[1]['latency_ms']))
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the current process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak/1024**2 if sys.platform == 'darwin' else peak/1024
+
+def training_memory(config, batch_size, gradient_checkpointing, queue, num_steps=3):
+    """Runs training steps of the BERT model on random QA pairs of
+    max_seq_len tokens and puts the peak memory and step time in the queue.
+    Runs in its own process, since the peak of a process never decreases.
+
+    Arguments:
+        config: Dictionary
+        batch_size: int
+        gradient_checkpointing: bool
+        queue: multiprocessing Queue
+        num_steps: int - number of training steps, the first one is not timed
+    """
+    model = BERT_MODEL(config['bert_model_name']).get_model()
+    if gradient_checkpointing:
+        enable_gradient_checkpointing(model)
+    optimizer = AdamW(model.parameters(), lr=3e-6)
+    model.train()
+    model_mb = peak_rss_mb()
+
+    max_seq_len = config['max_seq_len']
+    input_ids = torch.randint(1000, 30000, (batch_size, max_seq_len))
+    token_type_ids = torch.zeros(batch_size, max_seq_len, dtype=torch.long)
+    token_type_ids[:, max_seq_len//4:] = 1
+    att_masks = torch.ones(batch_size, max_seq_len, dtype=torch.long)
+    labels = torch.randint(0, 2, (batch_size,))
+
+    for step in range(num_steps):
+        if step == 1:
+            start = time.time()
+        model.zero_grad()
+        with bf16_autocast(config['bf16']):
+            loss = model(input_ids, token_type_ids=token_type_ids, \
+                         attention_mask=att_masks, labels=labels)[0]
+        loss.backward()
+        optimizer.step()
+
+    queue.put({'peak_mb': peak_rss_mb(),
+               'train_mb': peak_rss_mb() - model_mb,
+               'step_s': (time.time() - start)/(num_steps - 1)})
+
+def benchmark_memory(config):
+    """Compares the peak memory and time per training step of BERT
+    fine-tuning with and without gradient checkpointing for several batch
+    sizes. Every setting is measured in a new process.
+
+    Arguments:
+        config: Dictionary
+    """
+    context = multiprocessing.get_context('spawn')
+    names = []
+    results = []
+    for batch_size in config['batch_sizes']:
+        for gradient_checkpointing in [False, True]:
+            name = "{}{}".format(batch_size, '+ckpt' if gradient_checkpointing else '')
+            print("\nTraining with batch size {}{}...".format(batch_size, \
+                  ' and gradient checkpointing' if gradient_checkpointing else ''))
+            queue = context.Queue()
+            process = context.Process(target=training_memory, \
+                                      args=(config, batch_size, gradient_checkpointing, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                # Killed when the batch does not fit into memory
+                print("Failed with exit code {}".format(process.exitcode))
+                continue
+            names.append(name)
+            results.append(queue.get())
+
+    if results:
+        print_comparison(names, results)
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    # Required arguments
+    parser.add_argument("--mode", default=None, type=str, required=True,
+    help="Specify 'quantization' to compare the fp32 and int8 re-rankers or 'retrieval' to compare BM25 and dense retrieval or 'fusion' to report the recall@N of hybrid retrieval or 'bm25' to compare the Lucene and in-process BM25 or 'memory' to report the peak training memory with and without gradient checkpointing.")
+
+    # Optional arguments
+    parser.add_argument("--test_pickle", default=default_test_path, type=str, required=False,
+    help="Path to test data in .pickle format.")
+    parser.add_argument("--num_queries", default=None, type=int, required=False,
+    help="Number of test questions to evaluate. Defaults to the whole test set.")
+    parser.add_argument("--model_path", default=None, type=str, required=False,
+    help="Path to the fine-tuned model. Defaults to the trained finbert-qa model.")
+    parser.add_argument("--score_batch_size", default=16, type=int, required=False,
+    help="Number of QA pairs to score per forward pass.")
+    parser.add_argument("--vector_store", default=None, type=str, required=False,
+    help="Directory of the answer vectors built by src/vector_store.py.")
+    parser.add_argument("--nprobe", default=0, type=int, required=False,
+    help="Number of IVF clusters searched by the dense retriever. Also benchmarks the IVF index if greater than 0.")
+    parser.add_argument("--bm25_index", default=path + '/data/bm25_index.npz', type=str, required=False,
+    help="BM25 index built by src/bm25.py.")
+    parser.add_argument("--fusion", default="rrf", type=str, required=False,
+    help="Fusion of the hybrid retriever, 'rrf' for reciprocal rank fusion or 'weighted' for weighted scores.")
+    parser.add_argument("--dense_weight", default=0.5, type=float, required=False,
+    help="Weight of the dense retriever in the hybrid fusion. BM25 gets 1 - dense_weight.")
+    parser.add_argument("--batch_sizes", default="4,8,16", type=str, required=False,
+    help="Comma-separated training batch sizes of the memory benchmark.")
+    parser.add_argument("--max_seq_len", default=512, type=int, required=False,
+    help="Maximum sequence length for a given input.")
+    parser.add_argument("--bf16", default=False, \
+                        action="store_true", \
+                        help="Train with bfloat16 autocast in the memory benchmark.")
+
+    args = parser.parse_args()
+
+    config = {'test_set': args.test_pickle,
+              'num_queries': args.num_queries,
+              'model_path': args.model_path,
+              'bert_model_name': 'bert-qa',
+              'device': 'cpu',
+              'max_seq_len': args.max_seq_len,
+              'score_batch_size': args.score_batch_size,
+              'vector_store': args.vector_store,
+              'nprobe': args.nprobe,
+              'bm25_index': args.bm25_index,
+              'fusion': args.fusion,
+              'dense_weight': args.dense_weight,
+              'batch_sizes': [int(size) for size in args.batch_sizes.split(',')],
+              'bf16': args.bf16}
+
+    if args.mode == 'quantization':
+        benchmark_quantization(config)
+    elif args.mode == 'retrieval':
+        benchmark_retrieval(config)
+    elif args.mode == 'fusion':
+        benchmark_fusion(config)
+    elif args.mode == 'bm25':
+        benchmark_bm25(config)
+    elif args.mode == 'memory':
+        benchmark_memory(config)
+    else:
+        print("Please specify 'quantization', 'retrieval', 'fusion', 'bm25' or 'memory' for mode")
+        sys.exit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from pathlib import Path
+from collections import Counter
+from tqdm import tqdm
+import numpy as np
+import argparse
+import heapq
+
+from utils import *
+from process_data import tokenize
+from hits import Hit
+
+path = str(Path.cwd())
+
+default_index_path = path + '/data/bm25_index.npz'
+
+def build_bm25_index(collection, index_path=default_index_path):
+    """Tokenizes the answers and saves their postings in compressed sparse
+    row (CSR) form: the postings of term t are the entries
+    indptr[t]:indptr[t+1] of rows and tfs.
+
+    Arguments:
+        collection: Dataframe with a column of docid and a column of answer text
+        index_path: str - output .npz file
+    """
+    # Drop empty answers
+    collection = collection.dropna(subset=['doc'])
+
+    term_to_id = {}
+    term_ids = []
+    rows = []
+    tfs = []
+    doc_lens = np.zeros(len(collection), dtype=np.int32)
+
+    for row, doc in enumerate(tqdm(collection['doc'].values)):
+        tokens = tokenize(doc)
+        doc_lens[row] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            term_ids.append(term_to_id.setdefault(term, len(term_to_id)))
+            rows.append(row)
+            tfs.append(tf)
+
+    term_ids = np.array(term_ids, dtype=np.int32)
+    # Group the postings by term, rows stay sorted within a term
+    order = np.argsort(term_ids, kind='stable')
+    indptr = np.zeros(len(term_to_id) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(term_ids, minlength=len(term_to_id)))
+
+    terms = np.array(sorted(term_to_id, key=term_to_id.get))
+
+    np.savez_compressed(index_path,
+                        terms=terms,
+                        indptr=indptr,
+                        rows=np.array(rows, dtype=np.int32)[order],
+                        tfs=np.array(tfs, dtype=np.int32)[order],
+                        doc_lens=doc_lens,
+                        docids=collection['docid'].values.astype(np.int64))
+
+class NativeBM25Searcher():
+    """In-process BM25 retriever over the postings saved by build_bm25_index,
+    with the search interface of the Lucene SimpleSearcher.
+
+    Scores follow the Lucene BM25 similarity with the Anserini defaults
+    k1=0.9 and b=0.4.
+    """
+    def __init__(self, index_path=default_index_path, k1=0.9, b=0.4):
+        """Arguments:
+            index_path: str - .npz file created by build_bm25_index
+            k1: float - term frequency saturation
+            b: float - document length normalization
+        """
+        index = np.load(index_path)
+        self.term_to_id = {term: i for i, term in enumerate(index['terms'])}
+        self.indptr = index['indptr']
+        self.rows = index['rows']
+        self.tfs = index['tfs'].astype(np.float32)
+        self.docids = index['docids']
+
+        doc_lens = index['doc_lens'].astype(np.float32)
+        num_docs = len(doc_lens)
+        # Length normalization of each answer
+        self.norms = k1*(1 - b + b*doc_lens/doc_lens.mean())
+        self.k1 = k1
+        # Inverse document frequency of each term
+        dfs = np.diff(self.indptr).astype(np.float32)
+        self.idfs = np.log(1 + (num_docs - dfs + 0.5)/(dfs + 0.5))
+
+    def search(self, query, k=10):
+        """Retrieves the top-k answers of a question.
+
+        Returns:
+            hits: List of Hit objects, highest score first
+        ----------
+        Arguments:
+            query: str
+            k: int
+        """
+        term_ids = [self.term_to_id[term] for term in tokenize(query) if term in self.term_to_id]
+        if len(term_ids) == 0:
+            return []
+
+        # Score accumulator of the query
+        scores = np.zeros(len(self.docids), dtype=np.float32)
+        touched = []
+        for t in term_ids:
+            start, end = self.indptr[t], self.indptr[t+1]
+            rows = self.rows[start:end]
+            tfs = self.tfs[start:end]
+            # Vectorized BM25 term weight of every answer containing the term
+            scores[rows] += self.idfs[t]*tfs*(self.k1 + 1)/(tfs + self.norms[rows])
+            touched.append(rows)
+        touched = np.unique(np.concatenate(touched))
+
+        # Top-k heap over the answers containing a query term
+        top = heapq.nlargest(k, zip(scores[touched], touched))
+
+        return [Hit(self.docids[row], score) for score, row in top]
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    # Required arguments
+    parser.add_argument("--collection_path", default=None, type=str, required=True,
+    help="Path to the answer collection in .tsv format with the columns docid and doc.")
+
+    # Optional arguments
+    parser.add_argument("--output", default=default_index_path, type=str, required=False,
+    help="Path of the BM25 index in .npz format.")
+
+    args = parser.parse_args()
+
+    collection = load_answers_to_df(args.collection_path)
+    print("\nIndexing {} answers...\n".format(len(collection)))
+    build_bm25_index(collection, args.output)
+
+    print("Done. The BM25 index is saved in {}".format(args.output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+from pathlib import Path
+from tqdm import tqdm
+import numpy as np
+import argparse
+import torch
+import os
+
+from utils import *
+from registry import *
+from vector_store import *
+from process_data import tokenize
+from hits import Hit
+
+path = str(Path.cwd())
+
+def top_k(scores, k):
+    """Returns the indices of the k highest scores, highest first.
+
+    Arguments:
+        scores: Numpy array
+        k: int
+    """
+    if k < len(scores):
+        # Partial sort - only the top-k are ordered
+        idx = np.argpartition(-scores, k)[:k]
+    else:
+        idx = np.arange(len(scores))
+
+    return idx[np.argsort(-scores[idx], kind='stable')]
+
+def kmeans(vectors, num_clusters, n_iter=10, seed=1234):
+    """Spherical k-means on unit-length vectors.
+
+    Returns:
+        centroids: Numpy array - (num_clusters, dim) of unit-length centroids
+        assign: Numpy array - cluster of each vector
+    ----------
+    Arguments:
+        vectors: Numpy array - (num_vectors, dim)
+        num_clusters: int
+        n_iter: int - number of iterations
+        seed: int
+    """
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+
+    for i in range(n_iter):
+        assign = assign_clusters(vectors, centroids)
+        for c in range(num_clusters):
+            members = vectors[assign == c]
+            # Keep the previous centroid of an empty cluster
+            if len(members) > 0:
+                centroids[c] = members.sum(axis=0)
+        centroids = normalize(centroids)
+
+    return centroids, assign_clusters(vectors, centroids)
+
+def assign_clusters(vectors, centroids, block_size=65536):
+    """Returns the index of the most similar centroid of each vector.
+    """
+    assign = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start+block_size])
+        assign[start:start+len(block)] = block.dot(centroids.T).argmax(axis=1)
+
+    return assign
+
+def build_ivf(vector_store, num_clusters, n_iter=10):
+    """Clusters the answer vectors and saves an inverted file index to the
+    vector store directory. Answers of a cluster are stored contiguously.
+
+    Arguments:
+        vector_store: VectorStore object
+        num_clusters: int
+        n_iter: int - number of k-means iterations
+    """
+    vectors = np.asarray(vector_store.vectors, dtype=np.float32)
+    centroids, assign = kmeans(vectors, num_clusters, n_iter)
+
+    # Rows of the vector store sorted by cluster
+    rows = np.argsort(assign, kind='stable')
+    offsets = np.zeros(num_clusters + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=num_clusters))
+
+    np.save(os.path.join(vector_store.store_dir, 'ivf_centroids.npy'), centroids.astype(np.float32))
+    np.save(os.path.join(vector_store.store_dir, 'ivf_rows.npy'), rows)
+    np.save(os.path.join(vector_store.store_dir, 'ivf_offsets.npy'), offsets)
+
+class QueryEncoder():
+    """Encodes questions with the question tower of a trained QA-LSTM model.
+    """
+    def __init__(self, config, max_seq_len):
+        """Arguments:
+            config: Dictionary
+            max_seq_len: int - length the questions are padded or truncated to
+        """
+        # Imported here so the BM25 path does not build the QA-LSTM model
+        from qa_lstm import LSTM_MODEL
+
+        self.device = torch.device('cuda' if config['device'] == 'gpu' else 'cpu')
+        self.max_seq_len = max_seq_len
+        # The embeddings are loaded from the trained model, not from GloVe
+        self.model = LSTM_MODEL({'emb_dim': config.get('emb_dim', 100),
+                                 'hidden_size': config.get('hidden_size', 256),
+                                 'dropout': 0.0,
+                                 'glove': False})
+
+        if config.get('qa_lstm_model_path') is None:
+            model_name = get_trained_model("qa-lstm")
+            self.model_path = path + "/model/trained/qa-lstm/" + model_name
+        else:
+            self.model_path = config['qa_lstm_model_path']
+        self.model.load_state_dict(torch.load(self.model_path, map_location=self.device))
+        self.model.to(self.device)
+        self.model.eval()
+
+    def encode(self, query):
+        """Returns the unit-length vector of a question.
+
+        Returns:
+            q_output: Numpy array - (2*hidden_size,)
+        ----------
+        Arguments:
+            query: str
+        """
+        vocab = registry.vocab
+        # Tokens outside of the vocabulary are dropped
+        q_idx = [vocab[token] for token in tokenize(query) if token in vocab][:self.max_seq_len]
+        q_idx += [0]*(self.max_seq_len - len(q_idx))
+        q_vec = torch.tensor([q_idx]).to(self.device)
+
+        with torch.no_grad():
+            q_output = self.model.encode(q_vec).cpu().numpy()
+
+        return normalize(q_output)[0]
+
+class DenseSearcher():
+    """Dense first-stage retriever over the QA-LSTM answer vectors, with the
+    search interface of the Lucene SimpleSearcher.
+
+    Without an IVF index the whole matrix is scored block by block. With an
+    index built by build_ivf only the answers in the nprobe clusters closest
+    to the question are scored.
+    """
+    def __init__(self, config):
+        """Arguments:
+            config: Dictionary
+        """
+        self.vector_store = VectorStore(config.get('vector_store') or default_store_dir)
+        self.encoder = QueryEncoder(config, self.vector_store.max_seq_len)
+        # The questions and answers have to be encoded by the same model
+        self.vector_store.check_model(self.encoder.model_path)
+        # Number of answer vectors scored per matrix multiply
+        self.block_size = config.get('block_size', 65536)
+        # Number of clusters searched, 0 for exhaustive search
+        self.nprobe = config.get('nprobe', 0)
+
+        ivf_path = os.path.join(self.vector_store.store_dir, 'ivf_centroids.npy')
+        if self.nprobe > 0 and not os.path.exists(ivf_path):
+            print("Warning: no IVF index in {}, searching exhaustively".format(self.vector_store.store_dir))
+            self.nprobe = 0
+        if self.nprobe > 0:
+            self.centroids = np.load(ivf_path)
+            self.ivf_rows = np.load(os.path.join(self.vector_store.store_dir, 'ivf_rows.npy'))
+            self.ivf_offsets = np.load(os.path.join(self.vector_store.store_dir, 'ivf_offsets.npy'))
+
+    def search_vector(self, q_output, k):
+        """Returns the rows and scores of the k answers most similar to a
+        question vector.
+        """
+        vectors = self.vector_store.vectors
+
+        if self.nprobe > 0:
+            clusters = top_k(self.centroids.dot(q_output), self.nprobe)
+            rows = np.concatenate([self.ivf_rows[self.ivf_offsets[c]:self.ivf_offsets[c+1]] \
+                                   for c in clusters])
+            # Read the rows in storage order
+            rows.sort()
+            scores = np.asarray(vectors[rows]).dot(q_output)
+            idx = top_k(scores, k)
+            return rows[idx], scores[idx]
+
+        cand_rows = []
+        cand_scores = []
+        for start in range(0, len(vectors), self.block_size):
+            scores = np.asarray(vectors[start:start+self.block_size]).dot(q_output)
+            # Keep the top-k of every block
+            idx = top_k(scores, k)
+            cand_rows.append(idx + start)
+            cand_scores.append(scores[idx])
+        rows = np.concatenate(cand_rows)
+        scores = np.concatenate(cand_scores)
+        idx = top_k(scores, k)
+
+        return rows[idx], scores[idx]
+
+    def search(self, query, k=10):
+        """Retrieves the top-k answers of a question.
+
+        Returns:
+            hits: List of Hit objects, highest score first
+        ----------
+        Arguments:
+            query: str
+            k: int
+        """
+        rows, scores = self.search_vector(self.encoder.encode(query), k)
+
+        return [Hit(self.vector_store.docids[row], score) for row, score in zip(rows, scores)]
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    parser.add_argument("--vector_store", default=default_store_dir, type=str, required=False,
+    help="Directory of the answer vectors built by src/vector_store.py.")
+    parser.add_argument("--num_clusters", default=1024, type=int, required=False,
+    help="Number of clusters of the IVF index.")
+    parser.add_argument("--n_iter", default=10, type=int, required=False,
+    help="Number of k-means iterations.")
+
+    args = parser.parse_args()
+
+    vector_store = VectorStore(args.vector_store)
+    print("\nClustering {} answer vectors into {} clusters...\n".format(len(vector_store), args.num_clusters))
+    build_ivf(vector_store, args.num_clusters, args.n_iter)
+
+    print("Done. The IVF index is saved in {}".format(args.vector_store))
+
+if __name__ == "__main__":
+    main()
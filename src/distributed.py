@@ -0,0 +1,161 @@
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import contextlib
+import random
+import torch
+import os
+from torch.utils.data import RandomSampler, SequentialSampler
+from torch.utils.data.distributed import DistributedSampler
+
+# Seed of the random choices every process has to make identically
+seed = 1234
+
+def is_distributed():
+    """Returns True inside a process of a distributed training run.
+    """
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+def is_main_process():
+    return get_rank() == 0
+
+def get_local_rank():
+    """Returns the index of the process on its node.
+    """
+    return int(os.environ.get('LOCAL_RANK', 0)) if is_distributed() else 0
+
+def is_local_main_process():
+    return get_local_rank() == 0
+
+def barrier():
+    """Waits for all processes, does nothing outside a distributed run.
+    """
+    if is_distributed():
+        dist.barrier()
+
+@contextlib.contextmanager
+def local_main_first():
+    """Runs the enclosed block in the first process of every node before
+    the other processes of the run, for downloads and caches on the local
+    disk of the node.
+    """
+    if not is_local_main_process():
+        barrier()
+    yield
+    if is_local_main_process():
+        barrier()
+
+def all_reduce_sum(values):
+    """Sums a list of floats over all processes.
+
+    Returns:
+        values: List of floats
+    ----------
+    Arguments:
+        values: List of floats
+    """
+    if not is_distributed():
+        return list(values)
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+
+    return tensor.tolist()
+
+def all_reduce_mean(values):
+    """Averages a list of floats over all processes.
+    """
+    return [value/get_world_size() for value in all_reduce_sum(values)]
+
+def init_process(local_rank, config):
+    """Joins the process group of a distributed training run over the gloo
+    backend and gives the process its share of the CPU cores of the node.
+
+    Arguments:
+        local_rank: int - index of the process on its node
+        config: Dictionary with num_procs, num_nodes, node_rank,
+                master_addr and master_port
+    """
+    os.environ['MASTER_ADDR'] = config['master_addr']
+    os.environ['MASTER_PORT'] = str(config['master_port'])
+    os.environ['LOCAL_RANK'] = str(local_rank)
+    rank = config['node_rank']*config['num_procs'] + local_rank
+    world_size = config['num_nodes']*config['num_procs']
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+
+    # Processes of a node would oversubscribe the cores with the default
+    # number of threads each
+    torch.set_num_threads(max(1, (os.cpu_count() or 1)//config['num_procs']))
+    # Every process samples the same pairwise positives
+    random.seed(seed)
+
+def destroy_process():
+    """Leaves the process group of a distributed training run.
+    """
+    if is_distributed():
+        dist.destroy_process_group()
+
+def get_sampler(data, shuffle):
+    """Creates the sampler of a DataLoader. In a distributed run every
+    process samples its own shard of the dataset.
+
+    Returns:
+        sampler: DistributedSampler, RandomSampler or SequentialSampler object
+    ----------
+    Arguments:
+        data: Dataset object
+        shuffle: bool - sample in random order
+    """
+    if is_distributed():
+        return DistributedSampler(data, shuffle=shuffle)
+    if shuffle:
+        return RandomSampler(data)
+
+    return SequentialSampler(data)
+
+def skip_sync(model, skip):
+    """Returns a context manager skipping the gradient all-reduce of a
+    DistributedDataParallel model, for the micro-batches before the last
+    one of an accumulated optimizer step.
+
+    Arguments:
+        model: Torch model, wrapped in DistributedDataParallel or not
+        skip: bool
+    """
+    if skip and hasattr(model, 'no_sync'):
+        return model.no_sync()
+
+    return contextlib.ExitStack()
+
+def launch(worker, config):
+    """Starts num_procs local processes running worker(local_rank, config).
+
+    Arguments:
+        worker: Function at module level taking the local rank and config
+        config: Dictionary
+    """
+    mp.spawn(worker, args=(config,), nprocs=config['num_procs'])
+
+def report_throughput(num_examples, seconds):
+    """Prints the training throughput of every process and, on the main
+    process, of all processes together.
+
+    Arguments:
+        num_examples: int - training examples processed by this process
+        seconds: float - training time of the epoch
+    """
+    print("\t Worker {}: {} examples in {:.1f}s ({:.1f} examples/s)".format(
+          get_rank(), num_examples, seconds, num_examples/max(seconds, 1e-9)))
+    if not is_distributed():
+        return
+    total_examples = all_reduce_sum([num_examples])[0]
+    # The slowest process sets the epoch time
+    max_seconds = torch.tensor([seconds], dtype=torch.float64)
+    dist.all_reduce(max_seconds, op=dist.ReduceOp.MAX)
+    if is_main_process():
+        print("\t All {} workers: {:.1f} examples/s".format(get_world_size(), \
+              total_examples/max(max_seconds.item(), 1e-9)))
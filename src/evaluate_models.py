@@ -3,8 +3,6 @@ import argparse
 import sys
 
 from utils import *
-from qa_lstm import *
-from finbert_qa import *
 
 path = str(Path.cwd())
 
@@ -36,6 +34,24 @@ def main():
     help="Specify 'gpu' or 'cpu'")
     parser.add_argument("--max_seq_len", default=None, type=int, required=False,
     help="Maximum sequence length for a sequence.")
+    parser.add_argument("--score_batch_size", default=16, type=int, required=False,
+    help="Number of QA pairs to score per forward pass. Specify only if model_type is 'bert'")
+    parser.add_argument("--dynamic_padding", default=False, \
+                        action="store_true", \
+                        help="Pad each batch to its longest QA pair. Specify only if model_type is 'bert'")
+    parser.add_argument("--bucket_width", default=32, type=int, required=False,
+    help="Range of sequence lengths batched together when dynamic_padding is used.")
+    parser.add_argument("--answer_store", default=None, type=str, required=False,
+    help="Directory of the pre-tokenized answers built by src/answer_store.py.")
+    parser.add_argument("--quantized", default=False, \
+                        action="store_true", \
+                        help="Apply int8 dynamic quantization to the fine-tuned model. Runs on CPU.")
+    parser.add_argument("--quantized_model", default=None, type=str, required=False,
+    help="Path to a quantized model saved by src/export_model.py. Runs on CPU.")
+    parser.add_argument("--torchscript_model", default=None, type=str, required=False,
+    help="Path to a TorchScript model saved by src/export_model.py.")
+    parser.add_argument("--score_cache", default=None, type=str, required=False,
+    help="Directory of the persistent cache of QA pair scores. Specify only if model_type is 'bert'")
 
     # Optional arguments when model_type is 'qa-lstm'
     parser.add_argument("--emb_dim", default=100, type=int, required=False,
@@ -44,6 +60,8 @@ def main():
     help="Hidden size. Specify only if model_type is 'qa-lstm'")
     parser.add_argument("--dropout", default=0.2, type=float, required=False,
     help="Dropout rate. Specify only if model_type is 'qa-lstm'")
+    parser.add_argument("--vector_store", default=None, type=str, required=False,
+    help="Directory of the answer vectors built by src/vector_store.py. Specify only if model_type is 'qa-lstm'")
 
     args = parser.parse_args()
 
@@ -57,15 +75,27 @@ def main():
               'model_path': args.model_path,
               'device': args.device,
               'max_seq_len': args.max_seq_len,
+              'score_batch_size': args.score_batch_size,
+              'dynamic_padding': args.dynamic_padding,
+              'bucket_width': args.bucket_width,
+              'answer_store': args.answer_store,
+              'quantized': args.quantized,
+              'quantized_model': args.quantized_model,
+              'torchscript_model': args.torchscript_model,
+              'score_cache': args.score_cache,
               'emb_dim': args.emb_dim,
               'hidden_size': args.hidden_size,
-              'dropout': args.dropout}
+              'dropout': args.dropout,
+              'vector_store': args.vector_store}
 
     # TO-DO: Catch error for invalid datasets
 
+    # Only import the modules of the model type in use
     if config['model_type'] == 'qa-lstm':
+        from qa_lstm import QA_LSTM
         QA_LSTM(config).evaluate_model()
     elif config['model_type'] == 'bert':
+        from finbert_qa import FinBERT_QA
         FinBERT_QA(config).evaluate_model()
     else:
         print("Please specify 'qa-lstm' or 'bert' for model_type")
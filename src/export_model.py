@@ -0,0 +1,74 @@
+from pathlib import Path
+import argparse
+import os
+import sys
+
+from utils import *
+from finbert_qa import *
+
+path = str(Path.cwd())
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    # Required arguments
+    parser.add_argument("--format", default=None, type=str, required=True,
+    help="Specify 'quantized' to save an int8 dynamically quantized checkpoint or 'torchscript' to save a traced TorchScript model.")
+
+    # Optional arguments
+    parser.add_argument("--model_path", default=None, type=str, required=False,
+    help="Path to the fine-tuned model. Defaults to the trained finbert-qa model.")
+    parser.add_argument("--bert_model_name", default="bert-qa", type=str, required=False, \
+    help="Specify the pre-trained BERT model the fine-tuned model is based on from 'bert-base', 'finbert-domain', 'finbert-task', 'bert-qa'")
+    parser.add_argument("--output", default=None, type=str, required=False,
+    help="Path of the exported model.")
+    parser.add_argument("--quantized", default=False, \
+                        action="store_true", \
+                        help="Quantize the model before tracing. Specify only if format is 'torchscript'")
+    parser.add_argument("--max_seq_len", default=512, type=int, required=False,
+    help="Sequence length of the example inputs used for tracing.")
+    parser.add_argument("--batch_size", default=16, type=int, required=False,
+    help="Batch size of the example inputs used for tracing.")
+    parser.add_argument("--device", default='cpu', type=str, required=False,
+    help="Specify 'gpu' or 'cpu'. The TorchScript model runs on the device it is traced on. Quantized models run on CPU.")
+
+    args = parser.parse_args()
+
+    config = {'bert_model_name': args.bert_model_name,
+              'device': args.device,
+              'max_seq_len': args.max_seq_len}
+
+    if args.format == 'quantized':
+        output = args.output or path + "/model/trained/finbert-qa/finbert-qa-int8.pt"
+    elif args.format == 'torchscript':
+        output = args.output or path + "/model/trained/finbert-qa/finbert-qa-traced.pt"
+    else:
+        print("Please specify 'quantized' or 'torchscript' for format")
+        sys.exit()
+
+    qa = FinBERT_QA(config)
+
+    # Load the fine-tuned weights
+    if args.model_path is None:
+        qa.load_finetuned_model()
+    else:
+        qa.model.load_state_dict(torch.load(args.model_path, map_location=qa.device))
+        qa.model.eval()
+
+    if not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+
+    if args.format == 'quantized' or args.quantized:
+        print("\nQuantizing model...\n")
+        qa.quantize()
+
+    if args.format == 'torchscript':
+        print("\nTracing model...\n")
+        qa.save_traced(qa.trace(args.batch_size), output)
+    else:
+        qa.save_model(output)
+
+    print("Done. The model is saved in {}".format(output))
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,29 @@
 from pathlib import Path
 from tqdm import tqdm
 import numpy as np
-import random
 import torch
 import json
+import contextlib
+import inspect
+import time
 import os
 import sys
 from torch.nn import CrossEntropyLoss
-from torch.utils.data import TensorDataset, DataLoader, RandomSampler, SequentialSampler
+from torch.utils.data import DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.checkpoint import checkpoint
 from torch.nn.functional import softmax
 from transformers import BertTokenizer, BertForSequenceClassification, AdamW, get_linear_schedule_with_warmup, BertConfig
-from pyserini.search import pysearch
 
 from utils import *
 from evaluate import *
+from registry import *
+from batching import *
+from answer_store import *
+from pair_dataset import *
+from hybrid_retriever import *
+from score_cache import *
+from distributed import *
 
 # Set the random seed manually for reproducibility.
 torch.backends.cudnn.deterministic = True
@@ -21,14 +31,6 @@ torch.manual_seed(1234)
 
 path = str(Path.cwd())
 
-# Dictionary mapping of docid and qid to raw text
-docid_to_text = load_pickle(path + '/data/id_to_text/docid_to_text.pickle')
-qid_to_text = load_pickle(path + '/data/id_to_text/qid_to_text.pickle')
-# Labels
-labels = load_pickle(path + '/data/data_pickle/labels.pickle')
-# Lucene index
-fiqa_index = path + "/retriever/lucene-index-fiqa"
-
 class BERT_MODEL():
     """Fine-tuned BERT model for non-factoid question answering.
     """
@@ -64,6 +66,98 @@ class BERT_MODEL():
                                                               num_labels=2)
         return model
 
+def bf16_autocast(enabled):
+    """Returns a context manager running the enclosed CPU ops in bfloat16
+    where it is safe, or doing nothing if disabled or not supported by the
+    installed PyTorch.
+
+    Arguments:
+        enabled: bool
+    """
+    if not enabled or not bf16_supported():
+        return contextlib.ExitStack()
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'autocast'):
+        return torch.amp.autocast('cpu', dtype=torch.bfloat16)
+
+    return torch.cpu.amp.autocast(dtype=torch.bfloat16)
+
+def bf16_supported():
+    """Returns True if the installed PyTorch has CPU autocast.
+    """
+    if not hasattr(torch, 'bfloat16'):
+        return False
+
+    return (hasattr(torch, 'amp') and hasattr(torch.amp, 'autocast')) or \
+           (hasattr(torch, 'cpu') and hasattr(torch.cpu, 'amp'))
+
+def extra_files_map(files):
+    """Returns the extra files stored with a TorchScript model. Torch
+    releases before 1.5 take an ExtraFilesMap instead of a dictionary.
+
+    Arguments:
+        files: Dictionary of file name to str contents
+    """
+    extra_files = torch._C.ExtraFilesMap() if hasattr(torch._C, 'ExtraFilesMap') else {}
+    for name, contents in files.items():
+        extra_files[name] = contents
+
+    return extra_files
+
+def num_optimizer_steps(num_batches, accumulation_steps):
+    """Returns the number of optimizer steps of an epoch when the gradients
+    of accumulation_steps batches are accumulated per step.
+    """
+    return (num_batches + accumulation_steps - 1) // accumulation_steps
+
+def accumulation_group_size(step, num_batches, accumulation_steps):
+    """Returns the number of batches accumulated into the optimizer step of
+    a batch, fewer than accumulation_steps for the last step of an epoch.
+
+    Arguments:
+        step: int - index of the batch in the epoch
+        num_batches: int - number of batches of the epoch
+        accumulation_steps: int
+    """
+    group_start = step - step % accumulation_steps
+
+    return min(accumulation_steps, num_batches - group_start)
+
+# Newer PyTorch releases require choosing the checkpoint implementation
+checkpoint_kwargs = {'use_reentrant': False} if 'use_reentrant' in inspect.signature(checkpoint).parameters else {}
+
+def checkpointed(forward):
+    """Wraps the forward function of a BERT layer so its activations are
+    recomputed in the backward pass instead of being stored. Inference and
+    calls with keyword arguments run the layer as is.
+
+    Returns:
+        checkpointed_forward: Function
+    ----------
+    Arguments:
+        forward: Bound forward method of a BertLayer
+    """
+    def checkpointed_forward(*args, **kwargs):
+        if kwargs or not torch.is_grad_enabled():
+            return forward(*args, **kwargs)
+        return checkpoint(forward, *args, **checkpoint_kwargs)
+
+    return checkpointed_forward
+
+def enable_gradient_checkpointing(model):
+    """Applies activation checkpointing to every layer of the BERT encoder,
+    so only the layer inputs are kept for the backward pass. The forward
+    methods are replaced in place, which keeps the state dict keys of the
+    model unchanged.
+
+    Arguments:
+        model: BertForSequenceClassification model
+    """
+    for layer in model.bert.encoder.layer:
+        # Layers are only wrapped once
+        if not getattr(layer, 'checkpointed', False):
+            layer.forward = checkpointed(layer.forward)
+            layer.checkpointed = True
+
 class PointwiseBERT():
     def __init__(self, config, tokenizer, model, optimizer):
         self.config = config
@@ -76,81 +170,52 @@ class PointwiseBERT():
         self.max_seq_len = self.config['max_seq_len']
         # Batch size
         self.batch_size = self.config['batch_size']
+        # Worker processes encoding the batches
+        self.num_workers = self.config.get('num_workers', 0)
+        # Batches whose gradients are accumulated per optimizer step
+        self.accumulation_steps = self.config.get('accumulation_steps', 1)
+        # Run the forward passes in bfloat16 autocast on CPU
+        self.bf16 = self.config.get('bf16', False)
+        # Recompute the BERT layer activations in the backward pass
+        if self.config.get('gradient_checkpointing', False):
+            enable_gradient_checkpointing(model)
+        if self.bf16 and not bf16_supported():
+            print("Warning: this PyTorch version has no CPU autocast, training in float32")
         # Load the BERT tokenizer.
         self.tokenizer = tokenizer
+        # Encodes QA pairs, from the pre-tokenized answers if configured
+        self.encoder = PairEncoder(tokenizer, self.max_seq_len, \
+                                   load_answer_store(config))
         # Initialize model
         self.model = model
         self.optimizer = optimizer
 
-    def get_input_data(self, dataset):
-        """Creates input parameters for training and validation.
+    def get_pair_cache(self, dataset, type):
+        """Opens the encoded QA pairs of the training or validation set if a
+        pair cache directory is configured, encoding them on the first run.
 
         Returns:
-            input_ids: List of lists
-                    Each element contains a list of padded/truncated numericalized
-                    tokens of the sequences including [CLS] and [SEP] tokens
-                    e.g. [[101, 2054, 2003, 102, 2449, 1029, 102], ...]
-            token_type_ids: List of lists
-                    Each element contains a list of segment token indices to
-                    indicate first (question) and second (answer) parts of the inputs.
-                    0 corresponds to a question token, 1 corresponds an answer token
-                    e.g. [[0, 0, 0, 0, 1, 1, 1], ...]
-            att_masks: List of lists
-                    Each element contains a list of mask values to avoid
-                    performing attention on padding token indices.
-                    1 for tokens that are NOT MASKED, 0 for MASKED tokens.
-                    e.g. [[1, 1, 1, 1, 1, 1, 1], ...]
-            labels: List of 1's and 0's incidating relevacy of answer
+            pair_cache: EncodedPairCache object or None
         -----------------
         Arguements:
             dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
+            type: str - 'train' or 'validation'
         """
-        input_ids = []
-        token_type_ids = []
-        att_masks = []
-        labels = []
+        if self.config.get('pair_cache') is None:
+            return None
+        dataset_path = self.config['train_set'] if type == "train" else self.config['valid_set']
 
-        for i, seq in enumerate(tqdm(dataset)):
-            qid, ans_labels, cands = seq[0], seq[1], seq[2]
-            # Map question id to text
-            q_text = qid_to_text[qid]
-            # For each answer in the candidates
-            for docid in cands:
-                # Map the docid to text
-                ans_text = docid_to_text[docid]
-                # Encode the sequence using BERT tokenizer
-                encoded_seq = self.tokenizer.encode_plus(q_text, ans_text,
-                                                    max_length=self.max_seq_len,
-                                                    pad_to_max_length=True,
-                                                    return_token_type_ids=True,
-                                                    return_attention_mask = True)
-                # Get parameters
-                input_id = encoded_seq['input_ids']
-                token_type_id = encoded_seq['token_type_ids']
-                att_mask = encoded_seq['attention_mask']
-
-                # If an answer is in the list of relevant answers assign
-                # positive label
-                if docid in ans_labels:
-                    label = 1
-                else:
-                    label = 0
-
-                # Each parameter list has the length of the max_seq_len
-                assert len(input_id) == self.max_seq_len, "Input id dimension incorrect!"
-                assert len(token_type_id) == self.max_seq_len, "Token type id dimension incorrect!"
-                assert len(att_mask) == self.max_seq_len, "Attention mask dimension incorrect!"
-
-                input_ids.append(input_id)
-                token_type_ids.append(token_type_id)
-                att_masks.append(att_mask)
-                labels.append(label)
-
-        return input_ids, token_type_ids, att_masks, labels
+        # The first process of each node encodes the pairs while the others wait
+        with local_main_first():
+            pair_cache = load_pair_cache(dataset, dataset_path, self.encoder, self.config['pair_cache'])
+
+        return pair_cache
 
     def get_dataloader(self, dataset, type):
-        """Creates train and validation DataLoaders with input_ids,
-        token_type_ids, att_masks, and labels
+        """Creates train and validation DataLoaders with input_ids, sequence
+        lengths, answer segment starts, and labels. The QA pairs are read from the
+        pair cache if configured and encoded as the batches are read
+        otherwise, in num_workers worker processes if configured.
 
         Returns:
             train_dataloader: DataLoader object
@@ -160,26 +225,13 @@ class PointwiseBERT():
         Arguements:
             dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
             type: str - 'train' or 'validation'
-            batch_size: int
-        """
-        # Create input data
-        input_id, token_type_id, \
-        att_mask, label = self.get_input_data(dataset)
-
-        # Convert all inputs to torch tensors
-        input_ids = torch.tensor(input_id)
-        token_type_ids = torch.tensor(token_type_id)
-        att_masks = torch.tensor(att_mask)
-        labels = torch.tensor(label)
-
-        # Create the DataLoader for our training set.
-        data = TensorDataset(input_ids, token_type_ids, att_masks, labels)
-        if type == "train":
-            sampler = RandomSampler(data)
-        else:
-            sampler = SequentialSampler(data)
-        dataloader = DataLoader(data, sampler=sampler, batch_size=self.batch_size)
-        
+        """
+        data = PointwiseDataset(dataset, self.encoder, self.get_pair_cache(dataset, type))
+        # Shards the dataset between the processes of a distributed run
+        sampler = get_sampler(data, shuffle=(type == "train"))
+        dataloader = DataLoader(data, sampler=sampler, batch_size=self.batch_size, \
+                                num_workers=self.num_workers)
+
         return dataloader
 
     def get_accuracy(self, preds, labels):
@@ -220,32 +272,43 @@ class PointwiseBERT():
         num_steps = 0
         # Set model in train mode
         model.train()
+        # Zero the gradients
+        model.zero_grad()
         # For each batch of training data
-        for step, batch in enumerate(tqdm(train_dataloader)):
+        for step, batch in enumerate(tqdm(train_dataloader, disable=not is_main_process())):
             # Get tensors and move to gpu
             # batch contains four PyTorch tensors:
             #   [0]: input ids
-            #   [1]: token_type_ids
-            #   [2]: attention masks
+            #   [1]: sequence lengths
+            #   [2]: answer segment starts
             #   [3]: labels
-            b_input_ids = batch[0].to(self.device)
-            b_token_type_ids = batch[1].to(self.device)
-            b_input_mask = batch[2].to(self.device)
-            b_labels = batch[3].to(self.device)
-
-            # Zero the gradients
-            model.zero_grad()
-            # Forward pass: the model will return the loss and the logits
-            outputs = model(b_input_ids,
-                            token_type_ids = b_token_type_ids,
-                            attention_mask = b_input_mask,
-                            labels = b_labels)
+            batch = tuple(t.to(self.device) for t in batch)
+            # Rebuild the token_type_ids and attention masks on the device
+            b_input_ids, b_token_type_ids, b_input_mask = expand_inputs(batch[0], batch[1], batch[2])
+            b_labels = batch[3]
+            # Last batch of an optimizer step
+            update = (step + 1) % self.accumulation_steps == 0 or step + 1 == len(train_dataloader)
+            # Number of batches averaged into the optimizer step
+            group_size = accumulation_group_size(step, len(train_dataloader), self.accumulation_steps)
+
+            # Gradients are only all-reduced on the last batch of a step
+            with skip_sync(model, not update):
+                with bf16_autocast(self.bf16):
+                    # Forward pass: the model will return the loss and the logits
+                    outputs = model(b_input_ids,
+                                    token_type_ids = b_token_type_ids,
+                                    attention_mask = b_input_mask,
+                                    labels = b_labels)
+
+                # Get loss and predictions
+                loss = outputs[0]
+                logits = outputs[1]
+                # Perform a backward pass to calculate the gradients, scaled
+                # to average over the accumulated batches
+                (loss / group_size).backward()
 
-            # Get loss and predictions
-            loss = outputs[0]
-            logits = outputs[1]
             # Move logits and labels to CPU
-            logits = logits.detach().cpu().numpy()
+            logits = logits.detach().float().cpu().numpy()
             label_ids = b_labels.to('cpu').numpy()
 
             # Calculate the accuracy for a batch
@@ -260,8 +323,8 @@ class PointwiseBERT():
             # Accumulate the training loss over all of the batches
             total_loss += loss.item()
 
-            # Perform a backward pass to calculate the gradients
-            loss.backward()
+            if not update:
+                continue
 
             # Clip the norm of the gradients to 1.0.
             # This is to help prevent the "exploding gradients" problem
@@ -273,6 +336,9 @@ class PointwiseBERT():
             # Update scheduler
             scheduler.step()
 
+            # Zero the gradients
+            model.zero_grad()
+
         # Calculate the average loss over the training data.
         avg_loss = total_loss / len(train_dataloader)
         avg_acc = train_accuracy/num_steps
@@ -299,13 +365,15 @@ class PointwiseBERT():
         num_steps = 0
 
         # For each batch of the validation data
-        for batch in tqdm(validation_dataloader):
+        for batch in tqdm(validation_dataloader, disable=not is_main_process()):
             # Move tensors from batch to GPU
             batch = tuple(t.to(self.device) for t in batch)
             # Unpack the inputs from the dataloader
-            b_input_ids, b_token_type_ids, b_input_masks, b_labels = batch
+            b_input_ids, b_lengths, b_segments, b_labels = batch
+            # Rebuild the token_type_ids and attention masks on the device
+            b_input_ids, b_token_type_ids, b_input_masks = expand_inputs(b_input_ids, b_lengths, b_segments)
             # Don't to compute or store gradients
-            with torch.no_grad():
+            with torch.no_grad(), bf16_autocast(self.bf16):
                 outputs = model(b_input_ids,
                                 token_type_ids = b_token_type_ids,
                                 attention_mask = b_input_masks,
@@ -314,7 +382,7 @@ class PointwiseBERT():
             loss = outputs[0]
             logits = outputs[1]
             # Move logits and labels to CPU
-            logits = logits.detach().cpu().numpy()
+            logits = logits.detach().float().cpu().numpy()
             label_ids = b_labels.to('cpu').numpy()
 
             # Calculate the accuracy for this batch of test sentences.
@@ -345,8 +413,9 @@ class PointwiseBERT():
         train_dataloader = self.get_dataloader(self.train_set, "train")
         validation_dataloader = self.get_dataloader(self.valid_set, "validation")
 
-        # Total number of training steps is number of batches * number of epochs.
-        total_steps = len(train_dataloader) * n_epochs
+        # Total number of training steps is number of optimizer steps per
+        # epoch * number of epochs.
+        total_steps = num_optimizer_steps(len(train_dataloader), self.accumulation_steps) * n_epochs
         # Create a schedule with a learning rate that decreases linearly
         # after linearly increasing during a warmup period
         scheduler = get_linear_schedule_with_warmup(self.optimizer, \
@@ -356,25 +425,40 @@ class PointwiseBERT():
         # Lowest validation lost
         best_valid_loss = float('inf')
 
+        # Average the gradients over the processes of a distributed run
+        model = DistributedDataParallel(self.model) if is_distributed() else self.model
+
         print("\nTraining model...\n")
         for epoch in range(n_epochs):
+            if is_distributed():
+                # Reshuffle the shards every epoch
+                train_dataloader.sampler.set_epoch(epoch)
+            start = time.time()
             # Evaluate training loss
-            train_loss, train_acc = self.train(self.model, \
+            train_loss, train_acc = self.train(model, \
                                                train_dataloader, \
                                                self.optimizer, \
                                                scheduler)
+            train_time = time.time() - start
             # Evaluate validation loss
             valid_loss, valid_acc = self.validate(self.model, \
                                                   validation_dataloader)
+            # Average the results over the shards of all processes
+            train_loss, train_acc, valid_loss, valid_acc = all_reduce_mean([train_loss, train_acc, \
+                                                                            valid_loss, valid_acc])
             # At each epoch, if the validation loss is the best
             if valid_loss < best_valid_loss:
                 best_valid_loss = valid_loss
-                torch.save(self.model.state_dict(), path + "/model/" + \
-                str(epoch+1)+ '_pointwise_' + self.config['bert_model_name'] + '.pt')
+                # Only the main process saves the checkpoint
+                if is_main_process():
+                    torch.save(self.model.state_dict(), path + "/model/" + \
+                    str(epoch+1)+ '_pointwise_' + self.config['bert_model_name'] + '.pt')
 
-            print("\n\n Epoch {}:".format(epoch+1))
-            print("\t Train Loss: {} | Train Accuracy: {}%".format(round(train_loss, 3), round(train_acc*100, 2)))
-            print("\t Validation Loss: {} | Validation Accuracy: {}%\n".format(round(valid_loss, 3), round(valid_acc*100, 2)))
+            if is_main_process():
+                print("\n\n Epoch {}:".format(epoch+1))
+                print("\t Train Loss: {} | Train Accuracy: {}%".format(round(train_loss, 3), round(train_acc*100, 2)))
+                print("\t Validation Loss: {} | Validation Accuracy: {}%\n".format(round(valid_loss, 3), round(valid_acc*100, 2)))
+            report_throughput(len(train_dataloader.sampler), train_time)
 
 class PairwiseBERT():
     def __init__(self, config, tokenizer, model, optimizer):
@@ -388,130 +472,74 @@ class PairwiseBERT():
         self.max_seq_len = config['max_seq_len']
         # Batch size
         self.batch_size = config['batch_size']
+        # Worker processes encoding the batches
+        self.num_workers = config.get('num_workers', 0)
+        # Batches whose gradients are accumulated per optimizer step
+        self.accumulation_steps = config.get('accumulation_steps', 1)
+        # Run the forward passes in bfloat16 autocast on CPU
+        self.bf16 = config.get('bf16', False)
+        # Recompute the BERT layer activations in the backward pass
+        if config.get('gradient_checkpointing', False):
+            enable_gradient_checkpointing(model)
+        if self.bf16 and not bf16_supported():
+            print("Warning: this PyTorch version has no CPU autocast, training in float32")
+        # Negatives scored with one shared positive, 0 to pair each negative
+        # with its own copy of the positive
+        self.group_size = config.get('group_size', 0)
         # Load the BERT tokenizer.
         self.tokenizer = tokenizer
+        # Encodes QA pairs, from the pre-tokenized answers if configured
+        self.encoder = PairEncoder(tokenizer, self.max_seq_len, \
+                                   load_answer_store(config))
         # Initialize model
         self.model = model
         self.optimizer = optimizer
 
-    def get_input_data(self, dataset):
-        """Creates input parameters for training and validation.
+    def get_pair_cache(self, dataset, type):
+        """Opens the encoded QA pairs of the training or validation set if a
+        pair cache directory is configured, encoding them on the first run.
 
         Returns:
-            pos_input_ids: List of lists
-                    Each element contains a list of padded/truncated numericalized
-                    tokens of the positive QA sequences
-            pos_type_ids: List of lists
-                    Each element contains a list of segment token indices to
-                    indicate first (question) and second (answer) parts of the inputs.
-            pos_masks: List of lists
-                    Each element contains a list of mask values to avoid
-                    performing attention on padding token indices.
-            pos_labels: List of 1's
-            neg_input_ids: List of lists
-                    Each element contains a list of padded/truncated numericalized
-                    tokens of the negative QA sequences
-            neg_type_ids: List of lists
-                    Each element contains a list of segment token indices to
-                    indicate first (question) and second (answer) parts of the inputs.
-            neg_masks: List of lists
-                    Each element contains a list of mask values to avoid
-                    performing attention on padding token indices.
-            neg_labels: List of 0's
+            pair_cache: EncodedPairCache object or None
         -----------------
         Arguements:
             dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
+            type: str - 'train' or 'validation'
         """
-        pos_input_ids = []
-        neg_input_ids = []
-
-        pos_type_ids = []
-        neg_type_ids = []
-
-        pos_masks = []
-        neg_masks = []
+        if self.config.get('pair_cache') is None:
+            return None
+        dataset_path = self.config['train_set'] if type == "train" else self.config['valid_set']
 
-        pos_labels = []
-        neg_labels = []
+        # The first process of each node encodes the pairs while the others wait
+        with local_main_first():
+            pair_cache = load_pair_cache(dataset, dataset_path, self.encoder, self.config['pair_cache'])
 
-        for i, seq in enumerate(tqdm(dataset)):
-            qid, ans_labels, cands = seq[0], seq[1], seq[2]
-            # Get a list of negative candidate answers
-            filtered_cands = list(set(cands)-set(ans_labels))
-            # Select a positive answer from the labels
-            pos_docid = random.choice(ans_labels)
-            # Map question id to text
-            q_text = qid_to_text[qid]
-            # For each negative answer
-            for neg_docid in filtered_cands:
-                # Map the docid to text
-                pos_ans_text = docid_to_text[pos_docid]
-                neg_ans_text = docid_to_text[neg_docid]
-                # Encode positive QA pair
-                pos_encoded_seq = self.tokenizer.encode_plus(q_text, pos_ans_text,
-                                                    max_length=self.max_seq_len,
-                                                    pad_to_max_length=True,
-                                                    return_token_type_ids=True,
-                                                    return_attention_mask = True)
-                # Encode negative QA pair
-                neg_encoded_seq = self.tokenizer.encode_plus(q_text, neg_ans_text,
-                                                    max_length=self.max_seq_len,
-                                                    pad_to_max_length=True,
-                                                    return_token_type_ids=True,
-                                                    return_attention_mask = True)
-                # Get parameters
-                pos_input_id = pos_encoded_seq['input_ids']
-                pos_type_id = pos_encoded_seq['token_type_ids']
-                pos_mask = pos_encoded_seq['attention_mask']
-
-                neg_input_id = neg_encoded_seq['input_ids']
-                neg_type_id = neg_encoded_seq['token_type_ids']
-                neg_mask = neg_encoded_seq['attention_mask']
-
-                pos_input_ids.append(pos_input_id)
-                pos_type_ids.append(pos_type_id)
-                pos_masks.append(pos_mask)
-                pos_labels.append(1)
-
-                neg_input_ids.append(neg_input_id)
-                neg_type_ids.append(neg_type_id)
-                neg_masks.append(neg_mask)
-                neg_labels.append(0)
-
-        return pos_input_ids, pos_type_ids, pos_masks, pos_labels, \
-               neg_input_ids, neg_type_ids, neg_masks, neg_labels
+        return pair_cache
 
     def get_dataloader(self, dataset, type):
-        """Creates train and validation DataLoaders with input_ids,
-        token_type_ids, att_masks, and labels
+        """Creates train and validation DataLoaders with the input_ids,
+        sequence lengths, answer segment starts, and labels of the positive
+        and negative QA pairs. The pairs are read from the pair cache if configured and
+        encoded as the batches are read otherwise, in num_workers worker
+        processes if configured. With a group_size each batch holds the
+        negatives of one question and their shared positive.
 
         Returns:
             train_dataloader: DataLoader object
             validation_dataloader: DataLoader object
         """
-        # Create input parameters
-        pos_input_id, pos_type_id, pos_att_mask, pos_label, \
-        neg_input_id, neg_type_id, neg_att_mask, \
-        neg_label = self.get_input_data(dataset)
-
-        # Convert all inputs and into torch tensors
-        pos_input_ids = torch.tensor(pos_input_id)
-        pos_type_ids = torch.tensor(pos_type_id)
-        pos_att_masks = torch.tensor(pos_att_mask)
-        pos_labels = torch.tensor(pos_label)
-        neg_input_ids = torch.tensor(neg_input_id)
-        neg_type_ids = torch.tensor(neg_type_id)
-        neg_att_masks = torch.tensor(neg_att_mask)
-        neg_labels = torch.tensor(neg_label)
-
-        # Create the DataLoader
-        data = TensorDataset(pos_input_ids, pos_type_ids, pos_att_masks, pos_labels, \
-                             neg_input_ids, neg_type_ids, neg_att_masks, neg_labels)
-        if type == "train":
-            sampler = RandomSampler(data)
+        pair_cache = self.get_pair_cache(dataset, type)
+        if self.group_size > 0:
+            data = PairwiseGroupDataset(dataset, self.encoder, self.group_size, pair_cache)
+            # Each group is a batch
+            batch_size = None
         else:
-            sampler = SequentialSampler(data)
-        dataloader = DataLoader(data, sampler=sampler, batch_size=self.batch_size)
+            data = PairwiseDataset(dataset, self.encoder, pair_cache)
+            batch_size = self.batch_size
+        # Shards the dataset between the processes of a distributed run
+        sampler = get_sampler(data, shuffle=(type == "train"))
+        dataloader = DataLoader(data, sampler=sampler, batch_size=batch_size, \
+                                num_workers=self.num_workers)
 
         return dataloader
 
@@ -554,6 +582,66 @@ class PairwiseBERT():
 
         return loss
 
+    def score_pairs(self, model, batch):
+        """Computes the logits and relevancy scores of the positive and
+        negative QA pairs of a batch in one forward pass. In a batch of a
+        PairwiseGroupDataset the positive score is shared by all negatives
+        of the group.
+
+        Returns:
+            pos_logits: Torch tensor of positive QA pair logits
+            neg_logits: Torch tensor of negative QA pair logits
+            pos_scores: Torch tensor of positive QA pair probabilities, one
+                        per negative
+            neg_scores: Torch tensor of negative QA pair probabilities
+            pos_labels: Torch tensor of 1's
+            neg_labels: Torch tensor of 0's
+        ----------
+        Arguements:
+            model: Torch model
+            batch: Tuple of tensors on the device
+        """
+        if len(batch) == 4:
+            # Positive pair in the first row of the group
+            input_ids, lengths, segments, labels = batch
+            input_ids, type_ids, masks = expand_inputs(input_ids, lengths, segments)
+            outputs = model(input_ids,
+                            token_type_ids=type_ids,
+                            attention_mask=masks,
+                            labels=labels)
+            logits = outputs[1]
+            scores = softmax(logits, dim=1)[:,1]
+            neg_scores = scores[1:]
+
+            return logits[:1], logits[1:], scores[:1].expand_as(neg_scores), \
+                   neg_scores, labels[:1], labels[1:]
+
+        pos_input, pos_length, pos_segment, pos_labels, \
+        neg_input, neg_length, neg_segment, neg_labels = batch
+        # Score the positive and negative QA pairs in one forward pass, so
+        # checkpointed layers run one backward under DistributedDataParallel
+        num_pos = pos_input.size(0)
+        # Rebuild the token_type_ids and attention masks on the device
+        input_ids, type_ids, masks = expand_inputs(torch.cat([pos_input, neg_input]), \
+                                                   torch.cat([pos_length, neg_length]), \
+                                                   torch.cat([pos_segment, neg_segment]))
+
+        # Compute predictinos for postive and negative QA pairs
+        outputs = model(input_ids,
+                        token_type_ids=type_ids,
+                        attention_mask=masks,
+                        labels=torch.cat([pos_labels, neg_labels]))
+
+        # Get the logits from the model for positive and negative QA pairs
+        pos_logits = outputs[1][:num_pos]
+        neg_logits = outputs[1][num_pos:]
+
+        # Get the column of the relevant scores and apply activation function
+        pos_scores = softmax(pos_logits, dim=1)[:,1]
+        neg_scores = softmax(neg_logits, dim=1)[:,1]
+
+        return pos_logits, neg_logits, pos_scores, neg_scores, pos_labels, neg_labels
+
     def train(self, model, train_dataloader, optimizer, scheduler):
         """Trains the model and returns the average loss and accuracy.
 
@@ -573,45 +661,34 @@ class PairwiseBERT():
         train_accuracy = 0
         # Set model in training mode
         model.train()
+        # Zero gradients
+        model.zero_grad()
         # For each batch of training data
-        for step, batch in enumerate(tqdm(train_dataloader)):
-            # Get input tensors and move to gpu:
-            pos_input = batch[0].to(self.device)
-            pos_type_id = batch[1].to(self.device)
-            pos_mask = batch[2].to(self.device)
-            pos_labels = batch[3].to(self.device)
-            neg_input = batch[4].to(self.device)
-            neg_type_id = batch[5].to(self.device)
-            neg_mask = batch[6].to(self.device)
-            neg_labels = batch[7].to(self.device)
-
-            # Zero gradients
-            model.zero_grad()
-            # Compute predictinos for postive and negative QA pairs
-            pos_outputs = model(pos_input,
-                                token_type_ids=pos_type_id,
-                                attention_mask=pos_mask,
-                                labels=pos_labels)
-            neg_outputs = model(neg_input,
-                                token_type_ids=neg_type_id,
-                                attention_mask=neg_mask,
-                                labels=neg_labels)
-
-            # Get the logits from the model for positive and negative QA pairs
-            pos_logits = pos_outputs[1]
-            neg_logits = neg_outputs[1]
-
-            # Get the column of the relevant scores and apply activation function
-            pos_scores = softmax(pos_logits, dim=1)[:,1]
-            neg_scores = softmax(neg_logits, dim=1)[:,1]
-
-            # Compute pairwise loss and get the mean of each batch
-            loss = self.pairwise_loss(pos_scores, neg_scores).mean()
+        for step, batch in enumerate(tqdm(train_dataloader, disable=not is_main_process())):
+            # Get input tensors and move to gpu
+            batch = tuple(t.to(self.device) for t in batch)
+            # Last batch of an optimizer step
+            update = (step + 1) % self.accumulation_steps == 0 or step + 1 == len(train_dataloader)
+            # Number of batches averaged into the optimizer step
+            group_size = accumulation_group_size(step, len(train_dataloader), self.accumulation_steps)
+
+            # Gradients are only all-reduced on the last batch of a step
+            with skip_sync(model, not update):
+                with bf16_autocast(self.bf16):
+                    # Compute predictions for postive and negative QA pairs
+                    pos_logits, neg_logits, pos_scores, neg_scores, \
+                    pos_labels, neg_labels = self.score_pairs(model, batch)
+
+                # Compute pairwise loss in float32 and get the mean of each batch
+                loss = self.pairwise_loss(pos_scores.float(), neg_scores.float()).mean()
+                # Perform a backward pass to calculate the gradients, scaled
+                # to average over the accumulated batches
+                (loss / group_size).backward()
 
             # Move logits and labels to CPU
-            p_logits = pos_logits.detach().cpu().numpy()
+            p_logits = pos_logits.detach().float().cpu().numpy()
             p_labels = pos_labels.to('cpu').numpy()
-            n_logits = neg_logits.detach().cpu().numpy()
+            n_logits = neg_logits.detach().float().cpu().numpy()
             n_labels = neg_labels.to('cpu').numpy()
 
             # Calculate the accuracy for each batch
@@ -628,8 +705,8 @@ class PairwiseBERT():
             # Accumulate the training loss over all of the batches
             total_loss += loss.item()
 
-            # Perform a backward pass to calculate the gradients.
-            loss.backward()
+            if not update:
+                continue
 
             # Clip the norm of the gradients to 1.0.
             # This is to help prevent the "exploding gradients" problem.
@@ -641,6 +718,9 @@ class PairwiseBERT():
             # Update scheduler
             scheduler.step()
 
+            # Zero gradients
+            model.zero_grad()
+
         # Calculate the average loss over the training data.
         avg_loss = total_loss / len(train_dataloader)
         # Compute accuracy for each epoch
@@ -667,39 +747,21 @@ class PairwiseBERT():
         eval_accuracy = 0
 
         # Evaluate data for one epoch
-        for batch in tqdm(validation_dataloader):
+        for batch in tqdm(validation_dataloader, disable=not is_main_process()):
             # Add batch to GPU
             batch = tuple(t.to(self.device) for t in batch)
-            # Unpack the inputs from our dataloader
-            pos_input, pos_type_id, pos_mask, pos_labels, \
-            neg_input, neg_type_id, neg_mask, neg_labels = batch
-
             # Don't compute and store gradients
-            with torch.no_grad():
-                # Compute predictinos for postive and negative QA pairs
-                pos_outputs = model(pos_input,
-                                    token_type_ids=pos_type_id,
-                                    attention_mask=pos_mask,
-                                    labels=pos_labels)
-                neg_outputs = model(neg_input,
-                                    token_type_ids=neg_type_id,
-                                    attention_mask=neg_mask,
-                                    labels=neg_labels)
-
-                # Get logits
-                pos_logits = pos_outputs[1]
-                neg_logits = neg_outputs[1]
-
-                # Apply activation function
-                pos_scores = softmax(pos_logits, dim=1)[:,1]
-                neg_scores = softmax(neg_logits, dim=1)[:,1]
-
-            loss = self.pairwise_loss(pos_scores, neg_scores).mean()
+            with torch.no_grad(), bf16_autocast(self.bf16):
+                # Compute predictions for postive and negative QA pairs
+                pos_logits, neg_logits, pos_scores, neg_scores, \
+                pos_labels, neg_labels = self.score_pairs(model, batch)
+
+            loss = self.pairwise_loss(pos_scores.float(), neg_scores.float()).mean()
 
             # Move logits and labels to CPU
-            p_logits = pos_logits.detach().cpu().numpy()
+            p_logits = pos_logits.detach().float().cpu().numpy()
             p_labels = pos_labels.to('cpu').numpy()
-            n_logits = neg_logits.detach().cpu().numpy()
+            n_logits = neg_logits.detach().float().cpu().numpy()
             n_labels = neg_labels.to('cpu').numpy()
 
             # Calculate the accuracy for this batch of test sentences.
@@ -734,8 +796,9 @@ class PairwiseBERT():
         # Number of epochs
         n_epochs = self.config['n_epochs']
 
-        # Total number of training steps is number of batches * number of epochs.
-        total_steps = len(self.train_dataloader) * n_epochs
+        # Total number of training steps is number of optimizer steps per
+        # epoch * number of epochs.
+        total_steps = num_optimizer_steps(len(self.train_dataloader), self.accumulation_steps) * n_epochs
         # Create a schedule with a learning rate that decreases linearly
         # after linearly increasing during a warmup period
         self.scheduler = get_linear_schedule_with_warmup(self.optimizer, \
@@ -745,25 +808,53 @@ class PairwiseBERT():
         # Lowest validation lost
         best_valid_loss = float('inf')
 
+        # Average the gradients over the processes of a distributed run
+        model = DistributedDataParallel(self.model) if is_distributed() else self.model
+
         print("\nTraining model...\n")
         for epoch in range(n_epochs):
+            if is_distributed():
+                # Reshuffle the shards every epoch
+                self.train_dataloader.sampler.set_epoch(epoch)
+            start = time.time()
             # Evaluate training loss
-            train_loss, train_acc = self.train(self.model, \
+            train_loss, train_acc = self.train(model, \
                                                self.train_dataloader, \
                                                self.optimizer, \
                                                self.scheduler)
+            train_time = time.time() - start
             # Evaluate validation loss
             valid_loss, valid_acc = self.validate(self.model, \
                                                   self.validation_dataloader)
+            # Average the results over the shards of all processes
+            train_loss, train_acc, valid_loss, valid_acc = all_reduce_mean([train_loss, train_acc, \
+                                                                            valid_loss, valid_acc])
             # At each epoch, if the validation loss is the best
             if valid_loss < best_valid_loss:
                 best_valid_loss = valid_loss
-                torch.save(self.model.state_dict(), path + '/model/' + \
-                str(epoch+1)+ '_pairwise_' + self.config['bert_model_name'] + '.pt')
+                # Only the main process saves the checkpoint
+                if is_main_process():
+                    torch.save(self.model.state_dict(), path + '/model/' + \
+                    str(epoch+1)+ '_pairwise_' + self.config['bert_model_name'] + '.pt')
+
+            if is_main_process():
+                print("\n\n Epoch {}:".format(epoch+1))
+                print("\t Train Loss: {} | Train Accuracy: {}%".format(round(train_loss, 3), round(train_acc*100, 2)))
+                print("\t Validation Loss: {} | Validation Accuracy: {}%\n".format(round(valid_loss, 3), round(valid_acc*100, 2)))
+            report_throughput(len(self.train_dataloader.sampler), train_time)
+
+class TraceWrapper(torch.nn.Module):
+    """Fixes the positional input signature of BertForSequenceClassification
+    for tracing.
+    """
+    def __init__(self, model):
+        super(TraceWrapper, self).__init__()
+        self.model = model
 
-            print("\n\n Epoch {}:".format(epoch+1))
-            print("\t Train Loss: {} | Train Accuracy: {}%".format(round(train_loss, 3), round(train_acc*100, 2)))
-            print("\t Validation Loss: {} | Validation Accuracy: {}%\n".format(round(valid_loss, 3), round(valid_acc*100, 2)))
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        logits = self.model(input_ids, token_type_ids=token_type_ids, \
+                            attention_mask=attention_mask)[0]
+        return (logits,)
 
 class FinBERT_QA():
     """
@@ -775,12 +866,64 @@ class FinBERT_QA():
         self.bert_model_name = self.config['bert_model_name']
         self.device = torch.device('cuda' if config['device'] == 'gpu' else 'cpu')
         self.max_seq_len = self.config['max_seq_len']
+        # Number of QA pairs scored per forward pass during re-ranking
+        self.score_batch_size = self.config.get('score_batch_size', 16)
+        # Pad each batch to its longest member instead of max_seq_len
+        self.dynamic_padding = self.config.get('dynamic_padding', False)
+        # Range of sequence lengths grouped into the same bucket
+        self.bucket_width = self.config.get('bucket_width', 32)
+        # Real and padding token counts of the scored batches
+        self.padding_stats = PaddingStats()
         # Load the BERT tokenizer.
         print('\nLoading BERT tokenizer...\n')
         self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
+        # Encodes QA pairs, from the pre-tokenized answers if configured
+        self.encoder = PairEncoder(self.tokenizer, self.max_seq_len, \
+                                   load_answer_store(self.config))
+        # Apply int8 dynamic quantization to the fine-tuned model
+        self.quantized = self.config.get('quantized', False)
+        # Path to a checkpoint saved after quantization
+        self.quantized_model = self.config.get('quantized_model')
+        # Path to a traced TorchScript model
+        self.torchscript_model = self.config.get('torchscript_model')
+        # Exported models already hold the fine-tuned weights
+        self.exported = self.quantized_model is not None or self.torchscript_model is not None
+        # Checkpoint the weights are loaded from
+        self.model_path = self.torchscript_model or self.quantized_model
+        # Persistent scores of the QA pairs of the loaded checkpoint
+        self.score_cache = None
+        if self.quantized or self.quantized_model is not None:
+            # Quantized kernels only run on CPU
+            self.device = torch.device('cpu')
         # Initialize model
-        print("\nLoading pre-trained BERT model...")
-        self.model = BERT_MODEL(self.bert_model_name).get_model().to(self.device)
+        if self.torchscript_model is not None:
+            # Skips building the transformers model
+            print("\nLoading TorchScript model...")
+            # The traced graph creates its tensors on the device it was traced
+            # on, so the model is loaded and run there
+            extra_files = extra_files_map({'device': ''})
+            self.model = torch.jit.load(self.torchscript_model, _extra_files=extra_files)
+            device = extra_files['device']
+            if isinstance(device, bytes):
+                device = device.decode('utf-8')
+            # Models exported without a device were traced on CPU
+            self.device = torch.device(device or 'cpu')
+            print("Running on {}, the device the model was traced on".format(self.device))
+        elif self.quantized_model is not None:
+            print("\nLoading quantized model...")
+            # Quantize the model architecture, then load the int8 weights
+            self.model = BERT_MODEL(self.bert_model_name).get_model()
+            self.quantize()
+            self.model.load_state_dict(torch.load(self.quantized_model, map_location=self.device))
+        else:
+            print("\nLoading pre-trained BERT model...")
+            self.model = BERT_MODEL(self.bert_model_name).get_model().to(self.device)
+        # Number of candidates retrieved and re-ranked per query
+        self.num_cands = self.config.get('num_cands', 50)
+        # Searcher of the first-stage retriever, created on first retrieval
+        self.searcher = None
+        # MicroBatchScheduler shared by concurrent callers of predict
+        self.scheduler = None
 
     def run_train(self):
         """Train and validate the model.
@@ -797,8 +940,61 @@ class FinBERT_QA():
             trainer = PairwiseBERT(self.config, self.tokenizer, self.model, optimizer)
             trainer.train_pairwise()
 
+    def encode_pair(self, q_text, docid):
+        """Encodes a QA pair with the BERT tokenizer. With an answer store
+        only the question is tokenized and the answer ids are read from the
+        store.
+
+        Returns:
+            encoded_seq: Dictionary with input_ids, token_type_ids and
+                         attention_mask
+        -------------------
+        Arguments:
+            q_text - str - query
+            docid - int - candidate answer docid
+        """
+        # Padding is deferred to the batch when dynamic padding is used
+        return self.encoder.encode(q_text, docid, pad=not self.dynamic_padding)
+
+    def score_batch(self, model, encoded_seqs):
+        """Computes the relevancy scores of a mini-batch of encoded QA pairs
+        in a single forward pass.
+
+        Returns:
+            scores: Numpy array of relevancy probabilities (label = 1)
+        -------------------
+        Arguments:
+            model - PyTorch model
+            encoded_seqs - List of encoded QA pairs from encode_pair
+        """
+        # Pad the batch to its longest member with dynamic padding, else
+        # to max_seq_len like the tokenizer
+        pad_len = None if self.dynamic_padding else self.max_seq_len
+        input_ids, token_type_ids, att_mask = pad_encoded(encoded_seqs, pad_len=pad_len, \
+                                              pad_token_id=self.tokenizer.pad_token_id)
+        self.padding_stats.update([sum(mask) for mask in att_mask], len(input_ids[0]))
+        # Numericalized, padded, clipped seqs with special tokens
+        input_ids = torch.tensor(input_ids).to(self.device)
+        # Specify question seq and answer seq
+        token_type_ids = torch.tensor(token_type_ids).to(self.device)
+        # Sepecify which position is part of the seq which is padded
+        att_mask = torch.tensor(att_mask).to(self.device)
+        # Don't calculate gradients
+        with torch.no_grad():
+            # Forward pass, calculate logit predictions for the QA pairs
+            outputs = model(input_ids, token_type_ids=token_type_ids, attention_mask=att_mask)
+        # Get the predictions
+        logits = outputs[0]
+        # Apply activation function
+        pred = softmax(logits, dim=1)
+        # Move predictions to CPU
+        pred = pred.detach().cpu().numpy()
+        # Relevant scores (where label = 1)
+        return pred[:,1]
+
     def predict(self, model, q_text, cands):
-        """Re-ranks the candidates answers for each question.
+        """Re-ranks the candidates answers for each question. Pairs found in
+        the score cache are not scored again.
 
         Returns:
             ranked_ans: list of re-ranked candidate docids
@@ -809,39 +1005,69 @@ class FinBERT_QA():
             q_text - str - query
             cands -List of retrieved candidate docids
         """
+        if self.score_cache is None:
+            return self.sort_cands(cands, self.score_cands(model, q_text, cands))
+
+        # NaN for the pairs not scored before
+        scores = self.score_cache.lookup(q_text, cands)
+        missing = np.where(np.isnan(scores))[0]
+        if len(missing) > 0:
+            missing_cands = [cands[i] for i in missing]
+            scores[missing] = self.score_cands(model, q_text, missing_cands)
+            self.score_cache.add(q_text, missing_cands, scores[missing])
+
+        return self.sort_cands(cands, scores)
+
+    def score_cands(self, model, q_text, cands):
+        """Scores the candidate answers of a question. All candidates are
+        tokenized up front and scored in mini-batches of score_batch_size
+        QA pairs. With dynamic padding the candidates are grouped into length
+        buckets and each batch is padded to its longest member. If a
+        scheduler is set, the pairs are scored in batches shared with
+        concurrent callers instead.
+
+        Returns:
+            scores: Numpy array of relevancy scores in the order of cands
+        -------------------
+        Arguments:
+            model - PyTorch model
+            q_text - str - query
+            cands -List of candidate docids
+        """
+        # Tokenize all the QA pairs
+        encoded_seqs = [self.encode_pair(q_text, docid) for docid in cands]
+        # Concurrent requests share model batches through the scheduler
+        if self.scheduler is not None:
+            return np.array(self.scheduler.submit(encoded_seqs), dtype=np.float32)
+        # Split the candidates into mini-batches of indices
+        if self.dynamic_padding:
+            lengths = [len(seq['input_ids']) for seq in encoded_seqs]
+            batches = length_bucketed_batches(lengths, self.score_batch_size, \
+                                              self.bucket_width)
+        else:
+            batches = [list(range(start, min(start + self.score_batch_size, len(cands)))) \
+                       for start in range(0, len(cands), self.score_batch_size)]
+        # Probability scores of relevancy in the order of the candidates
+        scores = np.zeros(len(cands), dtype=np.float32)
+        # For each mini-batch of candidates
+        for batch in batches:
+            scores[batch] = self.score_batch(model, [encoded_seqs[i] for i in batch])
+
+        return scores
+
+    def sort_cands(self, cands, scores):
+        """Sorts the candidates by descending relevancy score.
+
+        Returns:
+            ranked_ans: list of re-ranked candidate docids
+            sorted_scores: list of relevancy scores of the answers
+        -------------------
+        Arguments:
+            cands - List of candidate docids
+            scores - Numpy array of relevancy scores of the candidates
+        """
         # Convert list to numpy array
         cands_id = np.array(cands)
-        # Empty list for the probability scores of relevancy
-        scores = []
-        # For each answer in the candidates
-        for docid in cands:
-            # Map the docid to text
-            ans_text = docid_to_text[docid]
-            # Create inputs for the model
-            encoded_seq = self.tokenizer.encode_plus(q_text, ans_text,
-                                                max_length=self.max_seq_len,
-                                                pad_to_max_length=True,
-                                                return_token_type_ids=True,
-                                                return_attention_mask = True)
-
-            # Numericalized, padded, clipped seq with special tokens
-            input_ids = torch.tensor([encoded_seq['input_ids']]).to(self.device)
-            # Specify question seq and answer seq
-            token_type_ids = torch.tensor([encoded_seq['token_type_ids']]).to(self.device)
-            # Sepecify which position is part of the seq which is padded
-            att_mask = torch.tensor([encoded_seq['attention_mask']]).to(self.device)
-            # Don't calculate gradients
-            with torch.no_grad():
-                # Forward pass, calculate logit predictions for each QA pair
-                outputs = model(input_ids, token_type_ids=token_type_ids, attention_mask=att_mask)
-            # Get the predictions
-            logits = outputs[0]
-            # Apply activation function
-            pred = softmax(logits, dim=1)
-            # Move logits and labels to CPU
-            pred = pred.detach().cpu().numpy()
-            # Append relevant scores to list (where label = 1)
-            scores.append(pred[:,1][0])
         # Get the indices of the sorted similarity scores
         sorted_index = np.argsort(scores)[::-1]
         # Get the list of docid from the sorted indices
@@ -870,7 +1096,7 @@ class FinBERT_QA():
             # question id, list of rel answers, list of candidates
             qid, label, cands = seq[0], seq[1], seq[2]
             # Map question id to text
-            q_text = qid_to_text[qid]
+            q_text = registry.qid_to_text[qid]
 
             # List of re-ranked docids and the corresponding probabilities
             ranked_ans, sorted_scores = self.predict(model, q_text, cands)
@@ -892,39 +1118,209 @@ class FinBERT_QA():
         # Number of questions
         num_q = len(self.test_set)
 
-        # If use trained model
-        if self.config['use_trained_model'] == True:
-            # Download model
-            model_name = get_trained_model(bert_finetuned_model)
-            model_path = path + "/model/trained/" + \
-                         bert_finetuned_model + "/" + model_name
-        else:
-            model_path = self.config['model_path']
-        # Load model
-        self.model.load_state_dict(torch.load(model_path))
+        # Load model unless an exported model was loaded
+        if not self.exported:
+            # If use trained model
+            if self.config['use_trained_model'] == True:
+                # Download model
+                model_name = get_trained_model(bert_finetuned_model)
+                model_path = path + "/model/trained/" + \
+                             bert_finetuned_model + "/" + model_name
+            else:
+                model_path = self.config['model_path']
+            self.model_path = model_path
+            self.model.load_state_dict(torch.load(model_path, map_location=self.device))
+            if self.quantized:
+                self.quantize()
+        self.open_score_cache()
         print("\nEvaluating...\n")
         # Get rank
         qid_pred_rank = self.get_rank(self.model)
 
         # Evaluate
-        MRR, average_ndcg, precision, rank_pos = evaluate(qid_pred_rank, labels, k)
+        MRR, average_ndcg, precision, rank_pos = evaluate(qid_pred_rank, registry.labels, k)
 
         print("\nAverage nDCG@{0} for {1} queries: {2:.3f}".format(k, num_q, average_ndcg))
         print("MRR@{0} for {1} queries: {2:.3f}".format(k, num_q, MRR))
         print("Average Precision@1 for {0} queries: {1:.3f}".format(num_q, precision))
+        self.padding_stats.report(self.max_seq_len)
+        if self.score_cache is not None:
+            print("Score cache: {}".format(self.score_cache.stats()))
+
+    def load_finetuned_model(self):
+        """Downloads and loads the fine-tuned FinBERT-QA model for inference.
+        """
+        if not self.exported:
+            # Download model
+            model_name = get_trained_model("finbert-qa")
+            self.model_path = path + "/model/trained/finbert-qa/" + model_name
+            # Load model
+            self.model.load_state_dict(torch.load(self.model_path, map_location=self.device), strict=False)
+            if self.quantized:
+                self.quantize()
+        self.model.eval()
+        self.open_score_cache()
+
+    def open_score_cache(self):
+        """Opens the score cache of the loaded checkpoint if a cache
+        directory is configured.
+        """
+        if self.config.get('score_cache') is None or self.model_path is None:
+            return
+        answer_store = self.encoder.answer_store
+        # Export format, quantization and truncation change the scores of a
+        # checkpoint, the contents of which are hashed with the settings
+        settings = {'model_path': os.path.abspath(self.model_path),
+                    'torchscript': self.torchscript_model is not None,
+                    'quantized': self.quantized or self.quantized_model is not None,
+                    'max_seq_len': self.max_seq_len,
+                    'max_answer_len': None if answer_store is None else answer_store.max_answer_len}
+        print("\nOpening score cache...")
+        self.score_cache = ScoreCache(self.config['score_cache'], \
+                                      checkpoint_hash(self.model_path, settings))
+
+    def quantize(self):
+        """Applies int8 dynamic quantization to the linear layers of the
+        loaded model. Weights are stored in int8 and activations are
+        quantized on the fly, which speeds up CPU inference.
+        """
+        self.device = torch.device('cpu')
+        self.model = torch.quantization.quantize_dynamic(self.model.to(self.device), \
+                                                         {torch.nn.Linear}, \
+                                                         dtype=torch.qint8)
+        self.model.eval()
+
+    def trace(self, batch_size):
+        """Traces the loaded model into a TorchScript module with the
+        inputs (input_ids, attention_mask, token_type_ids) and the output
+        (logits,), the same positional order as BertForSequenceClassification.
+
+        Returns:
+            traced_model: TorchScript module
+        -------------------
+        Arguments:
+            batch_size - int - batch size of the example inputs
+        """
+        self.model.eval()
+        example = torch.ones(batch_size, self.max_seq_len, dtype=torch.long).to(self.device)
+
+        with torch.no_grad():
+            traced_model = torch.jit.trace(TraceWrapper(self.model), (example, example, example))
+
+        return traced_model
+
+    def save_traced(self, traced_model, model_path):
+        """Saves a traced model with the device it was traced on, which is
+        the device it runs on after loading.
+
+        Arguments:
+            traced_model - TorchScript module from trace
+            model_path - str
+        """
+        torch.jit.save(traced_model, model_path, \
+                       _extra_files=extra_files_map({'device': self.device.type}))
+
+    def save_model(self, model_path):
+        """Saves the weights of the model, so a quantized checkpoint can be
+        loaded without quantizing the fine-tuned weights again.
+
+        Arguments:
+            model_path - str
+        """
+        torch.save(self.model.state_dict(), model_path)
+
+    def get_searcher(self):
+        """Returns the searcher of the configured retriever, starting it on
+        the first call.
+
+        Returns:
+            searcher: SimpleSearcher, DenseSearcher or HybridSearcher object
+        """
+        if self.searcher is None:
+            self.searcher = load_searcher(self.config)
+
+        return self.searcher
+
+    def retrieve(self, query, k=50):
+        """Retrieves the top-k answer candidates of a query with the
+        configured retriever.
+
+        Returns:
+            cands: List of candidate docids
+        -------------------
+        Arguments:
+            query - str
+            k - int - number of candidates to retrieve
+        """
+        hits = self.get_searcher().search(query, k=k)
+
+        cands = []
+
+        for i in range(0, len(hits)):
+            cands.append(int(hits[i].docid))
+
+        return cands
+
+    def answer(self, query, top_k):
+        """Retrieves and re-ranks the answer candidates of a query with the
+        loaded model.
+
+        Returns:
+            answers: List of dictionaries with the rank, docid, score and
+                     text of the top-k answers, empty if nothing is retrieved
+        -------------------
+        Arguments:
+            query - str
+            top_k - int - number of answers to return
+        """
+        rank, scores = self.rank_answers(query)
+
+        return self.format_answers(rank, scores, top_k)
+
+    def rank_answers(self, query):
+        """Retrieves and re-ranks the answer candidates of a query.
+
+        Returns:
+            rank: List of re-ranked docids, empty if nothing is retrieved
+            scores: List of the scores of the re-ranked docids
+        -------------------
+        Arguments:
+            query - str
+        """
+        cands = self.retrieve(query, self.num_cands)
+
+        if len(cands) == 0:
+            return [], []
+
+        rank, scores = self.predict(self.model, query, cands)
+
+        return [int(docid) for docid in rank], [float(score) for score in scores]
+
+    def format_answers(self, rank, scores, top_k):
+        """Returns the rank, docid, score and text of the top-k answers.
+
+        Returns:
+            answers: List of dictionaries
+        -------------------
+        Arguments:
+            rank - List of re-ranked docids
+            scores - List of the scores of the re-ranked docids
+            top_k - int - number of answers to return
+        """
+        answers = []
+        for i in range(0, min(top_k, len(rank))):
+            answers.append({'rank': i+1,
+                            'docid': rank[i],
+                            'score': scores[i],
+                            'answer': registry.docid_to_text[rank[i]]})
+
+        return answers
 
     def search(self):
         """Search engine. Retrieves and re-ranks the answer candidates given a query.
         Renders the top-k answers for a query.
         """
-        # Download model
-        model_name = get_trained_model("finbert-qa")
-        model_path = path + "/model/trained/finbert-qa/" + model_name
-        # Load model
-        self.model.load_state_dict(torch.load(model_path), strict=False)
-        self.model.eval()
-
-        searcher = pysearch.SimpleSearcher(fiqa_index)
+        self.load_finetuned_model()
         self.k = self.config['top_k']
 
         if self.config['user_input'] == True:
@@ -933,27 +1329,34 @@ class FinBERT_QA():
         else:
             self.query = self.config['query']
 
-        hits = searcher.search(self.query, k=50)
+        print("\nRanking...\n")
+        answers = self.answer(self.query, self.k)
 
-        cands = []
-        
-        for i in range(0, len(hits)):
-            cands.append(int(hits[i].docid))
-
-        if len(cands) == 0:
+        if len(answers) == 0:
             print("\nNo answers found.")
-            sys.exit()
-        else:
-            print("\nRanking...\n")
-            self.rank, self.scores = self.predict(self.model, self.query, cands)
+            return
 
-            print("Question: \n\t{}\n".format(self.query))
+        print("Question: \n\t{}\n".format(self.query))
 
-            if len(cands) < self.k:
-                self.k = len(cands)
-            else:
-                pass
+        self.k = len(answers)
+
+        print("Top-{} Answers: \n".format(self.k))
+        for ans in answers:
+            print("{}.\t{}\n".format(ans['rank'], ans['answer']))
 
-            print("Top-{} Answers: \n".format(self.k))
-            for i in range(0, self.k):
-                print("{}.\t{}\n".format(i+1, docid_to_text[self.rank[i]]))
+def train_worker(local_rank, config):
+    """Trains FinBERT-QA in one process of a distributed training run.
+
+    Arguments:
+        local_rank: int - index of the process on its node
+        config: Dictionary
+    """
+    init_process(local_rank, config)
+    # Gradients are all-reduced over gloo on CPU
+    config = dict(config, device='cpu')
+    # The first process of each node downloads the pre-trained model while
+    # the others wait
+    with local_main_first():
+        qa = FinBERT_QA(config)
+    qa.run_train()
+    destroy_process()
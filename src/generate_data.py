@@ -10,17 +10,16 @@ import sys
 import argparse
 from pathlib import Path
 from sklearn.model_selection import train_test_split
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
 from pathlib import Path
 # os.environ["JAVA_HOME"] = "/usr/lib/jvm/java-11-openjdk-amd64"
-from pyserini.search import pysearch
 
 from utils import *
+from hybrid_retriever import load_searcher, detach_jvm
 
 path = str(Path.cwd())
 
-# Lucene indexer
-fiqa_index = path + "/retriever/lucene-index-fiqa/"
-
 def split_label(qid_docid):
     """
     Split question answer pairs into train, test, validation sets.
@@ -145,7 +144,24 @@ def split_question(train_label, test_label, valid_label, queries):
 
     return train_questions, test_questions, valid_questions
 
-def create_dataset(question_df, labels, cands_size):
+def search_chunk(searcher, queries, cands_size):
+    """Retrieves the top-k candidate answers of a chunk of questions.
+
+    Returns:
+        cands: List of lists of candidate docids, one per question
+    ----------
+    Arguments:
+        searcher: First-stage retriever with a search(query, k) method
+        queries: List of str
+        cands_size: int - number of candidates to retrieve
+    """
+    try:
+        return [[int(hit.docid) for hit in searcher.search(query, k=cands_size)] for query in queries]
+    finally:
+        # Pool threads searching the Lucene index are attached to the JVM
+        detach_jvm()
+
+def create_dataset(question_df, labels, cands_size, searcher, threads=8, chunk_size=32):
     """Retrieves the top-k candidate answers for a question and
     creates a list of lists of the dataset containing the question id,
     list of relevant answer ids, and the list of answer candidates
@@ -157,33 +173,35 @@ def create_dataset(question_df, labels, cands_size):
         question_df: Dataframe containing the qid and question text
         labels: Dictonary containing the qid to text map
         cands_size: int - number of candidates to retrieve
+        searcher: First-stage retriever with a search(query, k) method
+        threads: int - number of search threads
+        chunk_size: int - number of questions per search task of the
+                    retrievers without batch_search
     """
-    dataset = []
-    # Calls retriever
-    searcher = pysearch.SimpleSearcher(fiqa_index)
-    # For each question
-    for i, row in question_df.iterrows():
-        qid = row['qid']
-        tmp = []
-        # Append qid
-        tmp.append(qid)
-        # Append list of relevant docs
-        tmp.append(labels[qid])
-        # Retrieves answer candidates
-        cands = []
-        query = row['question']
-        query = re.sub('[£€§]', '', query)
-        hits = searcher.search(query, k=cands_size)
-
-        for docid in range(0, len(hits)):
-            cands.append(int(hits[docid].docid))
-        # Append candidate answers
-        tmp.append(cands)
-        dataset.append(tmp)
-
-    return dataset
-
-def get_dataset(query_path, labels_path, cands_size):
+    qids = question_df['qid'].tolist()
+    queries = [re.sub('[£€§]', '', query) for query in question_df['question']]
+    progress = tqdm(total=len(queries))
+
+    if hasattr(searcher, 'batch_search'):
+        # Lucene searches all questions in its own Java threads
+        keys = [str(i) for i in range(len(queries))]
+        results = searcher.batch_search(queries, keys, k=cands_size, threads=threads)
+        cands_list = [[int(hit.docid) for hit in results[key]] for key in keys]
+        progress.update(len(queries))
+    else:
+        chunks = [queries[i:i+chunk_size] for i in range(0, len(queries), chunk_size)]
+        cands_list = []
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            # Results arrive in the order of the chunks
+            for cands_chunk in pool.map(lambda chunk: search_chunk(searcher, chunk, cands_size), chunks):
+                cands_list.extend(cands_chunk)
+                progress.update(len(cands_chunk))
+    progress.close()
+
+    # qid, list of relevant docs and candidate answers
+    return [[qid, labels[qid], cands] for qid, cands in zip(qids, cands_list)]
+
+def get_dataset(query_path, labels_path, cands_size, config):
     """Splits the dataset into train, validation, and test set and creates
     the dataset form for training, validation, and testing.
 
@@ -196,6 +214,7 @@ def get_dataset(query_path, labels_path, cands_size):
         query_path: str - path containing a list of qid and questions
         labels_path: str - path containing a list of qid and relevant docid
         cands_size: int - number of candidates to retrieve
+        config: Dictionary with the retriever settings
     """
     # Question id and Question text
     queries = load_questions_to_df(query_path)
@@ -208,12 +227,18 @@ def get_dataset(query_path, labels_path, cands_size):
     train_questions, test_questions, \
     valid_questions = split_question(train_label, test_label, valid_label, queries)
 
-    print("\nGenerating training set...\n")
-    train_set = create_dataset(train_questions, labels, cands_size)
-    print("Generating validation set...\n")
-    valid_set = create_dataset(valid_questions, labels, cands_size)
-    print("Generating test set...\n")
-    test_set = create_dataset(test_questions, labels, cands_size)
+    # Calls retriever
+    searcher = load_searcher(config)
+
+    print("\nGenerating training, validation, and test set...\n")
+    # Each split uses all search threads
+    train_set, valid_set, test_set = [create_dataset(questions, labels, cands_size, searcher, \
+                                                     config.get('threads', 8), \
+                                                     config.get('chunk_size', 32)) \
+                                      for questions in [train_questions, valid_questions, test_questions]]
+
+    if hasattr(searcher, 'stats'):
+        print("Hit cache: {}".format(searcher.stats()))
 
     return train_set, valid_set, test_set
 
@@ -231,6 +256,24 @@ def main():
     help="Number of candidates to retrieve per question.")
     parser.add_argument("--output_dir", default=Path.cwd()/'data/data_pickle/',
     type=str, required=False, help="The output directory where the generated data will be stored.")
+    parser.add_argument("--retriever", default="bm25", type=str, required=False,
+    help="First-stage retriever, 'bm25', 'dense' or 'hybrid'.")
+    parser.add_argument("--bm25_index", default=None, type=str, required=False,
+    help="BM25 index built by src/bm25.py. Replaces the Lucene index with the in-process BM25 engine.")
+    parser.add_argument("--hit_cache", default=None, type=str, required=False,
+    help="Directory of the persistent cache of retrieved candidates.")
+    parser.add_argument("--vector_store", default=None, type=str, required=False,
+    help="Directory of the answer vectors built by src/vector_store.py. Specify only if retriever is 'dense' or 'hybrid'")
+    parser.add_argument("--nprobe", default=0, type=int, required=False,
+    help="Number of IVF clusters searched by the dense retriever, 0 for exhaustive search.")
+    parser.add_argument("--fusion", default="rrf", type=str, required=False,
+    help="Fusion of the hybrid retriever, 'rrf' for reciprocal rank fusion or 'weighted' for weighted scores.")
+    parser.add_argument("--dense_weight", default=0.5, type=float, required=False,
+    help="Weight of the dense retriever in the hybrid fusion. BM25 gets 1 - dense_weight.")
+    parser.add_argument("--threads", default=8, type=int, required=False,
+    help="Number of threads searching the questions of a split, Java threads of the Lucene batch search.")
+    parser.add_argument("--chunk_size", default=32, type=int, required=False,
+    help="Number of questions searched per task by retrievers without a batch search.")
 
     args = parser.parse_args()
 
@@ -238,9 +281,21 @@ def main():
         print("Usage: python3 src/generate_data.py <query_path> <label_path>")
         sys.exit()
 
+    config = {'retriever': args.retriever,
+              'bm25_index': args.bm25_index,
+              'hit_cache': args.hit_cache,
+              'vector_store': args.vector_store,
+              'nprobe': args.nprobe,
+              'fusion': args.fusion,
+              'dense_weight': args.dense_weight,
+              'threads': args.threads,
+              'chunk_size': args.chunk_size,
+              'device': 'cpu'}
+
     train_set, valid_set, test_set = get_dataset(args.query_path, \
                                                  args.label_path, \
-                                                 args.cands_size)
+                                                 args.cands_size, \
+                                                 config)
 
     save_pickle(args.output_dir + "train_set.pickle", train_set)
     save_pickle(args.output_dir + "valid_set.pickle", valid_set)
@@ -0,0 +1,115 @@
+from pathlib import Path
+import threading
+import hashlib
+import json
+import os
+
+from utils import *
+from hits import Hit
+
+path = str(Path.cwd())
+
+default_cache_dir = path + '/data/hit_cache'
+
+def fingerprint(paths, settings):
+    """Returns a short hash identifying the state of index or model files.
+    Rebuilding an index or saving a new checkpoint changes the size or
+    modification time of its files and therefore the fingerprint.
+
+    Arguments:
+        paths: List of files or directories, None entries are skipped
+        settings: Dictionary of settings affecting the results
+    """
+    h = hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    for index_path in paths:
+        if index_path is None:
+            continue
+        if os.path.isdir(index_path):
+            files = sorted(os.path.join(root, name) for root, dirs, names in os.walk(index_path) for name in names)
+        else:
+            files = [index_path]
+        for name in files:
+            if os.path.exists(name):
+                stat = os.stat(name)
+                h.update("{}:{}:{}".format(os.path.relpath(name, index_path), stat.st_size, int(stat.st_mtime)).encode('utf-8'))
+
+    return h.hexdigest()[:16]
+
+class CachedSearcher():
+    """Persistent cache of the ranked hits of a searcher, with the search
+    interface of the Lucene SimpleSearcher.
+
+    The hits of a query are kept at the largest depth requested so far, so a
+    smaller k is served by slicing and only new or deeper queries reach the
+    searcher. Entries are appended to a JSON lines file named after the index
+    fingerprint, so a rebuilt index starts a new cache.
+    """
+    def __init__(self, searcher, cache_dir, index_fingerprint):
+        """Loads the cached hits of the fingerprint.
+
+        Arguments:
+            searcher: Object with a search(query, k) method
+            cache_dir: str - directory of the cache files
+            index_fingerprint: str - fingerprint of the retriever indexes
+        """
+        self.searcher = searcher
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_path = os.path.join(cache_dir, 'hits-{}.jsonl'.format(index_fingerprint))
+        # Query hash to (depth, docids, scores)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Skip a line cut off by an interrupted write
+                        continue
+                    # Later entries are deeper
+                    self.cache[entry['key']] = (entry['depth'], entry['docids'], entry['scores'])
+
+    def key(self, query):
+        return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+    def search(self, query, k=10):
+        """Retrieves the top-k answers of a question from the cache or the
+        searcher.
+
+        Returns:
+            hits: List of Hit objects, highest score first
+        ----------
+        Arguments:
+            query: str
+            k: int
+        """
+        key = self.key(query)
+        entry = self.cache.get(key)
+
+        # Served if cached deep enough or the searcher returned all it had
+        if entry is not None and (entry[0] >= k or len(entry[1]) < entry[0]):
+            with self.lock:
+                self.hits += 1
+            depth, docids, scores = entry
+        else:
+            hits = self.searcher.search(query, k=k)
+            depth, docids, scores = k, [str(hit.docid) for hit in hits], [float(hit.score) for hit in hits]
+            with self.lock:
+                self.misses += 1
+                self.cache[key] = (depth, docids, scores)
+                with open(self.cache_path, 'a') as f:
+                    f.write(json.dumps({'key': key, 'depth': depth, 'docids': docids, 'scores': scores}) + '\n')
+
+        return [Hit(docid, score) for docid, score in zip(docids[:k], scores[:k])]
+
+    def stats(self):
+        """Returns the number of cached queries and the cache hits and misses.
+        """
+        return {'queries': len(self.cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/max(1, self.hits + self.misses)}
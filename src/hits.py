@@ -0,0 +1,6 @@
+class Hit():
+    """Retrieved answer with the docid and score attributes of a Lucene hit.
+    """
+    def __init__(self, docid, score):
+        self.docid = str(docid)
+        self.score = float(score)
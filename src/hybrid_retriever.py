@@ -0,0 +1,205 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import sys
+
+from utils import *
+from hits import Hit
+
+path = str(Path.cwd())
+
+# Lucene index
+fiqa_index = path + "/retriever/lucene-index-fiqa"
+
+def rrf_fusion(hit_lists, weights, rrf_k=60):
+    """Reciprocal rank fusion. Each answer scores the weighted sum of
+    1/(rrf_k + rank) over the retrievers that returned it.
+
+    Returns:
+        fused: Dictionary mapping docid to fused score
+    ----------
+    Arguments:
+        hit_lists: List of lists of hits, one per retriever
+        weights: List of floats, one per retriever
+        rrf_k: int - rank offset damping the top ranks
+    """
+    fused = {}
+    for hits, weight in zip(hit_lists, weights):
+        for rank, hit in enumerate(hits):
+            docid = int(hit.docid)
+            fused[docid] = fused.get(docid, 0.0) + weight/(rrf_k + rank + 1)
+
+    return fused
+
+def weighted_fusion(hit_lists, weights):
+    """Weighted sum of the retriever scores, each min-max normalized to [0, 1]
+    over the hits of the query. Answers missing from a list score 0 for it.
+
+    Returns:
+        fused: Dictionary mapping docid to fused score
+    ----------
+    Arguments:
+        hit_lists: List of lists of hits, one per retriever
+        weights: List of floats, one per retriever
+    """
+    fused = {}
+    for hits, weight in zip(hit_lists, weights):
+        if len(hits) == 0:
+            continue
+        scores = np.array([hit.score for hit in hits])
+        low, high = scores.min(), scores.max()
+        norm = (scores - low)/(high - low) if high > low else np.ones(len(scores))
+        for hit, score in zip(hits, norm):
+            docid = int(hit.docid)
+            fused[docid] = fused.get(docid, 0.0) + weight*score
+
+    return fused
+
+class HybridSearcher():
+    """Fuses the hits of several first-stage retrievers, with the search
+    interface of the Lucene SimpleSearcher.
+
+    The first retriever runs in the calling thread and the others in worker
+    threads, so BM25 and dense retrieval of a query overlap.
+    """
+    def __init__(self, searchers, weights=None, fusion='rrf', depth=100, rrf_k=60):
+        """Arguments:
+            searchers: List of objects with a search(query, k) method
+            weights: List of floats, one per searcher. Defaults to equal weights
+            fusion: str - 'rrf' or 'weighted'
+            depth: int - number of hits retrieved from each searcher
+            rrf_k: int - rank offset of reciprocal rank fusion
+        """
+        self.searchers = searchers
+        self.weights = weights or [1.0]*len(searchers)
+        self.fusion = fusion
+        self.depth = depth
+        self.rrf_k = rrf_k
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(searchers) - 1))
+
+    def search(self, query, k=10):
+        """Retrieves the top-k fused answers of a question.
+
+        Returns:
+            hits: List of Hit objects, highest fused score first
+        ----------
+        Arguments:
+            query: str
+            k: int
+        """
+        depth = max(k, self.depth)
+        futures = [self.pool.submit(searcher.search, query, depth) for searcher in self.searchers[1:]]
+        hit_lists = [self.searchers[0].search(query, depth)] + [future.result() for future in futures]
+
+        if self.fusion == 'weighted':
+            fused = weighted_fusion(hit_lists, self.weights)
+        else:
+            fused = rrf_fusion(hit_lists, self.weights, self.rrf_k)
+
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+        return [Hit(docid, score) for docid, score in ranked]
+
+def load_bm25(config):
+    """Creates the BM25 retriever, the in-process engine if a native index is
+    given in the config and the Lucene index otherwise.
+
+    Returns:
+        searcher: NativeBM25Searcher or SimpleSearcher object
+    ----------
+    Arguments:
+        config: Dictionary
+    """
+    if config.get('bm25_index') is not None:
+        from bm25 import NativeBM25Searcher
+        return NativeBM25Searcher(config['bm25_index'])
+
+    # Imported here since loading pyserini starts the JVM
+    from pyserini.search import pysearch
+    return pysearch.SimpleSearcher(fiqa_index)
+
+def detach_jvm():
+    """Detaches the calling thread from the JVM of the Lucene searcher.
+    pyjnius attaches every thread searching the Lucene index to the JVM, and
+    a thread has to detach before it exits or the JVM thread leaks.
+    """
+    # Only loaded when the Lucene searcher was started
+    jnius = sys.modules.get('jnius')
+    if jnius is not None:
+        jnius.detach()
+
+def create_searcher(config):
+    """Creates the first-stage retriever given in the config.
+
+    Returns:
+        searcher: SimpleSearcher, NativeBM25Searcher, DenseSearcher or
+                  HybridSearcher object
+    ----------
+    Arguments:
+        config: Dictionary with the retriever 'bm25', 'dense' or 'hybrid'
+    """
+    retriever = config.get('retriever', 'bm25')
+
+    if retriever in ['dense', 'hybrid']:
+        # Imported here so BM25 retrieval does not build the QA-LSTM model
+        from dense_retriever import DenseSearcher
+        dense = DenseSearcher(config)
+        if retriever == 'dense':
+            return dense
+
+    bm25 = load_bm25(config)
+
+    if retriever == 'hybrid':
+        dense_weight = config.get('dense_weight', 0.5)
+        return HybridSearcher([bm25, dense],
+                              weights=[1 - dense_weight, dense_weight],
+                              fusion=config.get('fusion', 'rrf'),
+                              depth=config.get('fusion_depth', 100))
+
+    return bm25
+
+def load_searcher(config):
+    """Creates the first-stage retriever given in the config, wrapped in a
+    persistent hit cache if a cache directory is configured.
+
+    Returns:
+        searcher: Object with a search(query, k) method
+    ----------
+    Arguments:
+        config: Dictionary with the retriever 'bm25', 'dense' or 'hybrid'
+    """
+    searcher = create_searcher(config)
+    if config.get('hit_cache') is None:
+        return searcher
+
+    from hit_cache import CachedSearcher, fingerprint
+    paths, settings = retriever_state(config)
+
+    return CachedSearcher(searcher, config['hit_cache'], fingerprint(paths, settings))
+
+def retriever_state(config):
+    """Returns the index paths and the settings the retrieved hits depend on.
+
+    Returns:
+        paths: List of index files or directories
+        settings: Dictionary
+    ----------
+    Arguments:
+        config: Dictionary
+    """
+    from vector_store import default_store_dir
+
+    retriever = config.get('retriever', 'bm25')
+    paths = []
+    if retriever in ['bm25', 'hybrid']:
+        paths.append(config.get('bm25_index') or fiqa_index)
+    if retriever in ['dense', 'hybrid']:
+        paths.append(config.get('vector_store') or default_store_dir)
+    settings = {'retriever': retriever,
+                'nprobe': config.get('nprobe', 0),
+                'qa_lstm_model_path': config.get('qa_lstm_model_path'),
+                'fusion': config.get('fusion', 'rrf'),
+                'dense_weight': config.get('dense_weight', 0.5),
+                'fusion_depth': config.get('fusion_depth', 100)}
+
+    return paths, settings
@@ -0,0 +1,397 @@
+from numpy.lib.format import open_memmap
+from tqdm import tqdm
+import numpy as np
+import hashlib
+import random
+import shutil
+import socket
+import torch
+import json
+import os
+from torch.utils.data import Dataset
+
+from utils import *
+from registry import *
+from answer_store import token_dtype
+from hit_cache import fingerprint
+
+def compact_tensors(encoded_seq, dtype):
+    """Converts an encoded QA pair into its compact tensors. The attention
+    mask and token type ids are replaced by the sequence length and the
+    start of the answer segment.
+
+    Returns:
+        input_ids: Torch tensor of dtype
+        length: Torch tensor - number of non-padding tokens
+        segment: Torch tensor - position of the first answer token
+    ----------
+    Arguments:
+        encoded_seq: Dictionary with input_ids, token_type_ids and
+                     attention_mask padded to max_seq_len
+        dtype: Numpy integer type of the token ids
+    """
+    length = sum(encoded_seq['attention_mask'])
+    # Question tokens with [CLS] and [SEP] have token type 0
+    segment = length - sum(encoded_seq['token_type_ids'])
+
+    return torch.from_numpy(np.asarray(encoded_seq['input_ids'], dtype=dtype)), \
+           torch.tensor(length, dtype=torch.long), \
+           torch.tensor(segment, dtype=torch.long)
+
+def expand_inputs(input_ids, lengths, segments):
+    """Rebuilds the BERT inputs of a batch of compact QA pairs on the device
+    of the batch.
+
+    Returns:
+        input_ids: Torch tensor of int64 token ids
+        token_type_ids: Torch tensor, 1 for the answer tokens
+        att_masks: Torch tensor, 0 for the padding tokens
+    ----------
+    Arguments:
+        input_ids: Torch tensor (batch_size, max_seq_len) of int16 or int32
+        lengths: Torch tensor (batch_size,) of sequence lengths
+        segments: Torch tensor (batch_size,) of answer segment starts
+    """
+    positions = torch.arange(input_ids.size(1), device=input_ids.device).unsqueeze(0)
+    att_masks = positions < lengths.unsqueeze(1)
+    token_type_ids = (positions >= segments.unsqueeze(1)) & att_masks
+
+    return input_ids.long(), token_type_ids.long(), att_masks.long()
+
+def load_texts(encoder):
+    """Loads the answer texts an encoder reads before the DataLoader forks
+    its workers, so they share one copy instead of loading one each.
+
+    Arguments:
+        encoder: PairEncoder object
+    """
+    if encoder.answer_store is None:
+        registry.docid_to_text
+
+def pair_key(q_idx, docid):
+    """Returns the int64 key of a (question index, docid) pair, question
+    index in the upper 32 bits.
+    """
+    return (np.int64(q_idx) << 32) | np.int64(docid)
+
+def tokenizer_hash(tokenizer):
+    """Returns a hash of the vocabulary and casing of a BERT tokenizer.
+    """
+    h = hashlib.sha1(str(tokenizer.init_kwargs.get('do_lower_case')).encode('utf-8'))
+    for token, token_id in sorted(tokenizer.vocab.items(), key=lambda item: item[1]):
+        h.update("{}\t{}\n".format(token, token_id).encode('utf-8'))
+
+    return h.hexdigest()[:16]
+
+class EncodedPairCache():
+    """Memory-mapped QA pairs of a dataset encoded once.
+
+    For every question the candidates and the relevant answers are stored,
+    sorted by pair_key. input_ids.npy holds the padded token ids in int16
+    (int32 for vocabularies over 32767 tokens), next to the sequence lengths
+    and the starts of the answer segments.
+    """
+    def __init__(self, cache_dir):
+        """Opens the cache.
+
+        Arguments:
+            cache_dir: str - directory created by build_pair_cache
+        """
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.max_seq_len = self.meta['max_seq_len']
+        self.keys = np.load(os.path.join(cache_dir, 'keys.npy'))
+        self.input_ids = np.load(os.path.join(cache_dir, 'input_ids.npy'), mmap_mode='r')
+        self.lengths = np.load(os.path.join(cache_dir, 'lengths.npy'), mmap_mode='r')
+        self.segments = np.load(os.path.join(cache_dir, 'segments.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def row(self, q_idx, docid):
+        """Returns the row of a pair.
+        """
+        key = pair_key(q_idx, docid)
+        row = np.searchsorted(self.keys, key)
+        if row == len(self.keys) or self.keys[row] != key:
+            raise KeyError((q_idx, docid))
+
+        return row
+
+    def tensors(self, q_idx, docid):
+        """Returns the compact tensors of a pair, see compact_tensors.
+
+        Arguments:
+            q_idx: int - index of the question in the dataset
+            docid: int
+        """
+        row = self.row(q_idx, docid)
+
+        return torch.from_numpy(np.array(self.input_ids[row])), \
+               torch.tensor(int(self.lengths[row]), dtype=torch.long), \
+               torch.tensor(int(self.segments[row]), dtype=torch.long)
+
+def build_pair_cache(dataset, encoder, cache_dir):
+    """Encodes the candidates and relevant answers of every question of a
+    dataset and saves them into cache_dir.
+
+    Arguments:
+        dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
+        encoder: PairEncoder object
+        cache_dir: str - output directory
+    """
+    max_seq_len = encoder.max_seq_len
+    pairs = {}
+    for q_idx, seq in enumerate(dataset):
+        for docid in list(seq[2]) + list(seq[1]):
+            pairs[int(pair_key(q_idx, docid))] = (q_idx, docid)
+    keys = np.array(sorted(pairs), dtype=np.int64)
+
+    # Written to a temporary directory so an interrupted build is not used.
+    # The directory is unique to the process, since the nodes of a
+    # distributed run may build the same cache on a shared filesystem
+    tmp_dir = '{}.tmp-{}-{}'.format(cache_dir, socket.gethostname(), os.getpid())
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    dtype = token_dtype(encoder.tokenizer.vocab)
+    input_ids = open_memmap(os.path.join(tmp_dir, 'input_ids.npy'), mode='w+', \
+                            dtype=dtype, shape=(len(keys), max_seq_len))
+    lengths = np.zeros(len(keys), dtype=np.int16)
+    segments = np.zeros(len(keys), dtype=np.int16)
+
+    for row, key in enumerate(tqdm(keys)):
+        q_idx, docid = pairs[int(key)]
+        q_text = registry.qid_to_text[dataset[q_idx][0]]
+        encoded_seq = encoder.encode(q_text, docid, pad=False)
+        ids = encoded_seq['input_ids'][:max_seq_len]
+        input_ids[row, :len(ids)] = ids
+        input_ids[row, len(ids):] = encoder.tokenizer.pad_token_id
+        lengths[row] = len(ids)
+        # Question tokens with [CLS] and [SEP] have token type 0
+        segments[row] = len(ids) - sum(encoded_seq['token_type_ids'][:max_seq_len])
+
+    input_ids.flush()
+    del input_ids
+    np.save(os.path.join(tmp_dir, 'keys.npy'), keys)
+    np.save(os.path.join(tmp_dir, 'lengths.npy'), lengths)
+    np.save(os.path.join(tmp_dir, 'segments.npy'), segments)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'max_seq_len': max_seq_len,
+                   'num_pairs': len(keys),
+                   'num_questions': len(dataset)}, f)
+
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # Another node finished the same cache first
+        if not os.path.isdir(cache_dir):
+            raise
+        shutil.rmtree(tmp_dir)
+
+def load_pair_cache(dataset, dataset_path, encoder, cache_root):
+    """Opens the encoded pairs of a dataset, encoding them on the first use.
+    The cache is keyed by the dataset file, the tokenizer and max_seq_len.
+
+    Returns:
+        pair_cache: EncodedPairCache object
+    ----------
+    Arguments:
+        dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
+        dataset_path: str - pickle file the dataset was loaded from
+        encoder: PairEncoder object
+        cache_root: str - directory of the pair caches
+    """
+    settings = {'dataset': os.path.basename(dataset_path),
+                'tokenizer': tokenizer_hash(encoder.tokenizer),
+                'max_seq_len': encoder.max_seq_len}
+    cache_dir = os.path.join(cache_root, fingerprint([dataset_path], settings))
+
+    if not os.path.isdir(cache_dir):
+        print("Encoding {} into {}...".format(dataset_path, cache_dir))
+        if not os.path.isdir(cache_root):
+            os.makedirs(cache_root)
+        build_pair_cache(dataset, encoder, cache_dir)
+
+    return EncodedPairCache(cache_dir)
+
+class PairSource():
+    """Tensors of the QA pairs of a dataset, from an EncodedPairCache if one
+    is given and encoded on the fly otherwise.
+    """
+    def __init__(self, dataset, encoder, pair_cache=None):
+        """Arguments:
+            dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
+            encoder: PairEncoder object padding to max_seq_len
+            pair_cache: EncodedPairCache object of the dataset or None
+        """
+        self.encoder = encoder
+        self.pair_cache = pair_cache
+        self.dtype = token_dtype(encoder.tokenizer.vocab)
+        self.questions = None
+        if pair_cache is None:
+            load_texts(encoder)
+            # Question texts in the order of the dataset
+            self.questions = [registry.qid_to_text[seq[0]] for seq in dataset]
+
+    def tensors(self, q_idx, docid):
+        """Returns the compact tensors of a pair, see compact_tensors.
+
+        Arguments:
+            q_idx: int - index of the question in the dataset
+            docid: int
+        """
+        if self.pair_cache is not None:
+            return self.pair_cache.tensors(q_idx, docid)
+
+        return compact_tensors(self.encoder.encode(self.questions[q_idx], docid), self.dtype)
+
+class PointwiseDataset(Dataset):
+    """QA pairs of a dataset with relevancy labels, encoded when they are
+    read so DataLoader workers tokenize the batches while the model trains,
+    or read from an EncodedPairCache. Pairs are returned in the compact form
+    of compact_tensors and expanded per batch with expand_inputs.
+
+    Only the question texts and a compact index of the pairs are held in
+    memory.
+    """
+    def __init__(self, dataset, encoder, pair_cache=None):
+        """Indexes every (question, candidate) pair of the dataset.
+
+        Arguments:
+            dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
+            encoder: PairEncoder object padding to max_seq_len
+            pair_cache: EncodedPairCache object of the dataset or None
+        """
+        self.source = PairSource(dataset, encoder, pair_cache)
+        num_pairs = sum(len(seq[2]) for seq in dataset)
+        # Question index, answer docid and label of each pair
+        self.question_index = np.zeros(num_pairs, dtype=np.int32)
+        self.docids = np.zeros(num_pairs, dtype=np.int64)
+        self.labels = np.zeros(num_pairs, dtype=np.int8)
+
+        i = 0
+        for q_idx, seq in enumerate(dataset):
+            ans_labels, cands = set(seq[1]), seq[2]
+            for docid in cands:
+                self.question_index[i] = q_idx
+                self.docids[i] = docid
+                # Positive label if the answer is relevant
+                self.labels[i] = 1 if docid in ans_labels else 0
+                i += 1
+
+    def __len__(self):
+        return len(self.docids)
+
+    def __getitem__(self, i):
+        """Returns the input_ids, length, answer segment start and label
+        tensors of a pair.
+        """
+        tensors = self.source.tensors(int(self.question_index[i]), int(self.docids[i]))
+
+        return tensors + (torch.tensor(int(self.labels[i]), dtype=torch.long),)
+
+class PairwiseDataset(Dataset):
+    """Positive and negative QA pairs of a dataset, encoded when they are
+    read. Each negative candidate of a question is paired with one positive
+    answer chosen at random when the dataset is indexed.
+    """
+    def __init__(self, dataset, encoder, pair_cache=None):
+        """Indexes every (question, positive, negative) triple of the dataset.
+
+        Arguments:
+            dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
+            encoder: PairEncoder object padding to max_seq_len
+            pair_cache: EncodedPairCache object of the dataset or None
+        """
+        self.source = PairSource(dataset, encoder, pair_cache)
+        question_index = []
+        pos_docids = []
+        neg_docids = []
+
+        for q_idx, seq in enumerate(dataset):
+            ans_labels, cands = seq[1], seq[2]
+            # Get a list of negative candidate answers
+            filtered_cands = list(set(cands)-set(ans_labels))
+            # Select a positive answer from the labels
+            pos_docid = random.choice(ans_labels)
+            question_index += [q_idx]*len(filtered_cands)
+            pos_docids += [pos_docid]*len(filtered_cands)
+            neg_docids += filtered_cands
+
+        self.question_index = np.array(question_index, dtype=np.int32)
+        self.pos_docids = np.array(pos_docids, dtype=np.int64)
+        self.neg_docids = np.array(neg_docids, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.neg_docids)
+
+    def __getitem__(self, i):
+        """Returns the input_ids, length, answer segment start and label
+        tensors of the positive pair followed by those of the negative pair.
+        """
+        q_idx = int(self.question_index[i])
+        pos_tensors = self.source.tensors(q_idx, int(self.pos_docids[i]))
+        neg_tensors = self.source.tensors(q_idx, int(self.neg_docids[i]))
+
+        return pos_tensors + (torch.tensor(1, dtype=torch.long),) + \
+               neg_tensors + (torch.tensor(0, dtype=torch.long),)
+
+class PairwiseGroupDataset(Dataset):
+    """Negative candidates of a question grouped with one shared positive
+    answer. Each item is a group scored in a single forward pass: the
+    positive pair followed by up to group_size negative pairs, so the
+    positive is encoded and scored once per group instead of once per
+    negative.
+    """
+    def __init__(self, dataset, encoder, group_size, pair_cache=None):
+        """Splits the negatives of every question into groups.
+
+        Arguments:
+            dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
+            encoder: PairEncoder object padding to max_seq_len
+            group_size: int - maximum number of negatives per group
+            pair_cache: EncodedPairCache object of the dataset or None
+        """
+        self.source = PairSource(dataset, encoder, pair_cache)
+        question_index = []
+        pos_docids = []
+        neg_docids = []
+        # Start of the negatives of each group in neg_docids
+        offsets = [0]
+
+        for q_idx, seq in enumerate(dataset):
+            ans_labels, cands = seq[1], seq[2]
+            # Get a list of negative candidate answers
+            filtered_cands = list(set(cands)-set(ans_labels))
+            # Select a positive answer from the labels
+            pos_docid = random.choice(ans_labels)
+            for start in range(0, len(filtered_cands), group_size):
+                group = filtered_cands[start:start + group_size]
+                question_index.append(q_idx)
+                pos_docids.append(pos_docid)
+                neg_docids += group
+                offsets.append(offsets[-1] + len(group))
+
+        self.question_index = np.array(question_index, dtype=np.int32)
+        self.pos_docids = np.array(pos_docids, dtype=np.int64)
+        self.neg_docids = np.array(neg_docids, dtype=np.int64)
+        self.offsets = np.array(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.pos_docids)
+
+    def __getitem__(self, i):
+        """Returns the input_ids, lengths, answer segment starts and labels
+        of a group, the positive pair in the first row.
+        """
+        q_idx = int(self.question_index[i])
+        docids = [int(self.pos_docids[i])] + \
+                 self.neg_docids[self.offsets[i]:self.offsets[i+1]].tolist()
+        rows = [self.source.tensors(q_idx, docid) for docid in docids]
+        labels = torch.zeros(len(docids), dtype=torch.long)
+        labels[0] = 1
+
+        return tuple(torch.stack(tensors) for tensors in zip(*rows)) + (labels,)
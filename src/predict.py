@@ -17,6 +17,40 @@ def main():
     help="Top-k answers to output.")
     parser.add_argument("--device", default='gpu', type=str, required=False,
     help="Specify 'gpu' or 'cpu'")
+    parser.add_argument("--score_batch_size", default=16, type=int, required=False,
+    help="Number of QA pairs to score per forward pass when re-ranking.")
+    parser.add_argument("--dynamic_padding", default=False, \
+                        action="store_true", \
+                        help="Pad each batch to its longest QA pair instead of max_seq_len.")
+    parser.add_argument("--bucket_width", default=32, type=int, required=False,
+    help="Range of sequence lengths batched together when dynamic_padding is used.")
+    parser.add_argument("--answer_store", default=None, type=str, required=False,
+    help="Directory of the pre-tokenized answers built by src/answer_store.py.")
+    parser.add_argument("--quantized", default=False, \
+                        action="store_true", \
+                        help="Apply int8 dynamic quantization to the fine-tuned model. Runs on CPU.")
+    parser.add_argument("--quantized_model", default=None, type=str, required=False,
+    help="Path to a quantized model saved by src/export_model.py. Runs on CPU.")
+    parser.add_argument("--torchscript_model", default=None, type=str, required=False,
+    help="Path to a TorchScript model saved by src/export_model.py.")
+    parser.add_argument("--retriever", default="bm25", type=str, required=False,
+    help="First-stage retriever, 'bm25', 'dense' or 'hybrid'.")
+    parser.add_argument("--bm25_index", default=None, type=str, required=False,
+    help="BM25 index built by src/bm25.py. Replaces the Lucene index with the in-process BM25 engine.")
+    parser.add_argument("--hit_cache", default=None, type=str, required=False,
+    help="Directory of the persistent cache of retrieved candidates.")
+    parser.add_argument("--vector_store", default=None, type=str, required=False,
+    help="Directory of the answer vectors built by src/vector_store.py. Specify only if retriever is 'dense' or 'hybrid'")
+    parser.add_argument("--nprobe", default=0, type=int, required=False,
+    help="Number of IVF clusters searched by the dense retriever, 0 for exhaustive search.")
+    parser.add_argument("--fusion", default="rrf", type=str, required=False,
+    help="Fusion of the hybrid retriever, 'rrf' for reciprocal rank fusion or 'weighted' for weighted scores.")
+    parser.add_argument("--dense_weight", default=0.5, type=float, required=False,
+    help="Weight of the dense retriever in the hybrid fusion. BM25 gets 1 - dense_weight.")
+    parser.add_argument("--num_cands", default=50, type=int, required=False,
+    help="Number of candidates retrieved and re-ranked per query.")
+    parser.add_argument("--score_cache", default=None, type=str, required=False,
+    help="Directory of the persistent cache of QA pair scores.")
 
 
     args = parser.parse_args()
@@ -26,7 +60,23 @@ def main():
               'top_k': args.top_k,
               'bert_model_name': 'bert-qa',
               'device': args.device,
-              'max_seq_len': 512}
+              'max_seq_len': 512,
+              'score_batch_size': args.score_batch_size,
+              'dynamic_padding': args.dynamic_padding,
+              'bucket_width': args.bucket_width,
+              'answer_store': args.answer_store,
+              'quantized': args.quantized,
+              'quantized_model': args.quantized_model,
+              'torchscript_model': args.torchscript_model,
+              'retriever': args.retriever,
+              'bm25_index': args.bm25_index,
+              'hit_cache': args.hit_cache,
+              'vector_store': args.vector_store,
+              'nprobe': args.nprobe,
+              'fusion': args.fusion,
+              'dense_weight': args.dense_weight,
+              'num_cands': args.num_cands,
+              'score_cache': args.score_cache}
 
     FinBERT_QA(config).search()
 
@@ -1,10 +1,9 @@
 import regex as re
-import nltk
-nltk.download('punkt')
+# wordpunct_tokenize is regex based and needs no downloaded tokenizer models
 from nltk.tokenize import wordpunct_tokenize
 from collections import Counter
 
-from .utils import *
+from utils import *
 
 def pre_process(text):
     """Returns a lower-cased string with punctuations and special characters removed.
@@ -25,6 +24,18 @@ def pre_process(text):
 
     return processed_text
 
+def tokenize(text):
+    """Returns the tokens of a question or answer, processed the same way as
+    the QA-LSTM training data.
+
+    Returns:
+        tokens: List of str
+    ----------
+    Arguments:
+        text: str of answer or question text
+    """
+    return wordpunct_tokenize(pre_process(text))
+
 def process_questions(queries):
     """Returns a dataframe with tokenized questions.
 
@@ -5,12 +5,14 @@ import random
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import TensorDataset, DataLoader, RandomSampler, SequentialSampler
-import torchtext
+from torch.utils.data import Dataset, DataLoader, RandomSampler, SequentialSampler
 from tqdm import tqdm
 
 from utils import *
 from evaluate import *
+from registry import *
+from vector_store import *
+from answer_store import token_dtype
 
 # Set the random seed manually for reproducibility.
 torch.backends.cudnn.deterministic = True
@@ -18,15 +20,6 @@ torch.manual_seed(1234)
 
 path = str(Path.cwd())
 
-# Dictonary with token to id mapping
-vocab = load_pickle(path + "/data/qa_lstm_tokenizer/word2index.pickle")
-# Dictonary with qid to tokenized text mapping
-qid_to_tokenized_text = load_pickle(path + '/data/qa_lstm_tokenizer/qid_to_tokenized_text.pickle')
-# Dictionary with docid to tokenized text mapping
-docid_to_tokenized_text = load_pickle(path + '/data/qa_lstm_tokenizer/docid_to_tokenized_text.pickle')
-# Labels
-labels = load_pickle(path + '/data/data_pickle/labels.pickle')
-
 class LSTM_MODEL(nn.Module):
     """
     QA-LSTM model
@@ -45,9 +38,13 @@ class LSTM_MODEL(nn.Module):
         # Dropout rate
         self.dropout = config['dropout']
         # Vocabulary size
-        self.vocab_size = len(vocab)
-        # Create embedding layer
-        self.embedding = self.create_emb_layer()
+        self.vocab_size = len(registry.vocab)
+        # Create embedding layer, initialized with GloVe unless the weights
+        # are loaded from a trained model afterwards
+        if config.get('glove', True):
+            self.embedding = self.create_emb_layer()
+        else:
+            self.embedding = nn.Embedding(self.vocab_size, self.emb_dim)
         # The question and answer representations share the same biLSTM network
         self.lstm = nn.LSTM(self.emb_dim, \
                             self.hidden_size, \
@@ -68,6 +65,8 @@ class LSTM_MODEL(nn.Module):
         """
         print("\nInitializing model...")
         print("\nDownloading pre-trained GloVe embeddings...\n")
+        # Imported here since torchtext is slow to import
+        import torchtext
         # Use GloVe embeddings from torchtext
         emb = torchtext.vocab.GloVe("6B", dim=self.emb_dim)
         # Dictionary mapping of word idx to GloVe vectors
@@ -75,7 +74,7 @@ class LSTM_MODEL(nn.Module):
         # Count
         words_found = 0
 
-        for token, idx in vocab.items():
+        for token, idx in registry.vocab.items():
             # emb.stoi is a dict of token to idx mapping
             # If token from the vocabulary exist in GloVe
             if token in emb.stoi:
@@ -96,41 +95,74 @@ class LSTM_MODEL(nn.Module):
 
         return emb_layer
 
-    def forward(self, question, answer):
-        """Forward pass to generate biLSTM representations for the question and
-        answer independently, and then utilize cosine similarity to measure
-        their distance.
+    def encode(self, seq):
+        """Generates the max-pooled biLSTM representation of a batch of
+        sequences. Questions and answers share the same network.
 
         Returns:
-            similarity: Torch tensor with cosine similarity score.
+            output: Torch tensor - (batch_size, 2*hidden_size)
         ----------
         Arguements:
-            question: Torch tensor of vectorized question
-            answer: Torch tensor of vectorized answer
+            seq: Torch tensor of vectorized sequences
         """
-        # Embedding layers - (batch_size, max_seq_len, emb_dim)
-        question_embedding = self.embedding(question)
-        answer_embedding = self.embedding(answer)
+        # Embedding layer - (batch_size, max_seq_len, emb_dim)
+        embedding = self.embedding(seq)
 
         # biLSTM - (batch_size, max_seq_len, 2*hidden_size)
-        question_lstm, (hidden, cell) = self.lstm(question_embedding)
-        answer_lstm, (hidden, cell) = self.lstm(answer_embedding)
+        lstm, (hidden, cell) = self.lstm(embedding)
 
         # Max-pooling - (batch_size, 2*hidden_size)
         # There are n word level biLSTM representations where n is the max_seq_len
         # Use max pooling to generate the best representation
-        question_maxpool = torch.max(question_lstm, 1)[0]
-        answer_maxpool = torch.max(answer_lstm, 1)[0]
+        maxpool = torch.max(lstm, 1)[0]
 
         # Apply dropout
-        question_output = self.dropout(question_maxpool)
-        answer_output = self.dropout(answer_maxpool)
+        output = self.dropout(maxpool)
+
+        return output
+
+    def forward(self, question, answer):
+        """Forward pass to generate biLSTM representations for the question and
+        answer independently, and then utilize cosine similarity to measure
+        their distance.
+
+        Returns:
+            similarity: Torch tensor with cosine similarity score.
+        ----------
+        Arguements:
+            question: Torch tensor of vectorized question
+            answer: Torch tensor of vectorized answer
+        """
+        question_output = self.encode(question)
+        answer_output = self.encode(answer)
 
         # Similarity -(batch_size,)
         similarity = self.sim(question_output, answer_output)
 
         return similarity
 
+class TripleDataset(Dataset):
+    """Training triples of a question, a positive and a negative answer,
+    gathered from the rows of compact question and answer buffers.
+    """
+    def __init__(self, questions, answers, triples):
+        """Arguments:
+            questions: Numpy array (num questions, max_seq_len)
+            answers: Numpy array (num answers, max_seq_len)
+            triples: Numpy array (num triples, 3) of buffer rows
+        """
+        self.questions = torch.from_numpy(questions)
+        self.answers = torch.from_numpy(answers)
+        self.triples = triples
+
+    def __len__(self):
+        return len(self.triples)
+
+    def __getitem__(self, i):
+        q_row, pos_row, neg_row = self.triples[i]
+
+        return self.questions[q_row], self.answers[pos_row], self.answers[neg_row]
+
 class QA_LSTM():
     """QA-LSTM model
     """
@@ -151,6 +183,8 @@ class QA_LSTM():
         self.max_seq_len = self.config['max_seq_len']
         # Initialize model
         self.model = LSTM_MODEL(self.config).to(self.device)
+        # Pre-computed answer vectors or None to encode the candidates per query
+        self.vector_store = load_vector_store(self.config)
 
     def hinge_loss(self, pos_sim, neg_sim):
         """
@@ -197,53 +231,70 @@ class QA_LSTM():
             seq: List of tokens in a sequence
         """
         # Map tokens in seq to idx
+        vocab = registry.vocab
         seq_idx = [vocab[token] for token in seq]
         # Pad seq idx
         vectorized_seq = self.pad_seq(seq_idx)
 
         return vectorized_seq
 
+    def vectorize_into(self, seq, buffer_row):
+        """Writes a vectorized sequence into a row of a zero-initialized
+        buffer, truncated to max_seq_len. The rest of the row is padding.
+
+        Arguements:
+            seq: List of tokens in a sequence
+            buffer_row: Numpy array of length max_seq_len
+        """
+        vocab = registry.vocab
+        seq_idx = [vocab[token] for token in seq[:self.max_seq_len]]
+        buffer_row[:len(seq_idx)] = seq_idx
+
     def get_input_data(self, dataset):
-        """Creates input data for model.
+        """Creates input data for model. Every question and answer is
+        vectorized once into a preallocated buffer and the training triples
+        refer to their rows.
 
         Returns:
-            q_input_ids: List of lists of vectorized question sequence
-            pos_input_ids: List of lists of vectorized positve ans sequence
-            neg_input_ids: List of lists of vectorized negative ans sequence
+            questions: Numpy array (num questions, max_seq_len) of vectorized
+                       questions
+            answers: Numpy array (num answers, max_seq_len) of vectorized
+                     answers
+            triples: Numpy array (num triples, 3) of the rows of the
+                     question, positive answer and negative answer
         ----------
         Arguements:
             dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
         """
-        q_input_ids = []
-        pos_input_ids = []
-        neg_input_ids = []
-
-        for i, seq in enumerate(tqdm(dataset)):
+        # Vocabulary ids fit into 16 bit integers for small vocabularies
+        dtype = token_dtype(registry.vocab)
+        questions = np.zeros((len(dataset), self.max_seq_len), dtype=dtype)
+        # Docid to row in answers
+        answer_rows = {}
+        triples = []
+
+        for q_row, seq in enumerate(tqdm(dataset)):
             qid, ans_labels, cands = seq[0], seq[1], seq[2]
 
             # Remove the positive answers for the candidates
             filtered_cands = list(set(cands)-set(ans_labels))
             # Select a positive answer from the list of positive answers
             pos_docid = random.choice(ans_labels)
-            # Map question id to text
-            q_text = qid_to_tokenized_text[qid]
-            # Pad and vectorize text
-            q_input_id = self.vectorize(q_text)
+            # Map question id to text, pad and vectorize
+            self.vectorize_into(registry.qid_to_tokenized_text[qid], questions[q_row])
 
             # For all the negative answers
             for neg_docid in filtered_cands:
-                # Map the docid to text
-                pos_ans_text = docid_to_tokenized_text[pos_docid]
-                neg_ans_text = docid_to_tokenized_text[neg_docid]
-                # Pad and vectorize sequences
-                pos_input_id = self.vectorize(pos_ans_text)
-                neg_input_id = self.vectorize(neg_ans_text)
+                pos_row = answer_rows.setdefault(pos_docid, len(answer_rows))
+                neg_row = answer_rows.setdefault(neg_docid, len(answer_rows))
+                triples.append((q_row, pos_row, neg_row))
 
-                q_input_ids.append(q_input_id)
-                pos_input_ids.append(pos_input_id)
-                neg_input_ids.append(neg_input_id)
+        answers = np.zeros((len(answer_rows), self.max_seq_len), dtype=dtype)
+        for docid, row in answer_rows.items():
+            # Map the docid to text, pad and vectorize
+            self.vectorize_into(registry.docid_to_tokenized_text[docid], answers[row])
 
-        return q_input_ids, pos_input_ids, neg_input_ids
+        return questions, answers, np.array(triples, dtype=np.int32).reshape(-1, 3)
 
     def get_dataloader(self, dataset, type):
         """Creates train and validation DataLoaders with question, positive
@@ -256,14 +307,10 @@ class QA_LSTM():
             dataset: List of lists in the form of [qid, [pos ans], [ans cands]]
             type: str - 'train' or 'validation'
         """
-        question_input, pos_ans_input, neg_ans_input = self.get_input_data(dataset)
-
-        question_inputs = torch.tensor(question_input)
-        pos_ans_inputs = torch.tensor(pos_ans_input)
-        neg_ans_inputs = torch.tensor(neg_ans_input)
+        questions, answers, triples = self.get_input_data(dataset)
 
         # Create the DataLoader
-        data = TensorDataset(question_inputs, pos_ans_inputs, neg_ans_inputs)
+        data = TripleDataset(questions, answers, triples)
         if type == "train":
             sampler = RandomSampler(data)
         else:
@@ -290,10 +337,10 @@ class QA_LSTM():
         # For each batch of training data
         for step, batch in enumerate(tqdm(train_dataloader)):
             # batch contains 3 PyTorch tensors
-            # Move tensors to gpu
-            question = batch[0].to(self.device)
-            pos_ans = batch[1].to(self.device)
-            neg_ans = batch[2].to(self.device)
+            # Move tensors to gpu and widen the ids for the embedding layer
+            question = batch[0].to(self.device).long()
+            pos_ans = batch[1].to(self.device).long()
+            neg_ans = batch[2].to(self.device).long()
 
             # 1. Zero gradients
             model.zero_grad()
@@ -330,7 +377,7 @@ class QA_LSTM():
         # Evaluate data
         for batch in tqdm(validation_dataloader):
             # Add batch to GPU
-            batch = tuple(t.to(self.device) for t in batch)
+            batch = tuple(t.to(self.device).long() for t in batch)
             # Unpack the inputs from Dataloader
             question, pos_ans, neg_ans = batch
             # Don't calculate the gradients
@@ -381,6 +428,27 @@ class QA_LSTM():
             print("\t Train Loss: {0:.3f}".format(train_loss))
             print("\t Validation Loss: {0:.3f}\n".format(valid_loss))
 
+    def score_with_vectors(self, model, q_vec, cands):
+        """Computes the cosine similarity of a question and its candidates
+        from the pre-computed answer vectors, so only the question is encoded.
+
+        Returns:
+            scores: Numpy array of similarity scores
+        ----------
+        Arguements:
+            model: Trained PyTorch model
+            q_vec: Torch tensor of the vectorized question
+            cands: List of candidate docids
+        """
+        with torch.no_grad():
+            q_output = model.encode(q_vec).cpu().numpy()
+        # Unit-length question vector - (2*hidden_size,)
+        q_output = normalize(q_output)[0]
+        # Gather the unit-length answer vectors - (num_cands, 2*hidden_size)
+        a_output = self.vector_store.get_vectors(cands)
+
+        return a_output.dot(q_output)
+
     def get_rank(self, model):
         """Re-ranks the answer candidates per question using trained model.
 
@@ -401,19 +469,26 @@ class QA_LSTM():
             # Extract input data
             ques, pos_ans, cands = seq[0], seq[1], seq[2]
             # Tokenize and vectorize question
-            q_text = qid_to_tokenized_text[ques]
+            q_text = registry.qid_to_tokenized_text[ques]
             q_vec = torch.tensor([self.vectorize(q_text)]).to(self.device)
-            # Tokenize candidate answers
-            cands_text = [docid_to_tokenized_text[c] for c in cands]
             cands_id = np.array(cands)
-            # List to store similarity score of QA pair
-            scores = []
-            # For each candidate answer
-            for cand in cands_text:
-                # Vectorize the answers
-                a_vec = torch.tensor([self.vectorize(cand)]).to(self.device)
-                # Compute similarity score of QA pair and add to scores
-                scores.append(model(q_vec, a_vec).item())
+
+            if self.vector_store is not None:
+                # Score the candidates with their pre-computed answer vectors
+                scores = self.score_with_vectors(model, q_vec, cands)
+            else:
+                # Tokenize candidate answers
+                cands_text = [registry.docid_to_tokenized_text[c] for c in cands]
+                # Vectorize all candidate answers into one batch
+                a_vecs = torch.tensor([self.vectorize(cand) for cand in cands_text]).to(self.device)
+
+                with torch.no_grad():
+                    # Encode the question once - (1, 2*hidden_size)
+                    q_output = model.encode(q_vec)
+                    # Encode all candidates - (num_cands, 2*hidden_size)
+                    a_output = model.encode(a_vecs)
+                    # Similarity score of each QA pair - (num_cands,)
+                    scores = model.sim(q_output.expand_as(a_output), a_output).cpu().numpy()
 
             # Get the indices of the sorted (descending) similarity scores
             sorted_index = np.argsort(scores)[::-1]
@@ -424,28 +499,35 @@ class QA_LSTM():
 
         return qid_pred_rank
 
-    def evaluate_model(self):
-        """Prints the nDCG@10, MRR@10, Precision@1
+    def load_model(self):
+        """Loads the trained model weights.
         """
-        k = 10
-        # Number of questions
-        num_q = len(self.test_set)
-
         # If use trained model
         if self.config['use_trained_model'] == True:
             # Download model
             model_name = get_trained_model("qa-lstm")
-            model_path = path + "/model/trained/qa-lstm/" + model_name
+            self.model_path = path + "/model/trained/qa-lstm/" + model_name
         else:
-            model_path = self.config['model_path']
+            self.model_path = self.config['model_path']
         # Load model
-        self.model.load_state_dict(torch.load(model_path), strict=False)
+        self.model.load_state_dict(torch.load(self.model_path, map_location=self.device), strict=False)
+        if self.vector_store is not None:
+            self.vector_store.check_model(self.model_path)
+
+    def evaluate_model(self):
+        """Prints the nDCG@10, MRR@10, Precision@1
+        """
+        k = 10
+        # Number of questions
+        num_q = len(self.test_set)
+
+        self.load_model()
         print("\nEvaluating...\n")
         # Get rank
         qid_pred_rank = self.get_rank(self.model)
 
         # Evaluate
-        MRR, average_ndcg, precision, rank_pos = evaluate(qid_pred_rank, labels, k)
+        MRR, average_ndcg, precision, rank_pos = evaluate(qid_pred_rank, registry.labels, k)
 
         print("\nAverage nDCG@{0} for {1} queries: {2:.3f}".format(k, num_q, average_ndcg))
         print("MRR@{0} for {1} queries: {2:.3f}".format(k, num_q, MRR))
@@ -0,0 +1,90 @@
+from pathlib import Path
+import threading
+import time
+import os
+
+from utils import *
+
+path = str(Path.cwd())
+
+class DataRegistry():
+    """Lazily loaded data artifacts. Each artifact is loaded on first access,
+    cached for the lifetime of the process, and its load time is recorded.
+
+    Artifacts are accessed as attributes, e.g. registry.docid_to_text.
+    """
+    def __init__(self):
+        # Artifact name to function loading it
+        self.loaders = {}
+        # Artifact name to loaded artifact
+        self.cache = {}
+        # Artifact name to load time in seconds
+        self.load_times = {}
+        self.lock = threading.RLock()
+
+    def register(self, name, loader):
+        """Registers a function loading an artifact.
+
+        Arguments:
+            name: str
+            loader: Function without arguments returning the artifact
+        """
+        self.loaders[name] = loader
+
+    def get(self, name):
+        """Returns an artifact, loading it on first access.
+
+        Arguments:
+            name: str
+        """
+        if name in self.cache:
+            return self.cache[name]
+
+        with self.lock:
+            if name not in self.cache:
+                start = time.time()
+                self.cache[name] = self.loaders[name]()
+                self.load_times[name] = time.time() - start
+                print("Loaded {} in {:.2f}s".format(name, self.load_times[name]))
+
+        return self.cache[name]
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get('loaders', {}):
+            return self.get(name)
+        raise AttributeError(name)
+
+    def is_loaded(self, name):
+        return name in self.cache
+
+    def report(self):
+        """Prints the load time of every loaded artifact.
+        """
+        for name, load_time in self.load_times.items():
+            print("{:<28}{:.2f}s".format(name, load_time))
+
+def load_docid_to_text():
+    """Returns the docid to answer text mapping, from the memory-mapped text
+    store if it has been built and from the pickled dictionary otherwise.
+    """
+    text_store_dir = path + '/data/text_store'
+    if os.path.isdir(text_store_dir):
+        # Imported here so the pickle fallback does not need the store module
+        from text_store import TextStore
+        return TextStore(text_store_dir)
+
+    return load_pickle(path + '/data/id_to_text/docid_to_text.pickle')
+
+registry = DataRegistry()
+
+# Dictionary mapping of docid and qid to raw text
+registry.register('docid_to_text', load_docid_to_text)
+registry.register('qid_to_text', lambda: load_pickle(path + '/data/id_to_text/qid_to_text.pickle'))
+# Labels
+registry.register('labels', lambda: load_pickle(path + '/data/data_pickle/labels.pickle'))
+# Dictonary with token to id mapping
+registry.register('vocab', lambda: load_pickle(path + '/data/qa_lstm_tokenizer/word2index.pickle'))
+# Dictonary with qid to tokenized text mapping
+registry.register('qid_to_tokenized_text', lambda: load_pickle(path + '/data/qa_lstm_tokenizer/qid_to_tokenized_text.pickle'))
+# Dictionary with docid to tokenized text mapping
+registry.register('docid_to_tokenized_text', lambda: load_pickle(path + '/data/qa_lstm_tokenizer/docid_to_tokenized_text.pickle'))
@@ -0,0 +1,175 @@
+from pathlib import Path
+from collections import OrderedDict
+import threading
+import hashlib
+import shutil
+import json
+import time
+import os
+
+from utils import *
+from process_data import pre_process
+from hit_cache import fingerprint
+
+path = str(Path.cwd())
+
+def normalize_query(query):
+    """Returns the cache key of a query: the pre-processed text with
+    whitespace collapsed, so questions differing only in case, punctuation
+    or spacing share an entry.
+    """
+    return ' '.join(pre_process(query).split())
+
+class ResultCache():
+    """Bounded LRU cache of the ranked answers of queries with a time to
+    live, and an optional on-disk tier receiving the evicted entries.
+
+    Entries belong to a version, the fingerprint of the model checkpoint, the
+    indexes and the settings. The fingerprint is re-checked every
+    check_interval seconds and a change drops the cached entries. Spilled
+    entries are kept in a directory per version, and the directories of
+    other versions are removed.
+    """
+    def __init__(self, max_size=1024, ttl=3600, spill_dir=None, watch_paths=None, settings=None, check_interval=10):
+        """Arguments:
+            max_size: int - number of queries held in memory
+            ttl: float - seconds an entry is valid, 0 for no expiry
+            spill_dir: str - directory of the on-disk tier or None
+            watch_paths: List of files or directories of the model and indexes
+            settings: Dictionary of settings affecting the results
+            check_interval: float - seconds between fingerprint checks
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.watch_paths = watch_paths or []
+        self.settings = settings or {}
+        self.check_interval = check_interval
+        # Key to (time added, value), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'disk_hits': 0, 'misses': 0,
+                       'evictions': 0, 'expirations': 0, 'invalidations': 0}
+        self.version = fingerprint(self.watch_paths, self.settings)
+        self.last_check = time.time()
+        # Entries spilled by a run with another model, index or settings
+        self.prune_spilled()
+
+    def check_version(self):
+        """Drops the cached entries if the model or an index changed.
+        """
+        if time.time() - self.last_check < self.check_interval:
+            return
+        self.last_check = time.time()
+        version = fingerprint(self.watch_paths, self.settings)
+        if version != self.version:
+            self.version = version
+            self.entries.clear()
+            self.counts['invalidations'] += 1
+            self.prune_spilled()
+
+    def prune_spilled(self):
+        """Removes the on-disk tiers of all versions but the current one.
+        """
+        if self.spill_dir is None or not os.path.isdir(self.spill_dir):
+            return
+        for name in os.listdir(self.spill_dir):
+            version_dir = os.path.join(self.spill_dir, name)
+            # Version directories are named after 16 digit fingerprints
+            if name != self.version and len(name) == 16 and os.path.isdir(version_dir):
+                shutil.rmtree(version_dir, ignore_errors=True)
+
+    def expired(self, added):
+        return self.ttl > 0 and time.time() - added > self.ttl
+
+    def spill_path(self, key):
+        """Returns the file of a key in the on-disk tier of the current version.
+        """
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self.spill_dir, self.version, name)
+
+    def spill(self, key, added, value):
+        """Writes an evicted entry to the on-disk tier.
+        """
+        spill_path = self.spill_path(key)
+        if not os.path.isdir(os.path.dirname(spill_path)):
+            os.makedirs(os.path.dirname(spill_path))
+        with open(spill_path, 'w') as f:
+            json.dump({'added': added, 'value': value}, f)
+
+    def load_spilled(self, key):
+        """Returns the (time added, value) of a key from the on-disk tier or
+        None if it is missing or expired.
+        """
+        spill_path = self.spill_path(key)
+        if not os.path.exists(spill_path):
+            return None
+        with open(spill_path) as f:
+            entry = json.load(f)
+        os.remove(spill_path)
+        if self.expired(entry['added']):
+            self.counts['expirations'] += 1
+            return None
+
+        return entry['added'], entry['value']
+
+    def get(self, query):
+        """Returns the cached value of a query or None.
+
+        Arguments:
+            query: str
+        """
+        key = normalize_query(query)
+        with self.lock:
+            self.check_version()
+            entry = self.entries.get(key)
+            if entry is not None and self.expired(entry[0]):
+                del self.entries[key]
+                self.counts['expirations'] += 1
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return entry[1]
+
+            if self.spill_dir is not None:
+                entry = self.load_spilled(key)
+                if entry is not None:
+                    # Promote back to memory
+                    self.insert(key, entry[0], entry[1])
+                    self.counts['disk_hits'] += 1
+                    return entry[1]
+
+            self.counts['misses'] += 1
+            return None
+
+    def put(self, query, value):
+        """Caches the value of a query.
+
+        Arguments:
+            query: str
+            value: JSON serializable value
+        """
+        with self.lock:
+            self.insert(normalize_query(query), time.time(), value)
+
+    def insert(self, key, added, value):
+        self.entries[key] = (added, value)
+        self.entries.move_to_end(key)
+        # Evict the least recently used entries
+        while len(self.entries) > self.max_size:
+            old_key, (old_added, old_value) = self.entries.popitem(last=False)
+            self.counts['evictions'] += 1
+            if self.spill_dir is not None and not self.expired(old_added):
+                self.spill(old_key, old_added, old_value)
+
+    def stats(self):
+        """Returns the size, counters and hit rate of the cache.
+        """
+        with self.lock:
+            hits = self.counts['hits'] + self.counts['disk_hits']
+            stats = dict(self.counts)
+            stats['size'] = len(self.entries)
+            stats['hit_rate'] = hits/max(1, hits + self.counts['misses'])
+
+        return stats
@@ -0,0 +1,163 @@
+from collections import deque
+import numpy as np
+import threading
+import queue
+import time
+
+class ScoreRequest():
+    """Inputs of one caller waiting to be scored.
+    """
+    def __init__(self, items):
+        """Arguments:
+            items: List of model inputs, e.g. encoded QA pairs
+        """
+        self.items = items
+        # Scores in the order of the items
+        self.scores = [None]*len(items)
+        # Number of items not yet scored
+        self.remaining = len(items)
+        # Time the request was submitted and its last item was dispatched
+        self.submit_time = time.time()
+        self.dispatch_time = None
+        # Exception raised while scoring
+        self.error = None
+        self.done = threading.Event()
+
+class MicroBatchScheduler():
+    """Packs the inputs of concurrent requests into shared model batches.
+
+    A worker thread collects items from the queue until a batch has
+    max_batch_size items or max_wait_ms has passed since the first item of
+    the batch was taken, scores the batch with score_fn and routes the scores
+    back to the waiting callers.
+    """
+    def __init__(self, score_fn, max_batch_size=32, max_wait_ms=5):
+        """Starts the worker thread.
+
+        Arguments:
+            score_fn: Function mapping a list of items to a list of scores
+            max_batch_size: int - maximum number of items per batch
+            max_wait_ms: float - maximum time to wait for a batch to fill
+        """
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms/1000
+        # Queue of (request, item index) tuples
+        self.queue = queue.Queue()
+        # Number of batches and items scored
+        self.num_batches = 0
+        self.num_items = 0
+        # Queueing time in seconds of the most recent requests
+        self.wait_times = deque(maxlen=1000)
+        self.stats_lock = threading.Lock()
+
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, items):
+        """Queues the items of a request and blocks until they are scored.
+
+        Returns:
+            scores: List of scores in the order of the items
+        ----------
+        Arguments:
+            items: List of model inputs
+        """
+        if len(items) == 0:
+            return []
+
+        request = ScoreRequest(items)
+
+        for i in range(len(items)):
+            self.queue.put((request, i))
+
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+
+        return request.scores
+
+    def next_batch(self):
+        """Blocks for the first item and collects items until the batch is
+        full or the maximum wait has passed.
+
+        Returns:
+            batch: List of (request, item index) tuples
+        """
+        batch = [self.queue.get()]
+        deadline = time.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        """Scores batches and routes the scores back to their requests.
+        """
+        while True:
+            batch = self.next_batch()
+            dispatch_time = time.time()
+
+            for request, i in batch:
+                request.dispatch_time = dispatch_time
+
+            try:
+                scores = self.score_fn([request.items[i] for request, i in batch])
+                error = None
+            except Exception as e:
+                scores = [None]*len(batch)
+                error = e
+
+            with self.stats_lock:
+                self.num_batches += 1
+                self.num_items += len(batch)
+
+            for (request, i), score in zip(batch, scores):
+                request.scores[i] = score
+                if error is not None:
+                    request.error = error
+                request.remaining -= 1
+                # All items of the request are scored
+                if request.remaining == 0:
+                    with self.stats_lock:
+                        self.wait_times.append(request.dispatch_time - request.submit_time)
+                    request.done.set()
+
+    def stats(self):
+        """Returns the queue depth, the average batch fill ratio and the
+        queueing time of recent requests in milliseconds.
+
+        Returns:
+            stats: Dictionary
+        """
+        with self.stats_lock:
+            wait_ms = np.array(self.wait_times)*1000
+            num_batches = self.num_batches
+            num_items = self.num_items
+
+        if num_batches > 0:
+            fill_ratio = num_items/(num_batches*self.max_batch_size)
+        else:
+            fill_ratio = 0.0
+
+        if len(wait_ms) > 0:
+            wait = {'mean': float(np.mean(wait_ms)),
+                    'p50': float(np.percentile(wait_ms, 50)),
+                    'p95': float(np.percentile(wait_ms, 95)),
+                    'max': float(np.max(wait_ms))}
+        else:
+            wait = {'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+
+        return {'queue_depth': self.queue.qsize(),
+                'num_batches': num_batches,
+                'num_items': num_items,
+                'batch_fill_ratio': round(fill_ratio, 3),
+                'wait_ms': {key: round(value, 2) for key, value in wait.items()}}
@@ -0,0 +1,117 @@
+from pathlib import Path
+import numpy as np
+import threading
+import hashlib
+import json
+import os
+
+from utils import *
+
+path = str(Path.cwd())
+
+# Record of the score file - question hash, docid and score
+record_dtype = np.dtype([('question', '<u8'), ('docid', '<i8'), ('score', '<f4')])
+
+def checkpoint_hash(model_path, settings):
+    """Returns a hash of the contents of a model checkpoint and of the
+    settings changing its scores.
+
+    Arguments:
+        model_path: str
+        settings: Dictionary
+    """
+    h = hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    with open(model_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+    return h.hexdigest()[:16]
+
+def question_hash(q_text):
+    """Returns the first 64 bits of the SHA-1 hash of a question as an int.
+    """
+    return int.from_bytes(hashlib.sha1(q_text.encode('utf-8')).digest()[:8], 'little')
+
+class ScoreCache():
+    """Persistent cache of the relevancy scores of QA pairs for one model
+    checkpoint.
+
+    Scores are appended as fixed-size 20 byte records (question hash, docid,
+    score) to scores-<checkpoint hash>.bin and indexed in memory by
+    (question hash, docid) when the cache is opened.
+    """
+    def __init__(self, cache_dir, model_key):
+        """Opens the score file of a checkpoint.
+
+        Arguments:
+            cache_dir: str - directory of the score files
+            model_key: str - hash of the checkpoint, see checkpoint_hash
+        """
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_path = os.path.join(cache_dir, 'scores-{}.bin'.format(model_key))
+        # (question hash, docid) to score
+        self.index = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.cache_path):
+            # Drop a record cut off by an interrupted write
+            num_records = os.path.getsize(self.cache_path) // record_dtype.itemsize
+            records = np.fromfile(self.cache_path, dtype=record_dtype, count=num_records)
+            self.index = dict(zip(zip(records['question'].tolist(), records['docid'].tolist()), \
+                                  records['score'].tolist()))
+            with open(self.cache_path, 'r+b') as f:
+                f.truncate(num_records*record_dtype.itemsize)
+
+    def __len__(self):
+        return len(self.index)
+
+    def lookup(self, q_text, docids):
+        """Returns the cached scores of the answers of a question.
+
+        Returns:
+            scores: Numpy array, NaN for the pairs not in the cache
+        ----------
+        Arguments:
+            q_text: str - question
+            docids: List of docids
+        """
+        q_hash = question_hash(q_text)
+        scores = np.array([self.index.get((q_hash, int(docid)), np.nan) for docid in docids], dtype=np.float32)
+
+        with self.lock:
+            num_missing = int(np.isnan(scores).sum())
+            self.misses += num_missing
+            self.hits += len(docids) - num_missing
+
+        return scores
+
+    def add(self, q_text, docids, scores):
+        """Appends the scores of the answers of a question.
+
+        Arguments:
+            q_text: str - question
+            docids: List of docids
+            scores: List of scores
+        """
+        q_hash = question_hash(q_text)
+        records = np.zeros(len(docids), dtype=record_dtype)
+        records['question'] = q_hash
+        records['docid'] = [int(docid) for docid in docids]
+        records['score'] = scores
+
+        with self.lock:
+            with open(self.cache_path, 'ab') as f:
+                records.tofile(f)
+            for docid, score in zip(docids, scores):
+                self.index[(q_hash, int(docid))] = float(score)
+
+    def stats(self):
+        """Returns the number of cached pairs and the pair hits and misses.
+        """
+        return {'pairs': len(self.index),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/max(1, self.hits + self.misses)}
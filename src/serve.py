@@ -0,0 +1,356 @@
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import argparse
+import threading
+import traceback
+import json
+import time
+import sys
+
+from utils import *
+from finbert_qa import *
+from scheduler import *
+from result_cache import *
+
+class QAService():
+    """Keeps the fine-tuned FinBERT-QA model, tokenizer, answer texts and
+    Lucene searcher loaded and answers queries with them.
+    """
+    def __init__(self, config):
+        """Loads the model and starts the searcher once.
+
+        Arguments:
+            config: Dictionary
+        """
+        self.config = config
+        self.qa = FinBERT_QA(self.config)
+        self.qa.load_finetuned_model()
+        # Start the JVM and open the index before the first request
+        self.qa.get_searcher()
+        # The model and searcher are shared by all request threads
+        self.lock = threading.Lock()
+        # Pack the QA pairs of concurrent requests into shared model batches
+        if self.config.get('max_batch_size', 0) > 0:
+            self.qa.scheduler = MicroBatchScheduler(lambda seqs: self.qa.score_batch(self.qa.model, seqs), \
+                                                    max_batch_size=self.config['max_batch_size'], \
+                                                    max_wait_ms=self.config['max_wait_ms'])
+        # Ranked answers of recent queries
+        self.result_cache = None
+        if self.config.get('result_cache_size', 0) > 0:
+            paths, settings = retriever_state(self.config)
+            # Model settings changing the rankings
+            settings.update({key: self.config.get(key) for key in ['quantized', 'quantized_model', \
+                                                                   'torchscript_model', 'answer_store', \
+                                                                   'dynamic_padding', 'max_seq_len']})
+            settings['num_cands'] = self.qa.num_cands
+            self.result_cache = ResultCache(max_size=self.config['result_cache_size'], \
+                                            ttl=self.config['result_cache_ttl'], \
+                                            spill_dir=self.config.get('result_cache_dir'), \
+                                            watch_paths=[self.qa.model_path, self.config.get('answer_store')] + paths, \
+                                            settings=settings)
+
+    def search(self, query, top_k=None):
+        """Retrieves and re-ranks the answers of a query.
+
+        Returns:
+            response: Dictionary with the query, the top-k answers and the
+                      latency in milliseconds
+        ----------
+        Arguments:
+            query: str
+            top_k: int - number of answers, defaults to the configured top_k
+        """
+        if top_k is None:
+            top_k = self.config['top_k']
+
+        start = time.time()
+        cached = None
+        if self.result_cache is not None:
+            cached = self.result_cache.get(query)
+
+        if cached is not None:
+            rank, scores = cached
+        elif self.qa.scheduler is not None:
+            # The scheduler serializes the model calls
+            rank, scores = self.qa.rank_answers(query)
+        else:
+            with self.lock:
+                rank, scores = self.qa.rank_answers(query)
+
+        if cached is None and self.result_cache is not None:
+            self.result_cache.put(query, [rank, scores])
+
+        return {'query': query,
+                'answers': self.qa.format_answers(rank, scores, top_k),
+                'cached': cached is not None,
+                'latency_ms': round((time.time() - start)*1000, 1)}
+
+    def stats(self):
+        """Returns the micro-batching, result cache, retrieval cache and
+        score cache statistics.
+
+        Returns:
+            stats: Dictionary, empty if none is enabled
+        """
+        stats = {}
+        if self.result_cache is not None:
+            stats['result_cache'] = self.result_cache.stats()
+        if self.qa.scheduler is not None:
+            stats['scheduler'] = self.qa.scheduler.stats()
+        if hasattr(self.qa.searcher, 'stats'):
+            stats['hit_cache'] = self.qa.searcher.stats()
+        if self.qa.score_cache is not None:
+            stats['score_cache'] = self.qa.score_cache.stats()
+
+        return stats
+
+def validate_request(request, default_top_k):
+    """Checks the query and top_k of a search request.
+
+    Returns:
+        query: str
+        top_k: int
+    ----------
+    Arguments:
+        request: Dictionary with a query and optionally top_k
+        default_top_k: int - top_k of requests without one
+    Raises:
+        ValueError with the error message for the client
+    """
+    if not isinstance(request, dict):
+        raise ValueError("Request must be a JSON object")
+    query = request.get('query')
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("Missing 'query'")
+    try:
+        top_k = int(request.get('top_k', default_top_k))
+    except (TypeError, ValueError):
+        raise ValueError("'top_k' must be an integer")
+    if top_k < 1:
+        raise ValueError("'top_k' must be positive")
+
+    return query, top_k
+
+def answer_request(service, request):
+    """Validates and answers a search request.
+
+    Returns:
+        status: int - HTTP status code
+        response: Dictionary, the answers or an error message
+    ----------
+    Arguments:
+        service: QAService object
+        request: Dictionary with a query and optionally top_k
+    """
+    try:
+        query, top_k = validate_request(request, service.config['top_k'])
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    try:
+        return 200, service.search(query, top_k)
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        return 500, {'error': "Search failed: {}".format(e)}
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in a new thread.
+    """
+    daemon_threads = True
+
+    def process_request_thread(self, request, client_address):
+        try:
+            ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            # The request thread searched the Lucene index
+            detach_jvm()
+
+def make_handler(service):
+    """Creates a request handler class bound to a QAService.
+
+    Returns:
+        QAHandler: BaseHTTPRequestHandler subclass
+    ----------
+    Arguments:
+        service: QAService object
+    """
+    class QAHandler(BaseHTTPRequestHandler):
+        """Serves GET /health, GET /stats, GET /search?query=...&top_k=...
+        and POST /search with a JSON body {"query": ..., "top_k": ...}.
+        """
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def handle_search(self, request):
+            self.send_json(*answer_request(service, request))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/health':
+                self.send_json(200, {'status': 'ok'})
+            elif url.path == '/stats':
+                self.send_json(200, service.stats())
+            elif url.path == '/search':
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                self.handle_search(params)
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/search':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                request = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                self.send_json(400, {'error': 'Invalid JSON'})
+                return
+            self.handle_search(request)
+
+    return QAHandler
+
+def serve_http(service, host, port):
+    """Serves queries over HTTP until interrupted.
+
+    Arguments:
+        service: QAService object
+        host: str
+        port: int
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print("\nServing FinBERT-QA on http://{}:{}/search\n".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+def serve_stdin(service):
+    """Answers one query per line from stdin and writes one JSON response
+    per line to stdout. A line is either the query text or a JSON object
+    with a query and optionally top_k. Invalid lines and failed searches
+    are answered with a JSON object with an error.
+
+    Arguments:
+        service: QAService object
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                print(json.dumps({'error': 'Invalid JSON'}), flush=True)
+                continue
+        else:
+            request = {'query': line}
+        status, response = answer_request(service, request)
+        print(json.dumps(response), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    parser.add_argument("--mode", default="http", type=str, required=False,
+    help="Specify 'http' to serve a JSON endpoint or 'stdin' to answer one query per line.")
+    parser.add_argument("--host", default="127.0.0.1", type=str, required=False,
+    help="Host to bind the HTTP server to.")
+    parser.add_argument("--port", default=8000, type=int, required=False,
+    help="Port of the HTTP server.")
+    parser.add_argument("--top_k", default=5, type=int, required=False, \
+    help="Default number of answers to return per query.")
+    parser.add_argument("--device", default='gpu', type=str, required=False,
+    help="Specify 'gpu' or 'cpu'")
+    parser.add_argument("--score_batch_size", default=16, type=int, required=False,
+    help="Number of QA pairs to score per forward pass when re-ranking.")
+    parser.add_argument("--dynamic_padding", default=False, \
+                        action="store_true", \
+                        help="Pad each batch to its longest QA pair instead of max_seq_len.")
+    parser.add_argument("--bucket_width", default=32, type=int, required=False,
+    help="Range of sequence lengths batched together when dynamic_padding is used.")
+    parser.add_argument("--answer_store", default=None, type=str, required=False,
+    help="Directory of the pre-tokenized answers built by src/answer_store.py.")
+    parser.add_argument("--quantized", default=False, \
+                        action="store_true", \
+                        help="Apply int8 dynamic quantization to the fine-tuned model. Runs on CPU.")
+    parser.add_argument("--quantized_model", default=None, type=str, required=False,
+    help="Path to a quantized model saved by src/export_model.py. Runs on CPU.")
+    parser.add_argument("--torchscript_model", default=None, type=str, required=False,
+    help="Path to a TorchScript model saved by src/export_model.py.")
+    parser.add_argument("--retriever", default="bm25", type=str, required=False,
+    help="First-stage retriever, 'bm25', 'dense' or 'hybrid'.")
+    parser.add_argument("--bm25_index", default=None, type=str, required=False,
+    help="BM25 index built by src/bm25.py. Replaces the Lucene index with the in-process BM25 engine.")
+    parser.add_argument("--hit_cache", default=None, type=str, required=False,
+    help="Directory of the persistent cache of retrieved candidates.")
+    parser.add_argument("--vector_store", default=None, type=str, required=False,
+    help="Directory of the answer vectors built by src/vector_store.py. Specify only if retriever is 'dense' or 'hybrid'")
+    parser.add_argument("--nprobe", default=0, type=int, required=False,
+    help="Number of IVF clusters searched by the dense retriever, 0 for exhaustive search.")
+    parser.add_argument("--fusion", default="rrf", type=str, required=False,
+    help="Fusion of the hybrid retriever, 'rrf' for reciprocal rank fusion or 'weighted' for weighted scores.")
+    parser.add_argument("--dense_weight", default=0.5, type=float, required=False,
+    help="Weight of the dense retriever in the hybrid fusion. BM25 gets 1 - dense_weight.")
+    parser.add_argument("--num_cands", default=50, type=int, required=False,
+    help="Number of candidates retrieved and re-ranked per query.")
+    parser.add_argument("--score_cache", default=None, type=str, required=False,
+    help="Directory of the persistent cache of QA pair scores.")
+    parser.add_argument("--max_batch_size", default=0, type=int, required=False,
+    help="Maximum number of QA pairs from concurrent requests scored together. 0 disables micro-batching.")
+    parser.add_argument("--max_wait_ms", default=5, type=float, required=False,
+    help="Maximum time in milliseconds to wait for a micro-batch to fill.")
+    parser.add_argument("--result_cache_size", default=0, type=int, required=False,
+    help="Number of queries whose ranked answers are cached in memory. 0 disables the result cache.")
+    parser.add_argument("--result_cache_ttl", default=3600, type=float, required=False,
+    help="Seconds a cached result is valid. 0 for no expiry.")
+    parser.add_argument("--result_cache_dir", default=None, type=str, required=False,
+    help="Directory receiving the results evicted from memory.")
+
+    args = parser.parse_args()
+
+    config = {'top_k': args.top_k,
+              'bert_model_name': 'bert-qa',
+              'device': args.device,
+              'max_seq_len': 512,
+              'score_batch_size': args.score_batch_size,
+              'dynamic_padding': args.dynamic_padding,
+              'bucket_width': args.bucket_width,
+              'answer_store': args.answer_store,
+              'quantized': args.quantized,
+              'quantized_model': args.quantized_model,
+              'torchscript_model': args.torchscript_model,
+              'max_batch_size': args.max_batch_size,
+              'max_wait_ms': args.max_wait_ms,
+              'result_cache_size': args.result_cache_size,
+              'result_cache_ttl': args.result_cache_ttl,
+              'result_cache_dir': args.result_cache_dir,
+              'retriever': args.retriever,
+              'bm25_index': args.bm25_index,
+              'hit_cache': args.hit_cache,
+              'vector_store': args.vector_store,
+              'nprobe': args.nprobe,
+              'fusion': args.fusion,
+              'dense_weight': args.dense_weight,
+              'num_cands': args.num_cands,
+              'score_cache': args.score_cache}
+
+    service = QAService(config)
+
+    if args.mode == 'http':
+        serve_http(service, args.host, args.port)
+    elif args.mode == 'stdin':
+        serve_stdin(service)
+    else:
+        print("Please specify 'http' or 'stdin' for mode")
+        sys.exit()
+
+if __name__ == "__main__":
+    main()
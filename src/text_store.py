@@ -0,0 +1,117 @@
+from pathlib import Path
+from tqdm import tqdm
+import numpy as np
+import argparse
+import mmap
+import os
+
+from utils import *
+
+path = str(Path.cwd())
+
+default_store_dir = path + '/data/text_store'
+
+class TextStore():
+    """Read-only, dict-like docid to answer text mapping backed by one
+    contiguous UTF-8 file read through mmap.
+
+    text.bin holds the encoded answers back to back and offsets.npy the byte
+    offset of each answer in the order of the sorted docids in docids.npy.
+    Processes opening the same store share the operating system page cache
+    instead of holding private copies of the texts.
+    """
+    def __init__(self, store_dir=default_store_dir):
+        """Opens the store.
+
+        Arguments:
+            store_dir: str - directory created by build_text_store
+        """
+        self.store_dir = store_dir
+        self.docids = np.load(os.path.join(store_dir, 'docids.npy'))
+        self.offsets = np.load(os.path.join(store_dir, 'offsets.npy'))
+        with open(os.path.join(store_dir, 'text.bin'), 'rb') as f:
+            self.text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def row(self, docid):
+        """Returns the row of a docid in the index or -1 if it is missing.
+        """
+        row = np.searchsorted(self.docids, docid)
+        if row < len(self.docids) and self.docids[row] == docid:
+            return row
+        return -1
+
+    def __getitem__(self, docid):
+        row = self.row(docid)
+        if row < 0:
+            raise KeyError(docid)
+
+        return self.text[self.offsets[row]:self.offsets[row+1]].decode('utf-8')
+
+    def __contains__(self, docid):
+        return self.row(docid) >= 0
+
+    def __len__(self):
+        return len(self.docids)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, docid, default=None):
+        if docid in self:
+            return self[docid]
+        return default
+
+    def keys(self):
+        return [int(docid) for docid in self.docids]
+
+    def items(self):
+        for docid in self.docids:
+            yield int(docid), self[docid]
+
+def build_text_store(collection, store_dir=default_store_dir):
+    """Writes the answers to a contiguous UTF-8 file and an offset index
+    keyed by docid. Answers with empty text are skipped.
+
+    Arguments:
+        collection: Dataframe with a column of docid and a column of answer text
+        store_dir: str - output directory
+    """
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    # Drop empty answers and sort by docid for binary search
+    collection = collection.dropna(subset=['doc']).sort_values(by=['docid'])
+
+    docids = collection['docid'].values.astype(np.int64)
+    offsets = np.zeros(len(docids) + 1, dtype=np.int64)
+
+    with open(os.path.join(store_dir, 'text.bin'), 'wb') as f:
+        for i, doc in enumerate(tqdm(collection['doc'].values)):
+            data = str(doc).encode('utf-8')
+            f.write(data)
+            offsets[i+1] = offsets[i] + len(data)
+
+    np.save(os.path.join(store_dir, 'docids.npy'), docids)
+    np.save(os.path.join(store_dir, 'offsets.npy'), offsets)
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    # Required arguments
+    parser.add_argument("--collection_path", default=None, type=str, required=True,
+    help="Path to the answer collection in .tsv format with the columns docid and doc.")
+
+    # Optional arguments
+    parser.add_argument("--output_dir", default=default_store_dir, type=str, required=False,
+    help="The output directory where the text store will be saved.")
+
+    args = parser.parse_args()
+
+    collection = load_answers_to_df(args.collection_path)
+    print("\nWriting {} answers...\n".format(len(collection)))
+    build_text_store(collection, args.output_dir)
+
+    print("Done. The text store is saved in {}".format(args.output_dir))
+
+if __name__ == "__main__":
+    main()
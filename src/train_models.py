@@ -3,8 +3,6 @@ import argparse
 import sys
 
 from utils import *
-from qa_lstm import *
-from finbert_qa import *
 
 path = str(Path.cwd())
 
@@ -55,6 +53,32 @@ def main():
     help="Weight decay. Specify only if model type is 'bert'")
     parser.add_argument("--num_warmup_steps", default=10000, type=int, required=False,
     help="Number of warmup steps. Specify only if model type is 'bert'")
+    parser.add_argument("--accumulation_steps", default=1, type=int, required=False,
+    help="Number of batches whose gradients are accumulated per optimizer step. Specify only if model type is 'bert'")
+    parser.add_argument("--bf16", default=False, \
+                        action="store_true", \
+                        help="Train with bfloat16 autocast on CPU. Specify only if model type is 'bert'")
+    parser.add_argument("--gradient_checkpointing", default=False, \
+                        action="store_true", \
+                        help="Recompute the BERT layer activations in the backward pass instead of storing them. Specify only if model type is 'bert'")
+    parser.add_argument("--num_procs", default=1, type=int, required=False,
+    help="Number of training processes per node. More than 1 process or node trains with gradient all-reduce over gloo on CPU. Specify only if model type is 'bert'")
+    parser.add_argument("--num_nodes", default=1, type=int, required=False,
+    help="Number of nodes of a distributed training run. Specify only if model type is 'bert'")
+    parser.add_argument("--node_rank", default=0, type=int, required=False,
+    help="Index of this node in a distributed training run. Specify only if model type is 'bert'")
+    parser.add_argument("--master_addr", default="127.0.0.1", type=str, required=False,
+    help="Address of the node with node_rank 0. Specify only if model type is 'bert'")
+    parser.add_argument("--master_port", default=29500, type=int, required=False,
+    help="Free port on the node with node_rank 0. Specify only if model type is 'bert'")
+    parser.add_argument("--group_size", default=0, type=int, required=False,
+    help="Number of negatives scored with one shared positive in a forward pass, 0 to pair each negative with a copy of the positive. Specify only if 'learning_approach' is pairwise")
+    parser.add_argument("--answer_store", default=None, type=str, required=False,
+    help="Directory of the pre-tokenized answers built by src/answer_store.py. Specify only if model type is 'bert'")
+    parser.add_argument("--pair_cache", default=None, type=str, required=False,
+    help="Directory of the encoded training and validation QA pairs, built on the first run. Specify only if model type is 'bert'")
+    parser.add_argument("--num_workers", default=0, type=int, required=False,
+    help="Number of DataLoader worker processes encoding the QA pairs. Specify only if model type is 'bert'")
 
     args = parser.parse_args()
 
@@ -73,13 +97,33 @@ def main():
               'bert_model_name': args.bert_model_name,
               'learning_approach': args.learning_approach,
               'margin': args.margin,
+              'group_size': args.group_size,
               'weight_decay': args.weight_decay,
-              'num_warmup_steps': args.num_warmup_steps}
+              'num_warmup_steps': args.num_warmup_steps,
+              'answer_store': args.answer_store,
+              'pair_cache': args.pair_cache,
+              'num_workers': args.num_workers,
+              'accumulation_steps': args.accumulation_steps,
+              'bf16': args.bf16,
+              'gradient_checkpointing': args.gradient_checkpointing,
+              'num_procs': args.num_procs,
+              'num_nodes': args.num_nodes,
+              'node_rank': args.node_rank,
+              'master_addr': args.master_addr,
+              'master_port': args.master_port}
 
 
+    # Only import the modules of the model type in use
     if config['model_type'] == 'qa-lstm':
+        from qa_lstm import QA_LSTM
         QA_LSTM(config).run_train()
+    elif config['model_type'] == 'bert' and config['num_procs']*config['num_nodes'] > 1:
+        # Each process builds its own model
+        from distributed import launch
+        from finbert_qa import train_worker
+        launch(train_worker, config)
     elif config['model_type'] == 'bert':
+        from finbert_qa import FinBERT_QA
         FinBERT_QA(config).run_train()
     else:
         print("Please specify 'qa-lstm' or 'bert' for model_type")
@@ -0,0 +1,200 @@
+from pathlib import Path
+from tqdm import tqdm
+import numpy as np
+import argparse
+import hashlib
+import torch
+import json
+import os
+
+from utils import *
+from registry import *
+
+path = str(Path.cwd())
+
+default_store_dir = path + '/data/vector_store'
+
+def normalize(vectors, eps=1e-8):
+    """Scales vectors to unit length so the cosine similarity becomes a dot
+    product.
+
+    Arguments:
+        vectors: Numpy array - (num_vectors, dim)
+        eps: float - smallest norm to divide by
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return vectors / np.maximum(norms, eps)
+
+def model_fingerprint(model_path):
+    """Returns a hash of the contents of a QA-LSTM checkpoint, identifying
+    the model the answer vectors were encoded with.
+
+    Arguments:
+        model_path: str
+    """
+    h = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+    return h.hexdigest()[:16]
+
+class VectorStore():
+    """Memory-mapped matrix of the QA-LSTM answer representations.
+
+    Row i of vectors.npy is the unit-length max-pooled biLSTM vector of the
+    i-th docid in the sorted docids.npy.
+    """
+    def __init__(self, store_dir=default_store_dir):
+        """Opens the store.
+
+        Arguments:
+            store_dir: str - directory created by build_vector_store
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        # Sequence length the answers were padded to when encoded
+        self.max_seq_len = self.meta['max_seq_len']
+        self.vectors = np.load(os.path.join(store_dir, 'vectors.npy'), mmap_mode='r')
+        self.docids = np.load(os.path.join(store_dir, 'docids.npy'))
+
+    def __len__(self):
+        return len(self.docids)
+
+    def check_model(self, model_path):
+        """Checks that the answer vectors were encoded with the checkpoint
+        that encodes the questions.
+
+        Arguments:
+            model_path: str - QA-LSTM checkpoint
+        Raises:
+            ValueError if the store was built with another checkpoint
+        """
+        if 'model' not in self.meta:
+            print("Warning: {} does not record its QA-LSTM checkpoint, rebuild it to check it".format(self.store_dir))
+            return
+        if self.meta['model'] != model_fingerprint(model_path):
+            raise ValueError("The answer vectors in {} were encoded with another QA-LSTM checkpoint " \
+                             "than {}, rebuild the vector store".format(self.store_dir, model_path))
+
+    def get_vectors(self, docids):
+        """Returns the answer vectors of a list of docids.
+
+        Returns:
+            vectors: Numpy array - (num_docids, dim)
+        ----------
+        Arguments:
+            docids: List of docids
+        """
+        docids = np.asarray(docids)
+        rows = np.searchsorted(self.docids, docids)
+        rows = np.minimum(rows, len(self.docids) - 1)
+        missing = self.docids[rows] != docids
+        if missing.any():
+            raise KeyError(docids[missing][0])
+
+        return np.asarray(self.vectors[rows])
+
+def load_vector_store(config):
+    """Opens the vector store given in the config.
+
+    Returns:
+        vector_store: VectorStore object or None if no store is configured
+    ----------
+    Arguments:
+        config: Dictionary
+    """
+    if config.get('vector_store') is None:
+        return None
+
+    vector_store = VectorStore(config['vector_store'])
+    if vector_store.max_seq_len != config.get('max_seq_len'):
+        print("Warning: the answer vectors were encoded with max_seq_len {}".format(vector_store.max_seq_len))
+
+    return vector_store
+
+def build_vector_store(qa, store_dir=default_store_dir, batch_size=256):
+    """Encodes every answer with the answer tower of a trained QA-LSTM model
+    and saves the unit-length vectors.
+
+    Arguments:
+        qa: QA_LSTM object with the trained model loaded by load_model
+        store_dir: str - output directory
+        batch_size: int - number of answers encoded per forward pass
+    """
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    docids = np.array(sorted(registry.docid_to_tokenized_text.keys()), dtype=np.int64)
+    # Write directly into the memory-mapped output file
+    vectors = np.lib.format.open_memmap(os.path.join(store_dir, 'vectors.npy'), mode='w+',
+                                        dtype=np.float32, shape=(len(docids), 2*qa.model.hidden_size))
+
+    qa.model.eval()
+    for start in tqdm(range(0, len(docids), batch_size)):
+        batch_docids = docids[start:start+batch_size]
+        a_vecs = torch.tensor([qa.vectorize(registry.docid_to_tokenized_text[docid]) \
+                               for docid in batch_docids]).to(qa.device)
+        with torch.no_grad():
+            a_output = qa.model.encode(a_vecs).cpu().numpy()
+        vectors[start:start+len(batch_docids)] = normalize(a_output)
+
+    vectors.flush()
+    np.save(os.path.join(store_dir, 'docids.npy'), docids)
+
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump({'max_seq_len': qa.max_seq_len,
+                   'num_answers': len(docids),
+                   'dim': vectors.shape[1],
+                   'model': model_fingerprint(qa.model_path)}, f)
+
+def main():
+    # Imported here so the store can be opened without the QA-LSTM model
+    from qa_lstm import QA_LSTM
+
+    parser = argparse.ArgumentParser()
+
+    # Optional arguments
+    parser.add_argument("--use_trained_model", default=False, \
+                        action="store_true", \
+                        help="Use the already trained QA-LSTM model.")
+    parser.add_argument("--model_path", default=None, type=str, required=False,
+    help="Specify model path if use_trained_model is not used")
+    parser.add_argument("--device", default='gpu', type=str, required=False,
+    help="Specify 'gpu' or 'cpu'")
+    parser.add_argument("--max_seq_len", default=512, type=int, required=False,
+    help="Maximum sequence length the answers are padded or truncated to.")
+    parser.add_argument("--emb_dim", default=100, type=int, required=False,
+    help="Embedding dimension.")
+    parser.add_argument("--hidden_size", default=256, type=int, required=False,
+    help="Hidden size.")
+    parser.add_argument("--batch_size", default=256, type=int, required=False,
+    help="Number of answers encoded per forward pass.")
+    parser.add_argument("--output_dir", default=default_store_dir, type=str, required=False,
+    help="The output directory where the vector store will be saved.")
+
+    args = parser.parse_args()
+
+    config = {'train_set': path + '/data/data_pickle/train_set_50.pickle',
+              'valid_set': path + '/data/data_pickle/valid_set_50.pickle',
+              'test_set': path + '/data/data_pickle/test_set_50.pickle',
+              'use_trained_model': args.use_trained_model,
+              'model_path': args.model_path,
+              'device': args.device,
+              'max_seq_len': args.max_seq_len,
+              'emb_dim': args.emb_dim,
+              'hidden_size': args.hidden_size,
+              'dropout': 0.0}
+
+    qa = QA_LSTM(config)
+    qa.load_model()
+
+    print("\nEncoding {} answers...\n".format(len(registry.docid_to_tokenized_text)))
+    build_vector_store(qa, args.output_dir, args.batch_size)
+
+    print("Done. The vector store is saved in {}".format(args.output_dir))
+
+if __name__ == "__main__":
+    main()
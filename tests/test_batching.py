@@ -0,0 +1,89 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from batching import *
+
+def test_pad_encoded_strips_tokenizer_padding():
+    # Pairs padded to max_seq_len by the tokenizer
+    encoded_seqs = [{'input_ids': [101, 5, 102, 6, 102, 0, 0, 0],
+                     'token_type_ids': [0, 0, 0, 1, 1, 0, 0, 0],
+                     'attention_mask': [1, 1, 1, 1, 1, 0, 0, 0]},
+                    {'input_ids': [101, 5, 102, 6, 7, 8, 102, 0],
+                     'token_type_ids': [0, 0, 0, 1, 1, 1, 1, 0],
+                     'attention_mask': [1, 1, 1, 1, 1, 1, 1, 0]}]
+
+    input_ids, token_type_ids, att_masks = pad_encoded(encoded_seqs)
+
+    assert input_ids == [[101, 5, 102, 6, 102, 0, 0], [101, 5, 102, 6, 7, 8, 102]]
+    assert token_type_ids == [[0, 0, 0, 1, 1, 0, 0], [0, 0, 0, 1, 1, 1, 1]]
+    assert att_masks == [[1, 1, 1, 1, 1, 0, 0], [1, 1, 1, 1, 1, 1, 1]]
+
+    # Padding back to max_seq_len gives the tokenizer output
+    input_ids, token_type_ids, att_masks = pad_encoded(encoded_seqs, pad_len=8)
+
+    assert input_ids == [seq['input_ids'] for seq in encoded_seqs]
+    assert token_type_ids == [seq['token_type_ids'] for seq in encoded_seqs]
+    assert att_masks == [seq['attention_mask'] for seq in encoded_seqs]
+
+def test_padding_stats_counts_real_tokens():
+    encoded_seqs = [{'input_ids': [101, 102, 0, 0],
+                     'token_type_ids': [0, 0, 0, 0],
+                     'attention_mask': [1, 1, 0, 0]}]
+    input_ids, token_type_ids, att_masks = pad_encoded(encoded_seqs, pad_len=4)
+    stats = PaddingStats()
+    stats.update([sum(mask) for mask in att_masks], len(input_ids[0]))
+
+    assert stats.waste_ratio() == 0.5
+
+@pytest.mark.parametrize('dynamic_padding', [False, True])
+def test_score_batch_matches_padded_encode_plus(tmp_path, dynamic_padding):
+    transformers = pytest.importorskip('transformers')
+    torch = pytest.importorskip('torch')
+    from finbert_qa import FinBERT_QA
+
+    words = ['what', 'is', 'a', 'bond', 'stock', 'an', 'asset', 'that', 'pays', 'interest']
+    vocab_file = tmp_path / 'vocab.txt'
+    vocab_file.write_text('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words))
+    tokenizer = transformers.BertTokenizer(str(vocab_file), do_lower_case=True)
+
+    torch.manual_seed(0)
+    model = transformers.BertForSequenceClassification(transformers.BertConfig(
+            vocab_size=len(words) + 5, hidden_size=32, num_hidden_layers=2,
+            num_attention_heads=2, intermediate_size=64, max_position_embeddings=64))
+    model.eval()
+
+    max_seq_len = 16
+    pairs = [('what is a bond', 'a bond pays interest'),
+             ('what is a stock', 'an asset'),
+             ('what is an asset', 'an asset that pays interest is a bond')]
+    encoded_seqs = [tokenizer.encode_plus(q, a, max_length=max_seq_len,
+                                          pad_to_max_length=not dynamic_padding,
+                                          return_token_type_ids=True,
+                                          return_attention_mask=True) for q, a in pairs]
+
+    # Scores of the unbatched baseline, padded to max_seq_len
+    baseline = []
+    for q, a in pairs:
+        seq = tokenizer.encode_plus(q, a, max_length=max_seq_len, pad_to_max_length=True,
+                                    return_token_type_ids=True, return_attention_mask=True)
+        with torch.no_grad():
+            logits = model(torch.tensor([seq['input_ids']]),
+                           token_type_ids=torch.tensor([seq['token_type_ids']]),
+                           attention_mask=torch.tensor([seq['attention_mask']]))[0]
+        baseline.append(torch.softmax(logits, dim=1)[0, 1].item())
+
+    qa = FinBERT_QA.__new__(FinBERT_QA)
+    qa.tokenizer = tokenizer
+    qa.device = torch.device('cpu')
+    qa.max_seq_len = max_seq_len
+    qa.dynamic_padding = dynamic_padding
+    qa.padding_stats = PaddingStats()
+
+    scores = qa.score_batch(model, encoded_seqs)
+
+    assert scores == pytest.approx(baseline, abs=1e-5)
+    assert qa.padding_stats.num_tokens == sum(sum(seq['attention_mask']) for seq in encoded_seqs)